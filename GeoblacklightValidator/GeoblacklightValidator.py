@@ -1,29 +1,19 @@
-import os, json, csv, requests, argparse
+import os, json, csv, argparse, hashlib, locale, time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from linkChecker import checkLinks
+from validationRules import compileSchema, fieldValue, runRules, validValues, ruleNames, checkRuleNames, addTimings, \
+    printTimings
+
+# orjson PARSES RECORDS SEVERAL TIMES FASTER THAN json WHEN IT'S INSTALLED. IT'S OPTIONAL
+try:
+    import orjson
+except ImportError:
+    orjson = None
 """
 import warnings
 warnings.filterwarnings("ignore")"""
 
-parser = argparse.ArgumentParser(description="Search through a given directory for all json files named"
-                                             " geoblacklight.json and validate their contents against the schema.")
-parser.add_argument("-d", "--directory", type=str, help="Location of the directory to crawl", required=True)
-
-args = parser.parse_args()
-reposdir = args.directory
-if not os.path.exists(reposdir):
-    print("Invalid directory given. Exiting")
-    exit()
-
-repos = {}
-givendir = os.path.basename(reposdir)
-if givendir.startswith("edu."):
-    repos[givendir] = reposdir
-else:
-    for dir in os.listdir(reposdir):
-        if dir.startswith("edu."):
-            dirpath = os.path.join(reposdir,dir)
-            if os.path.isdir(dirpath):
-                repos[dir] = dirpath
-
 gblschema = [
         "layer_slug_s",
         "dc_identifier_s",
@@ -50,139 +40,289 @@ gblschema = [
         "geoblacklight_version",
         ]
 
-def checkURL(url):
-    #print(url)
-    request = requests.get(url, verify=False)
+# gblschema AS SET LOOKUPS AND TYPED FIELD SPECS, FOR THE RULES OF validationRules.py
+schema = compileSchema(gblschema)
+
+reportColumns = ["File Path", "Title", "Parseable", "Missing Keys", "Invalid Keys", "Failed URLs", "Publisher Issue",
+                 "Creator Issue", "Access Issue", "Date Issue"]
+
+# RECORDS HANDED TO A WORKER PROCESS AT A TIME
+chunkSize = 64
+
+# RESULTS OF THE LAST RUN, BY RECORD, SO ONLY NEW OR CHANGED RECORDS ARE VALIDATED AGAIN (SEE validateRepositories).
+#  BUMP manifestVersion WHEN THE CHECKS CHANGE SO EVERY RECORD IS VALIDATED AGAIN
+manifestName = "geoblacklight_validation_manifest.json"
+manifestVersion = 1
+
+def readRecord(f):
+    # THE WHOLE FILE AS BYTES, READ ONCE FOR PARSING, DIAGNOSTICS AND THE DIGEST
+    with open(f, "rb") as jf:
+        return jf.read()
+
+
+def parseJSON(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson ONLY READS UTF-8 WITHOUT A BOM. LET json HAVE A GO AT ANYTHING ELSE
+            pass
+    # json DETECTS UTF-8 (WITH OR WITHOUT BOM), UTF-16 AND UTF-32 FROM THE BYTES
+    return json.loads(data)
+
+
+def checkJSON(f, data=None):
+    """Returns the parsed record f, or False if it can't be parsed. data are the bytes of f if they were already
+    read. The bytes are parsed as Unicode first, then decoded with the platform's default encoding (e.g. cp1252 on
+    Windows), the same encodings as before, without reading the file again."""
+    if data is None:
+        data = readRecord(f)
     try:
-        response = request.status_code
-        if response == 200:
-            return True
-        else:
-            return False
-    except:
-        return False
-
-def checkJSON(f):
-    enc = 'utf-8'
+        return parseJSON(data)
+    except ValueError:
+        pass
     try:
+        return json.loads(data.decode(locale.getpreferredencoding(False)))
+    except ValueError:
+        # UnicodeDecodeError IS A ValueError TOO
+        pass
+
+    text = data.decode("utf-8", errors="replace")
+    title = text.split("layer_slug_s")[1].split(",")[0] if "layer_slug_s" in text else "(no layer_slug_s)"
+    print("UNABLE TO PARSE JSON FILE", title, "at", f)
+    return False
+
 
-        with open(f) as jf:
-            jdict = json.load(jf)
-            return(jdict)
-    except:
-        with open(f, 'r', encoding=enc) as jf:
+def findRepositories(reposdir):
+    # {REPOSITORY NAME: PATH} OF THE edu.* REPOSITORIES IN reposdir, OR OF reposdir ITSELF IF IT IS ONE
+    repos = {}
+    givendir = os.path.basename(os.path.normpath(reposdir))
+    if givendir.startswith("edu."):
+        repos[givendir] = reposdir
+    else:
+        for dir in sorted(os.listdir(reposdir)):
+            if dir.startswith("edu."):
+                dirpath = os.path.join(reposdir,dir)
+                if os.path.isdir(dirpath):
+                    repos[dir] = dirpath
+    return repos
+
+
+def findRecords(directory):
+    # EVERY geoblacklight.json UNDER directory, SORTED SO REPORTS ARE IN THE SAME ORDER ON EVERY RUN AND PLATFORM
+    records = []
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file == "geoblacklight.json":
+                records.append(os.path.join(root,file))
+    return sorted(records)
+
+
+def validateFile(fpath, reposdir, checklinks=False, data=None, rules=None, timings=None):
+    """Parses and checks one geoblacklight.json with the rules of validationRules.py (those named in rules, all if
+    it's None). Returns (report row (see reportColumns), whether the record has a problem, urls). urls are the
+    dct_references_s links to check if checklinks is set and the record isn't restricted. They're checked for all
+    records at once (see validateRepositories) and the failures filled into the row. data are the bytes of the file
+    if they were already read. The time spent parsing and in each rule is added to timings if given.
+
+    Only depends on the file, so records can be checked by any number of worker processes."""
+    parseable = "True"
+    title = ""
+    urls = []
+
+    start = time.perf_counter()
+    json_dict = checkJSON(fpath, data)
+    if timings is not None:
+        addTimings(timings, {"(parse)": [1, time.perf_counter() - start]})
+
+    if not json_dict:
+        parseable = "False"
+        problem = True
+        values = validValues()
+    else:
+        values, problem = runRules(json_dict, schema, enabled=rules, timings=timings)
+
+        title = fieldValue(json_dict, schema, "dc_title_s")
+        access = fieldValue(json_dict, schema, "dc_rights_s")
+        if checklinks and str(access).lower() != "restricted":
             try:
-                jdict = json.load(jf)
-                return(jdict)
-            except:
-                data = jf.read()
-                title = data.split("layer_slug_s")[1].split(",")[0]
-                print("UNABLE TO PARSE JSON FILE", title, "at", f)
-                return False
-
-
-
-for repo, directory in repos.items():
-    print("STARTING", repo, "REPOSITORY")
-    csvpath = reposdir + "/" + repo + ".csv"
-
-    filecount = 0
-    invalidcount = 0
-
-    # OPEN CSV OF REPO EVALUATION FOR WRITING
-    with open(csvpath, 'w', newline='', encoding='utf8') as outfile:
-        wr = csv.writer(outfile, quoting=csv.QUOTE_ALL)
-
-        wr.writerow(
-            ["File Path", "Title", "Parseable", "Missing Keys", "Invalid Keys", "Failed URLs", "Publisher Issue", "Creator Issue",
-             "Access Issue", "Date Issue"])
-
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file == "geoblacklight.json":
-                    filecount += 1
-                    fileinfo = []
-                    problem = False
-                    parseable = "True"
-                    fpath = os.path.join(root,file)
-                    json_dict = checkJSON(fpath)
-                    if not json_dict:
-                        parseable = "False"
-                        problem = True
-                    else:
-                        # CHECK TO SEE IF THERE ARE ANY KEYS IN THE FILE NOT IN THE DICTIONARY gblschema
-                        missingkeys = []
-                        for key in gblschema:
-                            if key not in json_dict:
-                                missingkeys.append(key)
-                                problem = True
-
-                        unknownkeys = []
-                        for key in json_dict.keys():
-                            if key not in gblschema:
-                                unknownkeys.append(key)
-                                problem = True
-
-                        try:
-                            title = json_dict["dc_title_s"]
-                            references = json.loads(json_dict["dct_references_s"])
-                            publisher = json_dict["dc_publisher_s"]
-                            date = json_dict["solr_year_i"]
-                            creators = json_dict["dc_creator_sm"]
-                            access = json_dict["dc_rights_s"]
-                        except KeyError:
-                            pass
-
-                        pubissue = dateissue = creatorissue = accessissue = "Valid"
-
-                        urlfails = []
-                        if json_dict["dc_rights_s"].lower() != "restricted":
-                            for k,v in references.items():
-                                continue # Remove this line to see if each url exists. May cause port overload
-                                if checkURL(v):
-                                    urlfails.append(v)
-
-                        try:
-                            date = int(date)
-                        except:
-                            dateissue = "Invalid date: " + date
-
-                        if access.lower() != "public" and access.lower() != "restricted":
-                            accessissue = "Invalid Value: " + access
-
-                        illegalchars = ["?"]
-
-                        for char in illegalchars:
-                            if char in publisher:
-                                pubissue = "Illegal Char: " + char
-                            if len(publisher) == 1:
-                                pubissue = "Empty"
-                            for value in creators:
-                                if char in value:
-                                    creatorissue = "Illegal Char " + char
-                            if len(creators) < 1:
-                                creatorissue = "Empty"
-
-                    if pubissue != "Valid" or dateissue != "Valid" or creatorissue != "Valid" or accessissue != "Valid":
-                        problem = True
-
-                    if problem == True:
-                        invalidcount += 1
-                        fileinfo.append(fpath[len(reposdir):])
-                        title = title
-                        fileinfo.append(title)
-                        fileinfo.append(parseable)
-                        fileinfo.append(missingkeys)
-                        fileinfo.append(unknownkeys)
-                        fileinfo.append(urlfails)
-                        fileinfo.append(pubissue)
-                        fileinfo.append(creatorissue)
-                        fileinfo.append(accessissue)
-                        fileinfo.append(dateissue)
-                        #print(fileinfo)
-                        wr.writerow(fileinfo)
-
-
-    print("FINISHED", repo)
-    print("\tNUMBER OF RECORDS:", filecount)
-    print("\tINVALID RECORDS:", invalidcount)
\ No newline at end of file
+                urls = list(json.loads(fieldValue(json_dict, schema, "dct_references_s") or "{}").values())
+            except (TypeError, ValueError, AttributeError):
+                urls = []
+
+    return [fpath[len(reposdir):], title, parseable] + [values[column] if column in values else []
+                                                         for column in reportColumns[3:]], problem, urls
+
+
+def validateChangedFile(fpath, digest, reposdir, checklinks=False, rules=None):
+    """Returns (digest, validateFile result, timings) of a record whose modified time or size changed. If its
+    content is unchanged (digest is the one of the last run, e.g. the file was only touched by a checkout) it isn't
+    validated again and the result is None."""
+    timings = {}
+    start = time.perf_counter()
+    data = readRecord(fpath)
+    current = hashlib.sha256(data).hexdigest()
+    addTimings(timings, {"(read)": [1, time.perf_counter() - start]})
+    if digest is not None and current == digest:
+        return current, None, timings
+    return current, validateFile(fpath, reposdir, checklinks, data, rules, timings), timings
+
+
+def loadManifest(manifest_path, checklinks, rules):
+    # {RECORD PATH: {"mtime", "size", "digest", "result"}} OF THE LAST RUN, EMPTY IF IT CAN'T BE USED
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf8") as mf:
+            manifest = json.load(mf)
+    except ValueError:
+        print("WARNING: Unreadable manifest {}. Validating every record.".format(manifest_path))
+        return {}
+    # LINKS ARE ONLY COLLECTED WHEN THEY'RE CHECKED, SO RESULTS OF A RUN WITH ANOTHER SETTING CAN'T BE REUSED. NOR
+    #  CAN RESULTS OF ANOTHER SET OF RULES
+    if manifest.get("version") != manifestVersion or manifest.get("checklinks") != checklinks or \
+            manifest.get("rules") != rules:
+        return {}
+    return manifest.get("records", {})
+
+
+def saveManifest(manifest_path, records, checklinks, rules):
+    tmpfile = manifest_path + ".tmp"
+    with open(tmpfile, "w", encoding="utf8") as mf:
+        json.dump({"version": manifestVersion, "checklinks": checklinks, "rules": rules, "records": records}, mf)
+    os.replace(tmpfile, manifest_path)
+
+
+def validateRepositories(reposdir, processes=None, checklinks=False, concurrency=None, host_concurrency=None,
+                         full=False, rules=None, timing=False):
+    """Validates every geoblacklight.json of every repository in reposdir, writing the problem records of each
+    repository to <reposdir>/<repository>.csv. Records are checked by a pool of processes (os.cpu_count() by
+    default, 1 checks them in this process). Reports are written in the order the records are found, regardless
+    of which worker finished first.
+
+    Results are kept in a manifest in reposdir (manifestName) with the modified time, size and digest of each
+    record. Unless full is set, records whose time and size (or digest) are unchanged since the last run aren't
+    validated again, their earlier findings are reported as they were, and deleted records are dropped.
+
+    With checklinks the reference URLs of all records are checked once validation is done, each distinct URL once
+    (see linkChecker.py), with at most concurrency requests at once and host_concurrency per host.
+
+    rules are the names of the rules of validationRules.py to run (all if None). With timing the time spent
+    reading, parsing and in each rule, over all records validated, is printed."""
+    repos = findRepositories(reposdir)
+    records = {repo: findRecords(directory) for repo, directory in repos.items()}
+    workers = processes if processes else os.cpu_count()
+    rules = checkRuleNames(rules) if rules is not None else ruleNames()
+    validate = partial(validateChangedFile, reposdir=reposdir, checklinks=checklinks, rules=rules)
+
+    manifest_path = os.path.join(reposdir, manifestName)
+    previous = {} if full else loadManifest(manifest_path, checklinks, rules)
+    manifest = {}
+
+    # RECORDS TO VALIDATE, WITH THE DIGEST OF THEIR LAST RUN IF THEY HAD ONE
+    changed = []
+    signatures = {}
+    for repo, paths in records.items():
+        for fpath in paths:
+            rel = fpath[len(reposdir):]
+            st = os.stat(fpath)
+            signatures[rel] = (st.st_mtime, st.st_size)
+            entry = previous.get(rel)
+            if entry is not None and (entry["mtime"], entry["size"]) == signatures[rel]:
+                manifest[rel] = entry
+            else:
+                changed.append((fpath, entry["digest"] if entry is not None else None))
+
+    total = len(signatures)
+    print("{} records: {} unchanged, {} new or changed, {} removed since the last run".format(
+        total, total - len(changed), len(changed), len(set(previous) - set(signatures))))
+
+    if workers == 1 or len(changed) <= chunkSize:
+        validated = [validate(fpath, digest) for fpath, digest in changed]
+    else:
+        print("Validating {} records with {} worker processes".format(len(changed), workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map YIELDS IN SUBMISSION ORDER, WHICHEVER WORKER FINISHES FIRST
+            validated = list(executor.map(validate, [c[0] for c in changed], [c[1] for c in changed],
+                                          chunksize=chunkSize))
+
+    timings = {}
+    for (fpath, digest), (current, result, record_timings) in zip(changed, validated):
+        addTimings(timings, record_timings)
+        rel = fpath[len(reposdir):]
+        if result is None:
+            # SAME CONTENT AS LAST RUN
+            result = previous[rel]["result"]
+        mtime, size = signatures[rel]
+        manifest[rel] = {"mtime": mtime, "size": size, "digest": current, "result": result}
+
+    saveManifest(manifest_path, manifest, checklinks, rules)
+    if timing:
+        printTimings(timings)
+
+    links = {}
+    if checklinks:
+        links = checkLinks([url for entry in manifest.values() for url in entry["result"][2]],
+                           concurrency=concurrency, host_concurrency=host_concurrency)
+
+    for repo, paths in records.items():
+        print("STARTING", repo, "REPOSITORY")
+        csvpath = reposdir + "/" + repo + ".csv"
+        invalidcount = 0
+
+        # OPEN CSV OF REPO EVALUATION FOR WRITING
+        with open(csvpath, 'w', newline='', encoding='utf8') as outfile:
+            wr = csv.writer(outfile, quoting=csv.QUOTE_ALL)
+            wr.writerow(reportColumns)
+            for fpath in paths:
+                fileinfo, problem, urls = manifest[fpath[len(reposdir):]]["result"]
+                # URLS THAT AREN'T http(s) AREN'T CHECKED
+                urlfails = fileinfo[5] + [url for url in urls if url in links and not links[url][0]]
+                if problem or urlfails:
+                    invalidcount += 1
+                    wr.writerow(fileinfo[:5] + [urlfails] + fileinfo[6:])
+
+        print("FINISHED", repo)
+        print("\tNUMBER OF RECORDS:", len(paths))
+        print("\tINVALID RECORDS:", invalidcount)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search through a given directory for all json files named"
+                                                 " geoblacklight.json and validate their contents against the schema.")
+    parser.add_argument("-d", "--directory", type=str, help="Location of the directory to crawl", required=True)
+    parser.add_argument("-p", "--processes", type=int,
+                        help="Number of worker processes validating records in parallel. Defaults to the number of"
+                             " CPUs. 1 validates them one after the other")
+    parser.add_argument("-l", "--checklinks", action="store_true",
+                        help="Check that the dct_references_s URLs of every record that isn't restricted respond."
+                             " Results are cached between runs")
+    parser.add_argument("--concurrency", type=int,
+                        help="Maximum number of URLs checked at once. Defaults to 32")
+    parser.add_argument("--hostconcurrency", type=int,
+                        help="Maximum number of URLs of one host checked at once. Defaults to 4")
+    parser.add_argument("-r", "--rules", type=str,
+                        help="Comma separated names of the checks to run. Defaults to all of them: " +
+                             ", ".join(ruleNames()))
+    parser.add_argument("-t", "--timing", action="store_true",
+                        help="Print the time spent reading, parsing and in each check")
+    parser.add_argument("-f", "--full", action="store_true",
+                        help="Validate every record, not only those that are new or changed since the last run")
+
+    args = parser.parse_args()
+    reposdir = args.directory
+    if not os.path.exists(reposdir):
+        print("Invalid directory given. Exiting")
+        exit()
+
+    rules = None
+    if args.rules:
+        try:
+            rules = checkRuleNames(args.rules.replace(" ", "").split(","))
+        except ValueError as e:
+            print(e)
+            exit()
+
+    validateRepositories(reposdir, processes=args.processes, checklinks=args.checklinks,
+                         concurrency=args.concurrency, host_concurrency=args.hostconcurrency, full=args.full,
+                         rules=rules, timing=args.timing)
@@ -0,0 +1,136 @@
+# CHECKS THAT THE URLS OF dct_references_s RESPOND, FOR A WHOLE CORPUS AT ONCE. URLS ARE DEDUPLICATED ACROSS ALL RECORDS
+#  (MANY RECORDS SHARE ONE WMS/WFS ENDPOINT) AND CHECKED CONCURRENTLY FROM AN asyncio LOOP, WITH A LIMIT ON THE
+#  REQUESTS IN FLIGHT OVERALL AND A LOWER ONE PER HOST SO NO SERVER (OR LOCAL PORT RANGE) IS OVERLOADED. EACH URL IS
+#  CHECKED WITH A HEAD REQUEST, FALLING BACK TO A GET OF ITS FIRST BYTE FOR SERVERS THAT DON'T ANSWER HEAD. THE
+#  REQUESTS THEMSELVES ARE MADE WITH requests IN A POOL OF THREADS, SO NO ASYNC HTTP LIBRARY IS NEEDED.
+#
+# RESULTS ARE KEPT IN A SQLITE CACHE (link_cache.sqlite IN ~/.geoportaltools, OR THE FILE NAMED BY THE
+#  GEOPORTAL_LINK_CACHE ENVIRONMENT VARIABLE). A WORKING URL ISN'T CHECKED AGAIN FOR cacheTTL SECONDS, A FAILED ONE
+#  FOR failureTTL SECONDS.
+
+import asyncio, os, sqlite3, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+import urllib3
+
+# CERTIFICATES AREN'T VERIFIED (MANY INSTITUTIONAL SERVERS HAVE INCOMPLETE CHAINS), SO DON'T WARN FOR EVERY URL
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+linkCacheLocation = os.environ.get("GEOPORTAL_LINK_CACHE",
+                                   os.path.join(os.path.expanduser("~"), ".geoportaltools", "link_cache.sqlite"))
+cacheTTL = 7 * 24 * 3600
+failureTTL = 24 * 3600
+
+maxConcurrency = 32
+maxHostConcurrency = 4
+requestTimeout = 30
+
+# STATUS CODES OF SERVERS THAT DON'T SUPPORT HEAD (OR REFUSE IT) BUT MAY ANSWER A GET
+headUnsupported = (400, 403, 405, 501)
+
+sessions = threading.local()
+
+
+def getSession():
+    # ONE requests.Session PER THREAD, FOR CONNECTION REUSE
+    if not hasattr(sessions, "session"):
+        sessions.session = requests.Session()
+    return sessions.session
+
+
+def checkURL(url, timeout=None, verify=False):
+    """Returns (ok, status) for url: whether it responds with a success (after redirects) and the final HTTP status
+    code, or the name of the error if it couldn't be reached."""
+    if timeout is None:
+        timeout = requestTimeout
+    session = getSession()
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout, verify=verify)
+        if response.status_code in headUnsupported:
+            # ONLY THE FIRST BYTE, AND THE BODY ISN'T DOWNLOADED EVEN IF THE SERVER IGNORES THE RANGE
+            response = session.get(url, headers={"Range": "bytes=0-0"}, allow_redirects=True, timeout=timeout,
+                                   verify=verify, stream=True)
+            response.close()
+    except requests.RequestException as e:
+        return False, type(e).__name__
+    return 200 <= response.status_code < 400, str(response.status_code)
+
+
+async def checkURLsAsync(urls, concurrency=None, host_concurrency=None, timeout=None, verify=False):
+    # {URL: (ok, status)} OF urls, CHECKED AT MOST concurrency AT ONCE AND host_concurrency AT ONCE PER HOST
+    concurrency = concurrency or maxConcurrency
+    host_concurrency = host_concurrency or maxHostConcurrency
+    loop = asyncio.get_running_loop()
+    global_sem = asyncio.Semaphore(concurrency)
+    host_sems = {}
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def check(url):
+            host = urlparse(url).netloc.lower()
+            host_sem = host_sems.setdefault(host, asyncio.Semaphore(host_concurrency))
+            # THE HOST SLOT IS TAKEN FIRST SO URLS WAITING ON A BUSY HOST DON'T HOLD GLOBAL SLOTS
+            async with host_sem:
+                async with global_sem:
+                    results[url] = await loop.run_in_executor(executor, checkURL, url, timeout, verify)
+            if len(results) % 500 == 0:
+                print("\tCHECKED {} OF {} URLS".format(len(results), len(urls)))
+
+        await asyncio.gather(*(check(url) for url in urls))
+    return results
+
+
+def openCache(cache_path):
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    conn = sqlite3.connect(cache_path, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS links (url TEXT PRIMARY KEY, ok INTEGER, status TEXT, checked REAL)")
+    return conn
+
+
+def checkLinks(urls, concurrency=None, host_concurrency=None, timeout=None, cache_path=None, use_cache=True):
+    """Returns {url: (ok, status)} for every distinct url in urls. URLs checked within the cache TTL are answered
+    from the cache, the others are checked concurrently (checkURLsAsync) and stored in it."""
+    if cache_path is None:
+        cache_path = linkCacheLocation
+    urls = sorted(set(u for u in urls if isinstance(u, str) and u.lower().startswith(("http://", "https://"))))
+    now = time.time()
+
+    results = {}
+    conn = None
+    if use_cache:
+        try:
+            conn = openCache(cache_path)
+            # IN BATCHES, UNDER SQLITE'S LIMIT ON QUERY PARAMETERS
+            for i in range(0, len(urls), 500):
+                batch = urls[i:i + 500]
+                query = "SELECT url, ok, status, checked FROM links WHERE url IN ({})".format(",".join("?" * len(batch)))
+                for url, ok, status, checked in conn.execute(query, batch):
+                    if now - checked < (cacheTTL if ok else failureTTL):
+                        results[url] = (bool(ok), status)
+        except (sqlite3.Error, OSError) as e:
+            print("WARNING: Unable to use link cache {} ({}). Checking every URL.".format(cache_path, e))
+            conn = None
+
+    to_check = [u for u in urls if u not in results]
+    print("CHECKING {} URLS ({} DISTINCT, {} CACHED)".format(len(to_check), len(urls), len(results)))
+    if to_check:
+        checked = asyncio.run(checkURLsAsync(to_check, concurrency, host_concurrency, timeout))
+        results.update(checked)
+        if conn is not None:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO links (url, ok, status, checked) VALUES (?, ?, ?, ?)",
+                                 [(url, int(ok), status, now) for url, (ok, status) in checked.items()])
+
+    if conn is not None:
+        conn.close()
+    return results
+
+
+def clearCache(cache_path=None):
+    conn = openCache(cache_path if cache_path is not None else linkCacheLocation)
+    with conn:
+        conn.execute("DELETE FROM links")
+    conn.close()
@@ -0,0 +1,172 @@
+# REGISTRY OF THE CHECKS RUN ON EVERY PARSED geoblacklight.json. EACH CHECK IS A NAMED RULE FILLING ONE COLUMN OF THE
+#  VALIDATOR'S REPORT: A FUNCTION OF THE RECORD AND THE COMPILED SCHEMA RETURNING THE VALUE OF ITS COLUMN, WHICH IS
+#  THE RULE'S valid VALUE WHEN THE RECORD PASSES. A NEW CHECK IS ADDED WITH THE @rule DECORATOR.
+#
+# RULES CAN BE ENABLED PER RUN (runRules(..., enabled=[names])), A DISABLED RULE REPORTS ITS valid VALUE, AND THE TIME
+#  SPENT IN EACH RULE IS ADDED UP SO SLOW RULES SHOW ON LARGE CORPORA (printTimings). RULES CHECK THE TYPE OF THE
+#  VALUES THEY READ (A FIELD MAY BE null OR OF THE WRONG TYPE), AND A RULE THAT STILL RAISES AN EXCEPTION REPORTS IT IN
+#  ITS COLUMN INSTEAD OF STOPPING THE RUN.
+
+import time
+from collections import OrderedDict, namedtuple
+
+# kind IS THE TYPE OF A SINGLE VALUE ("string", "integer", "date", "boolean"), multivalued FOR *_sm/*_im FIELDS
+FieldSpec = namedtuple("FieldSpec", ["name", "kind", "multivalued"])
+Schema = namedtuple("Schema", ["required", "known", "specs"])
+Rule = namedtuple("Rule", ["name", "column", "valid", "func"])
+
+# SOLR DYNAMIC FIELD SUFFIXES OF THE GEOBLACKLIGHT SCHEMA
+fieldSuffixes = OrderedDict([("_sm", ("string", True)), ("_im", ("integer", True)), ("_s", ("string", False)),
+                             ("_i", ("integer", False)), ("_dt", ("date", False)), ("_b", ("boolean", False))])
+
+illegalChars = ["?"]
+
+rules = OrderedDict()
+
+
+def compileSchema(fields):
+    """Compiles the list of schema field names into a Schema: the required fields in order, a set of the known
+    fields for constant time lookups and a FieldSpec for each field, typed from its suffix (string if it has
+    none, e.g. solr_geom)."""
+    specs = {}
+    for name in fields:
+        kind, multivalued = "string", False
+        for suffix, spec in fieldSuffixes.items():
+            if name.endswith(suffix):
+                kind, multivalued = spec
+                break
+        specs[name] = FieldSpec(name, kind, multivalued)
+    return Schema(tuple(fields), frozenset(fields), specs)
+
+
+def fieldValue(record, schema, name):
+    # VALUE OF name IN record, OR AN EMPTY VALUE OF ITS TYPE IF IT'S MISSING (MISSING KEYS ARE A RULE OF THEIR OWN)
+    if name in record:
+        return record[name]
+    spec = schema.specs.get(name)
+    return [] if spec is not None and spec.multivalued else ""
+
+
+def rule(name, column, valid="Valid"):
+    # REGISTERS THE DECORATED func(record, schema) AS RULE name, FILLING REPORT COLUMN column
+    def register(func):
+        rules[name] = Rule(name, column, valid, func)
+        return func
+    return register
+
+
+def ruleNames():
+    return list(rules)
+
+
+def checkRuleNames(names):
+    unknown = [n for n in names if n not in rules]
+    if unknown:
+        raise ValueError("Unknown rule(s) {}. Rules are {}".format(", ".join(unknown), ", ".join(rules)))
+    return list(names)
+
+
+def validValues():
+    # {COLUMN: VALUE} OF A RECORD THAT PASSES EVERY RULE
+    return {r.column: (list(r.valid) if isinstance(r.valid, list) else r.valid) for r in rules.values()}
+
+
+def runRules(record, schema, enabled=None, timings=None):
+    """Runs the enabled rules (all if enabled is None) on record. Returns ({column: value}, whether any rule found
+    a problem). The time of each rule is added to timings ({rule name: [records, seconds]}) if given."""
+    values = validValues()
+    problem = False
+    for r in rules.values():
+        if enabled is not None and r.name not in enabled:
+            continue
+        start = time.perf_counter()
+        try:
+            value = r.func(record, schema)
+        except Exception as e:
+            value = "Rule error: {}: {}".format(type(e).__name__, e)
+        if timings is not None:
+            timing = timings.setdefault(r.name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += time.perf_counter() - start
+        values[r.column] = value
+        if value != r.valid:
+            problem = True
+    return values, problem
+
+
+def addTimings(total, timings):
+    for name, (count, seconds) in timings.items():
+        timing = total.setdefault(name, [0, 0.0])
+        timing[0] += count
+        timing[1] += seconds
+
+
+def printTimings(timings):
+    total = sum(seconds for count, seconds in timings.values())
+    if not total:
+        return
+    print("{:<16} {:>9} {:>10} {:>12} {:>7}".format("RULE", "RECORDS", "SECONDS", "US/RECORD", "SHARE"))
+    for name, (count, seconds) in sorted(timings.items(), key=lambda t: -t[1][1]):
+        print("{:<16} {:>9} {:>10.3f} {:>12.1f} {:>6.1f}%".format(name, count, seconds, 1e6 * seconds / max(count, 1),
+                                                                  100 * seconds / total))
+
+
+@rule("missing_keys", "Missing Keys", valid=[])
+def missingKeys(record, schema):
+    # SCHEMA FIELDS NOT IN THE RECORD
+    return [key for key in schema.required if key not in record]
+
+
+@rule("unknown_keys", "Invalid Keys", valid=[])
+def unknownKeys(record, schema):
+    # RECORD FIELDS NOT IN THE SCHEMA (MISSPELLINGS, BUT ALSO CUSTOM FIELDS)
+    return [key for key in record if key not in schema.known]
+
+
+@rule("publisher", "Publisher Issue")
+def publisherIssue(record, schema):
+    publisher = fieldValue(record, schema, "dc_publisher_s")
+    if not isinstance(publisher, str):
+        return "Invalid Value: " + str(publisher)
+    issue = "Valid"
+    for char in illegalChars:
+        if char in publisher:
+            issue = "Illegal Char: " + char
+        if len(publisher) == 1:
+            issue = "Empty"
+    return issue
+
+
+@rule("creator", "Creator Issue")
+def creatorIssue(record, schema):
+    creators = fieldValue(record, schema, "dc_creator_sm")
+    if not isinstance(creators, list) or not all(isinstance(value, str) for value in creators):
+        return "Invalid Value: " + str(creators)
+    issue = "Valid"
+    for char in illegalChars:
+        for value in creators:
+            if char in value:
+                issue = "Illegal Char " + char
+        if len(creators) < 1:
+            issue = "Empty"
+    return issue
+
+
+@rule("access", "Access Issue")
+def accessIssue(record, schema):
+    access = fieldValue(record, schema, "dc_rights_s")
+    if not isinstance(access, str):
+        return "Invalid Value: " + str(access)
+    if access.lower() != "public" and access.lower() != "restricted":
+        return "Invalid Value: " + access
+    return "Valid"
+
+
+@rule("date", "Date Issue")
+def dateIssue(record, schema):
+    date = fieldValue(record, schema, "solr_year_i")
+    try:
+        int(date)
+    except (TypeError, ValueError):
+        return "Invalid date: " + str(date)
+    return "Valid"
@@ -0,0 +1,212 @@
+# LIGHTWEIGHT PROBING OF GEOSPATIAL DATASETS AND A PERSISTENT CACHE OF WHAT WAS FOUND. SHARED BY CSVtoISO19139 AND
+#  ISO19139toGBLjson SO A DATASET IS ONLY OPENED ONCE ALONG THE INGEST PATH AND NOT AT ALL ON RECONVERSION.
+#
+# THE CACHE IS A SQLITE DATABASE (dataset_cache.sqlite IN ~/.geoportaltools, OR THE FILE NAMED BY THE
+#  GEOPORTAL_DATASET_CACHE ENVIRONMENT VARIABLE). ENTRIES ARE KEYED BY THE ABSOLUTE DATASET PATH AND ARE ONLY VALID FOR
+#  THE SIZE AND MODIFIED TIME THE DATASET HAD WHEN THEY WERE STORED (INCLUDING A SHAPEFILE'S SIDECARS AND EVERY TILE
+#  OF AN IMAGE PYRAMID, SEE getFileSignature), SO A CHANGED DATASET IS PROBED AGAIN. WHEN THE CACHE HOLDS MORE THAN
+#  maxCacheEntries DATASETS THE LEAST RECENTLY USED ONES ARE EVICTED.
+#
+# FACTS STORED PER DATASET (WHICHEVER HAVE BEEN COMPUTED)
+#   geom_type       OGR geometry name of a vector layer, e.g. POLYGON, MULTILINESTRING
+#   feature_count   number of features of a vector layer
+#   crs             WKT of the dataset's coordinate reference system
+#   epsg            EPSG code of the crs, as a string
+#   raster_size     [columns, rows, bands] of a raster
+#   extent_wgs84    {"xmin", "xmax", "ymin", "ymax"} bounding box in WGS84
+
+import json, os, sqlite3, time
+from osgeo import ogr, osr, gdal
+
+cacheLocation = os.environ.get("GEOPORTAL_DATASET_CACHE",
+                               os.path.join(os.path.expanduser("~"), ".geoportaltools", "dataset_cache.sqlite"))
+maxCacheEntries = 50000
+
+vectorExtensions = (".shp", ".gpkg")
+# FILES OF A SHAPEFILE THAT THE PROBED FACTS DEPEND ON (CRS, ATTRIBUTES, FEATURE COUNT)
+shapefileSidecars = (".shx", ".dbf", ".prj", ".cpg")
+
+
+def getSRSFacts(srs):
+    # WKT AND EPSG CODE OF AN osr.SpatialReference (None, None IF THERE ISN'T ONE)
+    if srs is None:
+        return None, None
+    crs = srs.ExportToWkt()
+    # AutoIdentifyEPSG CHANGES THE SRS, WHICH MAY BE THE ONE OF AN OPEN LAYER, SO IT WORKS ON A COPY
+    srs = srs.Clone()
+    try:
+        srs.AutoIdentifyEPSG()
+    except RuntimeError:
+        pass
+    return crs, srs.GetAuthorityCode(None)
+
+
+def probeVectorDataset(datafile):
+    """Reads the geometry type, CRS and feature count of the first layer of a vector dataset (shp or gpkg) from the
+    layer header with OGR, without loading the features. Only if the layer doesn't declare a geometry type (e.g. a
+    GeoPackage layer of generic GEOMETRY) is the first feature read. Memory use doesn't depend on the dataset size."""
+    ds = ogr.Open(datafile)
+    if ds is None:
+        print("ERROR: Unable to open vector dataset {}".format(datafile))
+        raise ValueError
+    return probeVectorLayer(ds.GetLayer())
+
+
+def probeVectorLayer(layer):
+    # SAME AS probeVectorDataset FOR AN ALREADY OPEN ogr.Layer
+    ogr_geom_type = layer.GetGeomType()
+    if ogr_geom_type != ogr.wkbUnknown:
+        # SAME NAMES AS Geometry.GetGeometryName(), E.G. "POLYGON", "MULTILINESTRING"
+        geom_type = ogr.GeometryTypeToName(ogr.GT_Flatten(ogr_geom_type)).upper().replace(" ", "")
+    else:
+        feature = layer.GetNextFeature()
+        geometry = feature.GetGeometryRef() if feature is not None else None
+        geom_type = geometry.GetGeometryName() if geometry is not None else "UNKNOWN"
+
+    crs, epsg = getSRSFacts(layer.GetSpatialRef())
+
+    # SHAPEFILE AND GEOPACKAGE STORE THE FEATURE COUNT, SO THIS DOESN'T ITERATE THE FEATURES
+    feature_count = layer.GetFeatureCount()
+
+    return {"geom_type": geom_type, "crs": crs, "epsg": epsg, "feature_count": feature_count}
+
+
+def probeRasterDataset(datafile):
+    """Reads the CRS and size of a raster from its header with GDAL."""
+    ds = gdal.Open(datafile)
+    if ds is None:
+        print("ERROR: Unable to open raster dataset {}".format(datafile))
+        raise ValueError
+    return probeRasterDataSource(ds)
+
+
+def probeRasterDataSource(ds):
+    # SAME AS probeRasterDataset FOR AN ALREADY OPEN gdal.Dataset
+    srs = None
+    if ds.GetProjection():
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(ds.GetProjection())
+    crs, epsg = getSRSFacts(srs)
+
+    return {"crs": crs, "epsg": epsg, "raster_size": [ds.RasterXSize, ds.RasterYSize, ds.RasterCount]}
+
+
+def probeDataset(datafile):
+    if datafile.lower().endswith(vectorExtensions):
+        return probeVectorDataset(datafile)
+    return probeRasterDataset(datafile)
+
+
+def openCache(cache_path):
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    # SEVERAL PROCESSES MAY USE THE CACHE AT ONCE. WAIT FOR LOCKS RATHER THAN FAILING
+    conn = sqlite3.connect(cache_path, timeout=60)
+    conn.execute("CREATE TABLE IF NOT EXISTS datasets (path TEXT PRIMARY KEY, size INTEGER, mtime REAL,"
+                 " facts TEXT, accessed REAL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS datasets_accessed ON datasets (accessed)")
+    return conn
+
+
+def getFileSignature(path):
+    """Returns the (size, modified time) a cache entry for path is valid for. For a shapefile these cover its sidecars
+    (.prj, .dbf, ...) too. For a directory (image pyramid) the size is the total of every file under it and the time
+    the latest of any file or directory under it, so adding, removing or rewriting a tile anywhere changes it."""
+    st = os.stat(path)
+    if os.path.isdir(path):
+        size, mtime = 0, st.st_mtime
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                st = os.stat(os.path.join(root, name))
+                mtime = max(mtime, st.st_mtime)
+                if name in files:
+                    size += st.st_size
+        return size, mtime
+
+    size, mtime = st.st_size, st.st_mtime
+    base, ext = os.path.splitext(path)
+    if ext.lower() == ".shp":
+        for sidecar in shapefileSidecars:
+            for sidecar_path in (base + sidecar, base + sidecar.upper()):
+                if os.path.isfile(sidecar_path):
+                    st = os.stat(sidecar_path)
+                    size += st.st_size
+                    mtime = max(mtime, st.st_mtime)
+                    break
+    return size, mtime
+
+
+def getCachedFacts(path, names, compute, cache_path=None):
+    """Returns {name: value} for every fact in names. If the cache holds all of them for the current size and
+    modified time of path they're returned from there. Otherwise compute(path) is called, which should return a
+    dictionary holding at least those facts, and the result is merged into the cache entry for path.
+
+    If the cache can't be used (e.g. a read-only home directory) the facts are computed every time."""
+    if cache_path is None:
+        cache_path = cacheLocation
+    path = os.path.abspath(path)
+    size, mtime = getFileSignature(path)
+
+    try:
+        conn = openCache(cache_path)
+    except (sqlite3.Error, OSError) as e:
+        print("WARNING: Unable to open dataset cache {} ({}). Probing without it.".format(cache_path, e))
+        facts = compute(path)
+        return {name: facts[name] for name in names}
+
+    with conn:
+        row = conn.execute("SELECT size, mtime, facts FROM datasets WHERE path = ?", (path,)).fetchone()
+        facts = {}
+        if row is not None and row[0] == size and row[1] == mtime:
+            facts = json.loads(row[2])
+        cached = all(name in facts for name in names)
+        if cached:
+            conn.execute("UPDATE datasets SET accessed = ? WHERE path = ?", (time.time(), path))
+    if cached:
+        conn.close()
+        return {name: facts[name] for name in names}
+
+    # NOT CACHED, OR CACHED FOR AN OLDER VERSION OF THE DATASET
+    facts.update(compute(path))
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO datasets (path, size, mtime, facts, accessed) VALUES (?, ?, ?, ?, ?)",
+                     (path, size, mtime, json.dumps(facts), time.time()))
+        evictEntries(conn)
+    conn.close()
+
+    return {name: facts[name] for name in names}
+
+
+def getDatasetFacts(datafile, cache_path=None):
+    """Probes a vector (probeVectorDataset) or raster (probeRasterDataset) dataset through the cache."""
+    if datafile.lower().endswith(vectorExtensions):
+        names = ["geom_type", "crs", "epsg", "feature_count"]
+    else:
+        names = ["crs", "epsg", "raster_size"]
+    return getCachedFacts(datafile, names, probeDataset, cache_path=cache_path)
+
+
+def evictEntries(conn, max_entries=None):
+    # DROP THE LEAST RECENTLY USED ENTRIES ONCE THE CACHE IS OVER ITS SIZE
+    if max_entries is None:
+        max_entries = maxCacheEntries
+    count = conn.execute("SELECT COUNT(*) FROM datasets").fetchone()[0]
+    if count > max_entries:
+        conn.execute("DELETE FROM datasets WHERE path IN (SELECT path FROM datasets ORDER BY accessed LIMIT ?)",
+                     (count - max_entries,))
+
+
+def invalidateDataset(path, cache_path=None):
+    """Removes the cache entry for a dataset, e.g. after it was modified without changing its size or time."""
+    conn = openCache(cache_path if cache_path is not None else cacheLocation)
+    with conn:
+        conn.execute("DELETE FROM datasets WHERE path = ?", (os.path.abspath(path),))
+    conn.close()
+
+
+def clearCache(cache_path=None):
+    conn = openCache(cache_path if cache_path is not None else cacheLocation)
+    with conn:
+        conn.execute("DELETE FROM datasets")
+    conn.close()
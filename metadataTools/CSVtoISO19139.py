@@ -11,12 +11,37 @@
 #   The new file name (filename) created is derived from the value of the "Title" filed in the csv
 #   PURL values are assigned based on the file name (filename) and PURL prefix (purl_prefix) values
 
-import csv, os, argparse, shutil
+import csv, os, sys, argparse, shutil, copy, tempfile, time, math, importlib.util
 from osgeo import osr, ogr, gdal
 from datetime import datetime
 from lxml import etree as ET
 from xml.dom import minidom as md
-import geopandas as gpd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tileIndex import buildTileIndex
+from datasetStaging import stageDataset, stagingModes
+
+
+def importShared(name):
+    # LOADS A MODULE SHARED BY metadataTools AND solrTools FROM THE ROOT OF THE REPOSITORY WITHOUT ADDING THE ROOT TO
+    #  sys.path. A MODULE ALREADY IMPORTED UNDER THAT NAME (E.G. BY A CALLER WITH THE ROOT ON ITS PATH) IS REUSED
+    if name not in sys.modules:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, name + ".py")
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[name]
+            raise
+    return sys.modules[name]
+
+
+# datasetProbe.py (SHARED WITH solrTools) IS AT THE ROOT OF THE REPOSITORY
+datasetProbe = importShared("datasetProbe")
+getDatasetFacts, getCachedFacts = datasetProbe.getDatasetFacts, datasetProbe.getCachedFacts
+probeVectorLayer, probeRasterDataSource = datasetProbe.probeVectorLayer, datasetProbe.probeRasterDataSource
 
 
 # Distributor Info
@@ -54,6 +79,15 @@ ET.register_namespace("gml", gml)
 ET.register_namespace("gco", gco)
 ET.register_namespace("gts", gts)
 
+# CLARK NOTATION TAG ({namespace}name) OF A PREFIXED NAME, E.G. QN["gmd:title"]. COMPUTED ONCE PER NAME
+class QNames(dict):
+    def __missing__(self, name):
+        prefix, local = name.split(":")
+        self[name] = "{" + namespaces[prefix] + "}" + local
+        return self[name]
+
+QN = QNames()
+
 # PRETTY FORMAT THE XML FILE
 pretty_print = lambda f: '\n'.join([line for line in md.parseString(f).toprettyxml().split('\n') if line.strip()])
 
@@ -114,8 +148,16 @@ dataquality_iso = ["gmd:dataQualityInfo",
                    "gmd:LI_Lineage"]
 
 
-# WRITE THE XML OBJECT TO FILE
+# WRITE THE XML OBJECT TO FILE. THE TREE IS INDENTED IN PLACE WITH TABS AND SERIALIZED ONCE, WHICH GIVES THE SAME BYTES
+#  AS THE minidom ROUND TRIP IN writeToFileMinidom WITHOUT PARSING THE RECORD AGAIN
 def writeToFile(xmlObj, outfile):
+    tree = xmlObj if isinstance(xmlObj, ET._ElementTree) else ET.ElementTree(xmlObj)
+    ET.indent(tree, space="\t")
+    tree.write(outfile, encoding="UTF-8")
+
+# PREVIOUS IMPLEMENTATION OF writeToFile: SERIALIZE, PRETTY PRINT WITH minidom, DROP BLANK LINES AND PARSE AGAIN.
+#  KEPT FOR benchmarkWriteToFile
+def writeToFileMinidom(xmlObj, outfile):
     roughstring = ET.tostring(xmlObj)
     xmlfromstring = ET.fromstring(pretty_print(roughstring))
 
@@ -127,25 +169,40 @@ def writeToFile(xmlObj, outfile):
         os.remove(outfile)
     newTree.write(outfile, encoding="UTF-8")
 
-def copyrenameDataset(infile, outfile):
-    basename = os.path.splitext(os.path.basename(infile))[0]
+def benchmarkWriteToFile(xmlObj, repeat=20):
+    """Times writeToFile against writeToFileMinidom on copies of xmlObj (an ISO record tree) and checks that both
+    write the same bytes."""
+    outdir = tempfile.mkdtemp()
+    timings = {}
+    for func in (writeToFileMinidom, writeToFile):
+        outfile = os.path.join(outdir, func.__name__ + ".xml")
+        elapsed = 0.0
+        for i in range(repeat):
+            record = copy.deepcopy(xmlObj)
+            start = time.time()
+            func(record, outfile)
+            elapsed += time.time() - start
+        with open(outfile, "rb") as f:
+            timings[func.__name__] = (elapsed / repeat, f.read())
+    shutil.rmtree(outdir)
+
+    old_time, old_bytes = timings["writeToFileMinidom"]
+    new_time, new_bytes = timings["writeToFile"]
+    print("writeToFileMinidom: {:.2f} ms per record".format(old_time * 1000))
+    print("writeToFile:        {:.2f} ms per record ({:.1f}x faster)".format(new_time * 1000, old_time / new_time))
+    print("Identical output: {}".format(old_bytes == new_bytes))
+    return old_time, new_time
+
+def copyrenameDataset(infile, outfile, csvdir, staging="reflink"):
+    """Stages infile and its sidecar files (.dbf, .shx, .prj, ...) as outfile in the RenamedDatasets folder of
+    csvdir, linking or cloning them where the filesystem allows it (see datasetStaging.py)."""
     outdir = csvdir + "/RenamedDatasets"
-    if not os.path.exists(outdir):
-        os.mkdir(outdir)
-
-    #datadir = os.path.abspath(os.path.join(os.path.abspath(infile), os.pardir))
-    # Single shapefile are split into multiple (shp, sbx, dbf, etc.), need to iterate parent directory and copy
-    # all asoociated files.
-    #for root, dirs, files in os.walk(datadir):
-    #    for file in files:
-    #        if file.startswith(basename):
-    #            print(file)
     outpath = os.path.join(outdir, outfile)
-    
+
     print(f"Renaming dataset to file {outpath}")
-    shutil.copy(infile, outpath)
-    
-    return outpath
+    # THE ISO RECORD WRITTEN FOR THE ROW REPLACES THE DATASET'S OWN .xml METADATA. LEAVING IT OUT ALSO KEEPS A
+    #  HARDLINKED ORIGINAL FROM BEING OVERWRITTEN BY IT
+    return stageDataset(infile, outdir, outfile, mode=staging, exclude=(os.path.abspath(infile) + ".xml",))
 
 # REMOVE LEADING AND TRAILING WHITESPACES
 def rltw(text):
@@ -167,9 +224,8 @@ def formatDate(text):
                 else:
                     d[k] = v + "-12-31"
 
-            elif "-" not in text or len(text) != 10:
-                print("Formatting issue with date " + d[k] + ". Dates should be formatted YYYY-MM-DD")
-                exit()
+            elif "-" not in v or len(v) != 10:
+                raise ValueError("Formatting issue with date " + d[k] + ". Dates should be formatted YYYY-MM-DD")
 
             # ALL DATES SHOULD BE 10 CHARACTERS AT THIS POINT
             d[k] += "T00:00:00"
@@ -186,26 +242,72 @@ def formatDate(text):
 
     return dates
 
-# VIA USER CAPOOTI STACKEXCHANGE: HTTPS://GIS.STACKEXCHANGE.COM/A/7615
-def getEPSGCode(file_path):
-    df = gpd.read_file(file_path)
-    # GET EPSG CODE
-    try:
-        epsg_code = int(df.crs.get('init').split(":")[1])
-        return epsg_code
-    except:
-        print("Unable to get get epsg code of geodataframe: Found CRS : {}\nExiting.".format(df.crs))
+# EPSG CODE FROM THE DATASET HEADER (VECTOR OR RASTER), CACHED ACROSS RUNS (SEE datasetProbe.py). facts CAN BE THE
+#  RESULT OF getDatasetInfo, TO AVOID LOOKING THE DATASET UP AGAIN
+def getEPSGCode(file_path, facts=None):
+    if facts is None:
+        facts = getDatasetFacts(file_path)
+    if facts["epsg"] is None:
+        print("Unable to get get epsg code of dataset {}: Found CRS : {}\nExiting.".format(file_path, facts["crs"]))
         raise ValueError
-    prj = file_path[:-3] + "prj"
-    prj_file = open(prj, 'r')
-    prj_txt = prj_file.read()
-    srs = osr.SpatialReference()
-    srs.ImportFromESRI([prj_txt])
-    srs.AutoIdentifyEPSG()
-    return srs.GetAuthorityCode(None)
+    return int(facts["epsg"])
 
-# VIA USER LUKE ON STACKEXCHANGE: HTTPS://GIS.STACKEXCHANGE.COM/A/57837
+# WGS84 EXTENTS ARE CACHED WITH THE OTHER DATASET FACTS, SO AN UNCHANGED DATASET ISN'T REPROJECTED AGAIN
 def getRasterExtent(rasterDS):
+    return getCachedFacts(rasterDS, ["extent_wgs84"],
+                          lambda path: {"extent_wgs84": readRasterExtent(path)})["extent_wgs84"]
+
+def getVectorExtent(vectorDS):
+    return getCachedFacts(vectorDS, ["extent_wgs84"],
+                          lambda path: {"extent_wgs84": readVectorExtent(path)})["extent_wgs84"]
+
+# EVERYTHING THE ISO RECORD NEEDS FROM A DATASET, FROM ONE OPEN OF THE DATASET: crs, epsg AND extent_wgs84, PLUS
+#  geom_type AND feature_count FOR A VECTOR OR raster_size FOR A RASTER (SEE datasetProbe.py)
+vectorInfoFacts = ["crs", "epsg", "extent_wgs84", "geom_type", "feature_count"]
+rasterInfoFacts = ["crs", "epsg", "extent_wgs84", "raster_size"]
+
+def inspectDataset(datafile):
+    if os.path.isdir(datafile):
+        # IMAGE PYRAMID. THE TILE INDEX ONLY READS TILES ADDED OR CHANGED SINCE IT WAS LAST BUILT
+        facts = buildTileIndex(datafile)
+        crs = None
+        if facts["epsg"] is not None:
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(int(facts["epsg"]))
+            crs = srs.ExportToWkt()
+        return {"crs": crs, "epsg": facts["epsg"], "extent_wgs84": facts["extent_wgs84"],
+                "raster_size": facts["raster_size"]}
+    elif datafile.endswith(".shp") or datafile.endswith(".gpkg"):
+        ds = ogr.Open(datafile)
+        if ds is None:
+            print("ERROR: Unable to open vector dataset {}".format(datafile))
+            raise ValueError
+        layer = ds.GetLayer()
+        facts = probeVectorLayer(layer)
+        facts["extent_wgs84"] = vectorLayerExtent(layer, datafile)
+    else:
+        ds = gdal.Open(datafile)
+        if ds is None:
+            print("ERROR: Unable to open raster dataset {}".format(datafile))
+            raise ValueError
+        facts = probeRasterDataSource(ds)
+        facts["extent_wgs84"] = rasterExtent(ds)
+    return facts
+
+def getDatasetInfo(datafile):
+    """Returns the facts of inspectDataset for datafile, from the dataset cache if it's unchanged since they were
+    last collected."""
+    names = vectorInfoFacts if datafile.endswith(".shp") or datafile.endswith(".gpkg") else rasterInfoFacts
+    return getCachedFacts(datafile, names, inspectDataset)
+
+# VIA USER LUKE ON STACKEXCHANGE: HTTPS://GIS.STACKEXCHANGE.COM/A/57837
+def readRasterExtent(rasterDS):
+    if os.path.isdir(rasterDS):
+        # IMAGE PYRAMID DIRECTORY: UNION OF THE TILE FOOTPRINTS (SEE tileIndex.py)
+        return buildTileIndex(rasterDS)["extent_wgs84"]
+    return rasterExtent(gdal.Open(rasterDS))
+
+def rasterExtent(ds):
     # RETURN LIST OF CORNER COORDINATES FROM A GEOTRANSFORM
     def GetExtent(gt, cols, rows):
         ext = []
@@ -232,8 +334,6 @@ def getRasterExtent(rasterDS):
             trans_coords.append([x, y])
         return trans_coords
 
-    ds = gdal.Open(rasterDS)
-
     gt = ds.GetGeoTransform()
     cols = ds.RasterXSize
     rows = ds.RasterYSize
@@ -256,33 +356,128 @@ def getRasterExtent(rasterDS):
 
     return coordsdict
 
-# GET EXTENT (BOUNDING BOX) OF VECTOR DATASET
-def getVectorExtent(vectorDS):
-    if vectorDS.endswith(".shp"):
-        driver_name = "ESRI Shapefile"
-    elif vectorDS.endswith(".gpkg"):
-        driver_name = "GPKG"
-    else:
-        print("Unknown vector dataset for file {}. Must be 'shp' or 'gpkg'.")
+# GET EXTENT (BOUNDING BOX) OF VECTOR DATASET. THE NATIVE EXTENT STORED IN THE LAYER HEADER IS REPROJECTED TO WGS84 AS
+#  A DENSIFIED ENVELOPE (envelopeDensifyPoints POINTS PER EDGE), SO TIME AND MEMORY DON'T DEPEND ON THE SIZE OF THE
+#  DATASET. WHERE THE ENVELOPE ISN'T SAFE TO REPROJECT (IT CROSSES THE ANTIMERIDIAN, OR POINTS FAIL TO TRANSFORM) THE
+#  FEATURES ARE REPROJECTED ONE AT A TIME INSTEAD (readFeatureExtent)
+envelopeDensifyPoints = 21
+
+def readVectorExtent(vectorDS):
+    if not (vectorDS.endswith(".shp") or vectorDS.endswith(".gpkg")):
+        print("Unknown vector dataset for file {}. Must be 'shp' or 'gpkg'.".format(vectorDS))
+        raise ValueError
+
+    ds = ogr.Open(vectorDS)
+    if ds is None:
+        print("ERROR: Unable to open vector dataset {}".format(vectorDS))
         raise ValueError
-        
-    df = gpd.read_file(vectorDS)
+    return vectorLayerExtent(ds.GetLayer(), vectorDS)
+
+def vectorLayerExtent(layer, vectorDS):
+    src_srs = layer.GetSpatialRef()
+    if src_srs is None:
+        # NO PROMPT FOR A proj4 STRING: THIS RUNS IN POOL WORKERS WITHOUT A TERMINAL. THE ROW FAILS INTO THE ERROR REPORT
+        raise ValueError("Unable to identify native CRS for {}. Define it (e.g. a .prj for a shapefile)".format(vectorDS))
+    # A COPY, AS THE AXIS MAPPING SET BELOW WOULD OTHERWISE CHANGE THE LAYER'S OWN SRS FOR LATER CALLERS
+    src_srs = src_srs.Clone()
+    tgt_srs = osr.SpatialReference()
+    tgt_srs.ImportFromEPSG(4326)
+    for srs in (src_srs, tgt_srs):
+        # LONGITUDE, LATITUDE ORDER WITH GDAL 3+
+        if hasattr(srs, "SetAxisMappingStrategy"):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(src_srs, tgt_srs)
+
+    xmin, xmax, ymin, ymax = layer.GetExtent()  # returns e.g. (-180.0, 180.0, -78.7329013, 83.6664731)
+    extent = transformEnvelope(transform, xmin, xmax, ymin, ymax, src_srs, tgt_srs)
+    if extent is None:
+        print("Envelope of {} can't be reprojected safely. Reprojecting each feature.".format(vectorDS))
+        extent = readFeatureExtent(layer, transform)
+    return extent
+
+def transformEnvelope(transform, xmin, xmax, ymin, ymax, src_srs, tgt_srs):
+    # WGS84 BOUNDS OF THE DENSIFIED NATIVE ENVELOPE. None IF THEY CAN'T BE TRUSTED
+    n = envelopeDensifyPoints
+    points = []
+    for i in range(n):
+        x = xmin + (xmax - xmin) * i / (n - 1)
+        y = ymin + (ymax - ymin) * i / (n - 1)
+        points.extend([(x, ymin), (x, ymax), (xmin, y), (xmax, y)])
     try:
-        df.to_crs(epsg=4326, inplace=True)
-    except:
-        proj4 = input("Unable to identify native crs. Please paste in proj4 string (lookup at spatialreference.org): ")
-        df.crs = proj4
-        df.to_crs(epsg=4326, inplace=True)
-        
-    extent = df.total_bounds # returns array with values xmin, ymin, xmax, ymax
-    #driver = ogr.GetDriverByName(driver_name)
-    #dsOpen = driver.Open(vectorDS, 0)
-    #extentTuple = dsOpen.GetLayer().GetExtent()  # returns (-180.0, 180.0, -78.7329013, 83.6664731)
-    extent = {"xmin": extent[0], "xmax": extent[2], "ymin": extent[1], "ymax": extent[3]}
+        transformed = transform.TransformPoints(points)
+    except RuntimeError:
+        return None
+    xvalues = [p[0] for p in transformed]
+    yvalues = [p[1] for p in transformed]
+    if not all(math.isfinite(v) for v in xvalues + yvalues):
+        return None
+
+    extent = {"xmin": min(xvalues), "xmax": max(xvalues), "ymin": min(yvalues), "ymax": max(yvalues)}
+
+    # A POLE INSIDE THE NATIVE ENVELOPE ISN'T ON ITS EDGE, SO THE EDGES ALONE UNDERESTIMATE THE LATITUDE RANGE. THE
+    #  ENVELOPE THEN COVERS EVERY LONGITUDE
+    to_native = osr.CoordinateTransformation(tgt_srs, src_srs)
+    has_pole = False
+    for lat in (90.0, -90.0):
+        try:
+            px, py = to_native.TransformPoint(0.0, lat)[:2]
+        except RuntimeError:
+            continue
+        if math.isfinite(px) and math.isfinite(py) and xmin <= px <= xmax and ymin <= py <= ymax:
+            has_pole = True
+            extent["xmin"], extent["xmax"] = -180.0, 180.0
+            if lat > 0:
+                extent["ymax"] = 90.0
+            else:
+                extent["ymin"] = -90.0
+    if has_pole:
+        return extent
+
+    # IF THE ENVELOPE WRAPS AROUND THE ANTIMERIDIAN ITS EDGES JUMP FROM ~180 TO ~-180 AND THE BOUNDS ARE MEANINGLESS
+    if max(abs(xvalues[i] - xvalues[i + 4]) for i in range(len(xvalues) - 4)) > 180:
+        return None
+    return extent
+
+def readFeatureExtent(layer, transform):
+    # UNION OF THE WGS84 ENVELOPES OF THE FEATURES, ONE FEATURE IN MEMORY AT A TIME
+    extent = None
+    layer.ResetReading()
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        if geometry is None:
+            continue
+        geometry = geometry.Clone()
+        geometry.Transform(transform)
+        fxmin, fxmax, fymin, fymax = geometry.GetEnvelope()
+        if extent is None:
+            extent = {"xmin": fxmin, "xmax": fxmax, "ymin": fymin, "ymax": fymax}
+        else:
+            extent = {"xmin": min(extent["xmin"], fxmin), "xmax": max(extent["xmax"], fxmax),
+                      "ymin": min(extent["ymin"], fymin), "ymax": max(extent["ymax"], fymax)}
+    if extent is None:
+        print("ERROR: No geometries to compute the extent from.")
+        raise ValueError
     return extent
 
-# GET TYPE OF DATASET LAYER AND IF VECTOR, NUMBER OF FEATURES
-def getLayerInfo(ds):
+# ISO GEOMETRIC OBJECT TYPE OF EACH BASE OGR GEOMETRY TYPE (SEE baseGeometryType)
+isoGeometryTypes = {"POINT": "point", "LINESTRING": "composite", "POLYGON": "complex"}
+
+def baseGeometryType(geometry):
+    # OGR GEOMETRY NAME WITHOUT ITS MULTI PREFIX AND Z/M SUFFIX, E.G. MULTILINESTRINGZM, "3D Multi Point" AND
+    #  MULTIPOLYGON25D ARE LINESTRING, POINT AND POLYGON
+    geometry = geometry.upper().replace(" ", "")
+    if geometry.startswith("3D"):
+        geometry = geometry[2:]
+    if geometry.startswith("MULTI"):
+        geometry = geometry[5:]
+    for suffix in ("25D", "ZM", "Z", "M"):
+        if geometry.endswith(suffix):
+            return geometry[:-len(suffix)]
+    return geometry
+
+# GET TYPE OF DATASET LAYER AND IF VECTOR, NUMBER OF FEATURES. facts IS THE RESULT OF getDatasetInfo, dataset_type IS
+#  "vector" OR "raster"
+def getLayerInfo(facts, dataset_type):
     """
     ISO geometric object types
         complex: set of geometric primitives such that their boundaries can be represented as a union of other primitives (polygon)
@@ -297,21 +492,13 @@ def getLayerInfo(ds):
     if dataset_type == "raster":
         layer_info["Type"] = "surface"
     elif dataset_type == "vector":
-        shapefile = ogr.Open(ds)
-        layer = shapefile.GetLayer()
-        feature = layer.GetNextFeature()
-        geometry = feature.GetGeometryRef().GetGeometryName()
-
-        if geometry == "POINT":
-            layer_info["Type"] = "point"
-        elif geometry == "LINESTRING":
-            layer_info["Type"] = "composite"
-        elif geometry == "POLYGON" or geometry == "MULTIPOLYGON":
-            layer_info["Type"] = "complex"
-        else:
-            print("ERROR: UNKNOWN DATA TYPE " + geometry + ". Should be one of POINT, LINESTRING, or POLYGON")
+        geometry = baseGeometryType(facts["geom_type"])
+        if geometry not in isoGeometryTypes:
+            raise ValueError("Unsupported geometry type {}. Should be one of POINT, LINESTRING or POLYGON (or their"
+                             " MULTI, Z and M variants)".format(facts["geom_type"]))
+        layer_info["Type"] = isoGeometryTypes[geometry]
 
-        layer_info["Number of Features"] = str(len(layer))
+        layer_info["Number of Features"] = str(facts["feature_count"])
 
     return layer_info
 
@@ -319,7 +506,7 @@ def getLayerInfo(ds):
 def setGMXCodeElemAttributes(element, codeValue, element_name):
     codelistlocation = r"http://www.isotc211.org/2005/resources/Codelist/gmxCodelists.xml#" + element_name
 
-    subelement = ET.SubElement(element, "{" + namespaces["gmd"] + "}" + element_name)
+    subelement = ET.SubElement(element, QN["gmd:" + element_name])
     subelement.set("codeList", codelistlocation)
     subelement.set("codeListValue", codeValue)
     subelement.set("codeSpace", "ISOTC211/19115")
@@ -327,298 +514,388 @@ def setGMXCodeElemAttributes(element, codeValue, element_name):
 
 # CREATE SINGLE gco:Characterstring ELEMENT
 def createCharacterElem(element, string):
-    char_string_elem = ET.SubElement(element, "{" + namespaces["gco"] + "}CharacterString")
+    char_string_elem = ET.SubElement(element, QN["gco:CharacterString"])
     char_string_elem.text = string
 
 # CREATE SUBTREE OF CONTACT INFO
 def createContactTree(parent_elem, contact_dict, role):
-    ci_responseaprty_elem = ET.SubElement(parent_elem, "{" + namespaces["gmd"] + "}CI_ResponsibleParty")
-    indivname_elem = ET.SubElement(ci_responseaprty_elem, "{" + namespaces["gmd"] + "}individualName")
-    orgname_elem = ET.SubElement(ci_responseaprty_elem, "{" + namespaces["gmd"] + "}organizationName")
+    ci_responseaprty_elem = ET.SubElement(parent_elem, QN["gmd:CI_ResponsibleParty"])
+    indivname_elem = ET.SubElement(ci_responseaprty_elem, QN["gmd:individualName"])
+    orgname_elem = ET.SubElement(ci_responseaprty_elem, QN["gmd:organizationName"])
     createCharacterElem(indivname_elem, contact_dict["Individual Name"])
     createCharacterElem(orgname_elem, contact_dict["Organization Name"])
 
-    contactinfo_elem = ET.SubElement(ci_responseaprty_elem, "{" + namespaces["gmd"] + "}contactInfo")
-    address_elem = ET.SubElement(contactinfo_elem, "{" + namespaces["gmd"] + "}address")
-    ci_address_elem = ET.SubElement(address_elem, "{" + namespaces["gmd"] + "}CI_Address")
-    delivpoint_elem = ET.SubElement(ci_address_elem, "{" + namespaces["gmd"] + "}deliveryPoint")
+    contactinfo_elem = ET.SubElement(ci_responseaprty_elem, QN["gmd:contactInfo"])
+    address_elem = ET.SubElement(contactinfo_elem, QN["gmd:address"])
+    ci_address_elem = ET.SubElement(address_elem, QN["gmd:CI_Address"])
+    delivpoint_elem = ET.SubElement(ci_address_elem, QN["gmd:deliveryPoint"])
     createCharacterElem(delivpoint_elem, contact_dict["Street Address"])
-    city_elem = ET.SubElement(ci_address_elem, "{" + namespaces["gmd"] + "}city")
+    city_elem = ET.SubElement(ci_address_elem, QN["gmd:city"])
     createCharacterElem(city_elem, contact_dict["City"])
-    adminarea_elem = ET.SubElement(ci_address_elem, "{" + namespaces["gmd"] + "}administrativeArea")
+    adminarea_elem = ET.SubElement(ci_address_elem, QN["gmd:administrativeArea"])
     createCharacterElem(adminarea_elem, contact_dict["Admin Area"])
-    postalcode_elem = ET.SubElement(ci_address_elem, "{" + namespaces["gmd"] + "}postalCode")
+    postalcode_elem = ET.SubElement(ci_address_elem, QN["gmd:postalCode"])
     createCharacterElem(postalcode_elem, contact_dict["Postal Code"])
-    country_elem = ET.SubElement(ci_address_elem, "{" + namespaces["gmd"] + "}country")
+    country_elem = ET.SubElement(ci_address_elem, QN["gmd:country"])
     setGMXCodeElemAttributes(country_elem, contact_dict["Country"], "CountryCode")
-    emailaddr_elem = ET.SubElement(ci_address_elem, "{" + namespaces["gmd"] + "}electronicMailAddress")
+    emailaddr_elem = ET.SubElement(ci_address_elem, QN["gmd:electronicMailAddress"])
     createCharacterElem(emailaddr_elem, contact_dict["EMail Address"])
 
-    role_elem = ET.SubElement(ci_responseaprty_elem, "{" + namespaces["gmd"] + "}role")
+    role_elem = ET.SubElement(ci_responseaprty_elem, QN["gmd:role"])
     setGMXCodeElemAttributes(role_elem, role, "CI_RoleCode")
 
-# MAIN FUNCTION TO CRETE XML ELEMENTS BASED ON PATH LIST
-def createElements(element_path):
-    parent = iso_troot
-
-    for elem in element_path:
+# FIND EACH ELEMENT OF THE PATH UNDER THE PREVIOUS ONE, CREATING IT IF IT DOESN'T EXIST. RETURNS THE LAST ELEMENT OF THE
+#  PATH AND ITS PARENT
+def findPathElements(root, element_path):
+    parent = root
+    element = None
+    for num, elem in enumerate(element_path):
         # FIND ALL ELEMENTS MATCHING NAME UNDER PARENT
         elements = parent.findall(elem, namespaces)
 
         # CHECK TO MAKE SURE IF ONLY ONE ELEMENT EXISTS. SET element TO THAT ELEMENT
         if len(elements) == 1:
-            element = parent.find(elem, namespaces)
+            element = elements[0]
 
         # CREATE ELEMENT IF IT DOESN"T EXIST
         if len(elements) == 0:
-            ns = namespaces[elem.split(":")[0]]
-            element = ET.SubElement(parent, "{" + ns + "}" + elem.split(":")[1])
-
-        # THE FOLLOWING IF STATEMENTS PROVIDE DIFFERENT FUNCTIONALITY BASED ON WHATEVER PATH WAS PASSED TO FUNCTION
-
-        # SET METADATA LANGUAGE ELEMENT
-        if element_path[0] == "gmd:language":
-            codelistlocation = r"http://www.isotc211.org/2005/resources/Codelist/gmxCodelists.xml#LanguageCode"
-            languagecode_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}" + "LanguageCode")
-            languagecode_elem.set("codeList", codelistlocation)
-            languagecode_elem.set("codeListValue", language)
-            languagecode_elem.set("codeSpace", "ISO639-2")
-            languagecode_elem.text = language
-
-        # SET HIERARCHY ELEMENT
-        elif element_path[0] == "gmd:hierarchyLevel":
-            setGMXCodeElemAttributes(element, "dataset", "MD_ScopeCode")
-
-        # CREATE CONTACT TREE
-        elif elem == "gmd:contact":
-            createContactTree(element, metadata_contact, "pointOfContact")
-
-        # SET METADATA MODIFIED DATE
-        elif elem == "gco:Date" and parent.tag == "{" + namespaces["gmd"] + "}dateStamp":
-            currentdate = datetime.now()
-            formatted_date = currentdate.strftime('%Y-%m-%dT%H:%M:%S')  # 2017-05-31T11:35:23
-            element.text = formatted_date
-
-        # CREATE CITATION SUBTREE UNDER identificationInfo ELEMENT
-        elif elem == "gmd:CI_Citation":
-            def createOrganizationElement(ele, val, type):
-                cited_reponse_party_elem = ET.SubElement(ele,
-                                                         "{" + namespaces["gmd"] + "}citedResponsibleParty")
-                cirespon_party_elem = ET.SubElement(cited_reponse_party_elem,
-                                                    "{" + namespaces["gmd"] + "}CI_ResponsibleParty")
-                org_name_elem = ET.SubElement(cirespon_party_elem, "{" + namespaces["gmd"] + "}organisationName")
-                createCharacterElem(org_name_elem, val)
-                role_elem = ET.SubElement(cirespon_party_elem,
-                                                    "{" + namespaces["gmd"] + "}role")
-                setGMXCodeElemAttributes(role_elem, type, "CI_RoleCode")
-
-            # CREATE TITLE ELEMENT
-            title_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}title")
-            createCharacterElem(title_elem, title)
-
-            # CREATE PUBLICATION DATE
-            parentdate_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}date")
-            cidate_elem = ET.SubElement(parentdate_elem, "{" + namespaces["gmd"] + "}CI_Date")
-            date_elem = ET.SubElement(cidate_elem, "{" + namespaces["gmd"] + "}date")
-            pubdate_elem = ET.SubElement(date_elem, "{" + namespaces["gco"] + "}Date")
-            pubdate_elem.text = publicationDate
-            date_type_elem = ET.SubElement(cidate_elem, "{" + namespaces["gmd"] + "}dateType")
-            setGMXCodeElemAttributes(date_type_elem, "publication", "CI_DateTypeCode")
-
-            # CREATE PUBLISHER ELEMENTS
-            createOrganizationElement(element, publisher, "publisher")
-
-            # CREATE ORIGINATOR ELEMENTS
-            for originator in originators:
-                createOrganizationElement(element, originator, "originator")
-
-            # CREATE PRESENTATION FORM ELEMENT
-            presentationform_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}presentationForm")
-            setGMXCodeElemAttributes(presentationform_elem, presentation_form_code, "CI_PresentationFormCode")
-
-        # SET DATASET CONSTRAINTS. ACCESS AND USAGE CONTRAINTS ARE GROUPED INTO OTHER CONTRAINTS
-        elif elem == "gmd:otherConstraints":
-            createCharacterElem(element, isoconst_text)
-
-        elif elem == "gmd:MD_DataIdentification" and element_path[-1] == "gmd:MD_DataIdentification":
-            # SET LANGUAGE VALUE
-            language_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}language")
-            setGMXCodeElemAttributes(language_elem, language, "LanguageCode")
-
-            # SET ABSTRACT VALUE
-            abstract_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}abstract")
-            createCharacterElem(abstract_elem, abstract)
-
-            # SET MD PROGRESS VALUE
-            status_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}status")
-            setGMXCodeElemAttributes(status_elem, metadata_progress, "MD_ProgressCode")
-
-            # SET MD MAINTENANCE FREQUENCY INFO
-            resourcemaint_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}resourceMaintenance")
-            md_maintinfo_elem = ET.SubElement(resourcemaint_elem, "{" + namespaces["gmd"] + "}MD_MaintenanceInformation")
-            mainandupdatefreq_elem = ET.SubElement(md_maintinfo_elem, "{" + namespaces["gmd"] + "}maintenanceAndUpdateFrequency")
-            setGMXCodeElemAttributes(mainandupdatefreq_elem, maintenance_requency_code, "MD_MaintenanceFrequencyCode")
-
-            # SET KEYWORD ELEMENTS
-            for type, list in keywordArray.items():
-                descriptive_keywords_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}descriptiveKeywords")
-                md_keywords_elem = ET.SubElement(descriptive_keywords_elem, "{" + namespaces["gmd"] + "}MD_Keywords")
-                print(type, list)
-                for value in list:
-                    keyword_elem = ET.SubElement(md_keywords_elem, "{" + namespaces["gmd"] + "}keyword")
-                    createCharacterElem(keyword_elem, rltw(value))
-                type_elem = ET.SubElement(md_keywords_elem, "{" + namespaces["gmd"] + "}type")
-
-                if "theme" in type:
-                    keywordType = "theme"
-                elif "place" in type:
-                    keywordType = "place"
-
-                setGMXCodeElemAttributes(type_elem, keywordType, "MD_KeywordTypeCode")
-
-                thesaurusname_elem = ET.SubElement(md_keywords_elem, "{" + namespaces["gmd"] + "}thesaurusName")
-                cicitation_elem = ET.SubElement(thesaurusname_elem, "{" + namespaces["gmd"] + "}CI_Citation")
-                thesetitle_elem = ET.SubElement(cicitation_elem, "{" + namespaces["gmd"] + "}title")
-                if "LCSH" in type:
-                    thesaurus = "LCSH"
-                elif "GEOnet" in type:
-                    thesaurus = "GEOnet"
-                else:
-                    thesaurus = "None"
-                createCharacterElem(thesetitle_elem, thesaurus)
-
-            # ISO 19115 SUBJECT KEY VALUES
-            for topic in themeKey_ISOTopics:
-                topiccategory_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}topicCategory")
-                mdtopiccategory_elem = ET.SubElement(topiccategory_elem, "{" + namespaces["gmd"] + "}MD_TopicCategoryCode")
-                mdtopiccategory_elem.text = topic
-
-            # SPATIAL REPRESENTATION TYPE (vector, grid, tin,  textTable, steroModel, video officially supported)
-            spatialrepresentationtype_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}spatialRepresentationType")
-            setGMXCodeElemAttributes(spatialrepresentationtype_elem, spatial_representation_type_code, "MD_SpatialRepresentationTypeCode")
-
-            # SET SPATIAL EXTENT
-            spatial_extent_parent_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}extent")
-            ex_extent_elem = ET.SubElement(spatial_extent_parent_elem, "{" + namespaces["gmd"] + "}EX_Extent")
-            geographicelem_elem = ET.SubElement(ex_extent_elem, "{" + namespaces["gmd"] + "}geographicElement")
-            bounding_box_elem = ET.SubElement(geographicelem_elem, "{" + namespaces["gmd"] + "}EX_GeographicBoundingBox")
-
-            def setSpatialBoundsValues(bounds, value):
-                bounds_elem = ET.SubElement(bounding_box_elem, "{" + namespaces["gmd"] + "}" + bounds)
-                decimal_elem = ET.SubElement(bounds_elem, "{gco}Decimal")
-                decimal_elem.text = value
-
-            setSpatialBoundsValues("westBoundLongitude", str(ds_extent["xmin"]))
-            setSpatialBoundsValues("eastBoundLongitude", str(ds_extent["xmax"]))
-            setSpatialBoundsValues("southBoundLatitude", str(ds_extent["ymin"]))
-            setSpatialBoundsValues("northBoundLatitude", str(ds_extent["ymax"]))
-
-            # SET TEMPORAL EXTENT
-            temporal_extent_parent_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}extent")
-            ex_extent_elem = ET.SubElement(temporal_extent_parent_elem, "{" + namespaces["gmd"] + "}EX_Extent")
-            temporalelement_elem = ET.SubElement(ex_extent_elem, "{" + namespaces["gmd"] + "}temporalElement")
-            ex_temporalextent_elem = ET.SubElement(temporalelement_elem, "{" + namespaces["gmd"] + "}EX_TemporalExtent")
-            textent_elem = ET.SubElement(ex_temporalextent_elem, "{" + namespaces["gmd"] + "}extent")
-            if "beg_date" in dateOfContent:
-                time_perd_elem = ET.SubElement(textent_elem, "{" + namespaces["gml"] + "}TimePeriod")
-                beg_pos_elem = ET.SubElement(time_perd_elem, "{" + namespaces["gml"] + "}beginPosition")
-                end_pos_elem = ET.SubElement(time_perd_elem, "{" + namespaces["gml"] + "}endPosition")
-                beg_pos_elem.text = dateOfContent["beg_date"]
-                end_pos_elem.text = dateOfContent["end_date"]
-            elif "instant_date" in dateOfContent:
-                time_inst_elem = ET.SubElement(textent_elem, "{" + namespaces["gml"] + "}TimeInstant")
-                tim_pos_elem = ET.SubElement(time_inst_elem, "{" + namespaces["gml"] + "}timePosition")
-                instant_date = dateOfContent["instant_date"]
-                tim_pos_elem.text = instant_date
-
-        # SET SPATIAL REPRESENTATION INFO FOR VECTOR DATASET
-        elif elem == "gmd:MD_GeometricObjects":
-            geometricobjtype_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}geometricObjectType")
-            setGMXCodeElemAttributes(geometricobjtype_elem, objecttype, "MD_GeometricObjectTypeCode")
-
-            geometricobjcount_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}geometricObjectCount")
-            integer_elem = ET.SubElement(geometricobjcount_elem, "{" + namespaces["gco"] + "}Integer")
-            integer_elem.text = numobjects
-
-        # SET SPATIAL REPRESENTATION INFO FOR RASTER DATASET
-        elif elem == "gmd:MD_Georectified":
-            numberdimensions_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}numberOfDimensions")
-            integer_elem = ET.SubElement(numberdimensions_elem, "{" + namespaces["gco"] + "}Integer")
-            integer_elem.text = len(dimension)
-
-            for k, v in dimensions.items():
-                axisdimensionproperties_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}axisDimensionProperties")
-                md_dimension_elem = ET.SubElement(axisdimensionproperties_elem, "{" + namespaces["gmd"] + "}MD_Dimension")
-                dimensionname_elem = ET.SubElement(md_dimension_elem, "{" + namespaces["gmd"] + "}dimensionName")
-                dimnametypecode_elem = ET.SubElement(dimensionname_elem, "{" + namespaces["gmd"] + "}MD_DimensionNameTypeCode")
-                dimnametypecode_elem.text = v
-                dimensionsize_elem = ET.SubElement(axisdimensionproperties_elem, "{" + namespaces["gmd"] + "}MD_Dimension")
-                integer_elem = ET.SubElement(dimensionsize_elem, "{" + namespaces["gco"] + "}Integer")
-                integer_elem.text = 1
-
-            cellgeometry_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}cellGeometry")
-            setGMXCodeElemAttributes(cellgeometry_elem, "area", "MD_CellGeometryCode")
-
-        # CREATE DISTRIBUTOR INFO
-        elif elem == "gmd:MD_Distributor":
-            distribcontact_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}distributorContact")
-            createContactTree(distribcontact_elem, dist_contact, "distributor")
-
-            distribformat_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}distributorFormat")
-            md_format_elem = ET.SubElement(distribformat_elem, "{" + namespaces["gmd"] + "}MD_Format")
-            formatname_elem = ET.SubElement(md_format_elem, "{" + namespaces["gmd"] + "}name")
-            createCharacterElem(formatname_elem, distformat)
-            version_elem = ET.SubElement(md_format_elem, "{" + namespaces["gmd"] + "}version")
-            createCharacterElem(version_elem, "Unknown")
-
-            distribtransfer_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}distributorTransferOptions")
-            MD_DigitalTransferOptions = ET.SubElement(distribtransfer_elem, "{" + namespaces["gmd"] + "}MD_DigitalTransferOptions")
-            online_elem = ET.SubElement(MD_DigitalTransferOptions, "{" + namespaces["gmd"] + "}onLine")
-            ci_onlineres_elem = ET.SubElement(online_elem, "{" + namespaces["gmd"] + "}CI_OnlineResource")
-            linkage_elem = ET.SubElement(ci_onlineres_elem, "{" + namespaces["gmd"] + "}linkage")
-            url_elem = ET.SubElement(linkage_elem, "{" + namespaces["gco"] + "}URL")
-            url_elem.text = purl
-
-        # SET URI ELEMENT
-        elif elem == "gmd:dataSetURI":
-            createCharacterElem(element, purl)
-
-        # SET PROJECTION CODE AND CODE SPACE (EPSG)
-        elif elem == "gmd:RS_Identifier":
-            code_elem = ET.SubElement(parent, "{" + namespaces["gmd"] + "}code")
-            createCharacterElem(code_elem,referenceSystemCode)
-            codespace_elem = ET.SubElement(parent, "{" + namespaces["gmd"] + "}codeSpace")
-            createCharacterElem(codespace_elem, referenceSystemCodeSpace)
-            version_elem = ET.SubElement(parent, "{" + namespaces["gmd"] + "}version")
-            createCharacterElem(version_elem, referenceSystemVersion)
-
-        # CREATE LINEAGE ELEMENT IDENTIFYING THE OPERATION PERFORMED IN THIS SCRIPT
-        elif elem == "gmd:LI_Lineage":
-            processstep_elem = ET.SubElement(element, "{" + namespaces["gmd"] + "}processStep")
-            li_processstep_elem = ET.SubElement(processstep_elem, "{" + namespaces["gmd"] + "}LI_ProcessStep")
-            description_elem = ET.SubElement(li_processstep_elem, "{" + namespaces["gmd"] + "}description")
-            process_description = "Metadata for this dataset has been updated or modified as part of an ingest into " + \
-                                  metadata_contact["Organization Name"] + " geospatial data repository. As part of this" \
-                                                                          " process the dataset was renamed from " +\
-                                  datasetname.split(".")[0] + " to " + filename + "."
-            createCharacterElem(description_elem, process_description)
-            datetime_elem = ET.SubElement(li_processstep_elem, "{" + namespaces["gmd"] + "}dateTime")
-            gcodatetime_elem = ET.SubElement(datetime_elem, "{" + namespaces["gco"] + "}DateTime")
-            currentdate = datetime.now()
-            formatted_date = currentdate.strftime('%Y-%m-%dT%H:%M:%S')  # 2017-05-31T11:35:23
-            gcodatetime_elem.text = formatted_date
+            element = ET.SubElement(parent, QN[elem])
 
+        if num == len(element_path) - 1:
+            return parent, element
         parent = element
 
-# SIMPLE VALIDATION OF CSV ROW VALUES. BASED ON CSV TEMPLATE
+
+def elementIndexPath(root, element):
+    # CHILD POSITIONS LEADING FROM root TO element, TO FIND THE SAME ELEMENT IN A DEEP COPY OF root
+    indexes = []
+    while element is not root:
+        parent = element.getparent()
+        indexes.append(parent.index(element))
+        element = parent
+    return indexes[::-1]
+
+
+def elementAtIndexPath(root, indexes):
+    element = root
+    for i in indexes:
+        element = element[i]
+    return element
+
+
+# PATHS CREATED IN EVERY RECORD, IN ORDER. spatialrepinfo IS THE VECTOR OR RASTER SPATIAL REPRESENTATION PATH
+def recordElementPaths(spatialrepinfo):
+    return [mdlanguage_iso, mdhierarchylevel_iso, mdcontact_iso, mddatestamp_iso, cicitation_iso, constraints_iso,
+            identificationinfo_iso, spatialrepinfo, refsys_iso, distributorinfo_iso, dataquality_iso, uri_iso]
+
+
+class ISOTemplate(object):
+    """The ISO 19139 xml template, parsed once. For each spatial representation (vector or raster) a skeleton is
+    built the first time it's needed: a copy of the template in which every element of the record paths is found
+    or created, with the positions of the last element of each path (and its parent) kept. A record is then a deep
+    copy of the skeleton and its path elements are looked up by position instead of searching the tree.
+
+    Values are only ever added under the last element of a path, after all path elements exist, so records are
+    the same as when the paths were searched and created one after the other."""
+
+    def __init__(self, template_path):
+        self.template_path = template_path
+        self.tree = ET.parse(template_path)
+        self.skeletons = {}
+
+    def skeleton(self, spatialrepinfo):
+        key = tuple(spatialrepinfo)
+        if key not in self.skeletons:
+            root = copy.deepcopy(self.tree.getroot())
+            anchors = []
+            for element_path in recordElementPaths(spatialrepinfo):
+                parent, element = findPathElements(root, element_path)
+                anchors.append((tuple(element_path), elementIndexPath(root, parent), elementIndexPath(root, element)))
+            self.skeletons[key] = (root, anchors)
+        return self.skeletons[key]
+
+    def newRecord(self, spatialrepinfo):
+        """Returns (tree, anchors) of a new record. anchors maps each record path (as a tuple) to the (parent,
+        element) of its last element in tree."""
+        skeleton_root, anchor_positions = self.skeleton(spatialrepinfo)
+        root = copy.deepcopy(skeleton_root)
+        anchors = {}
+        for element_path, parent_pos, element_pos in anchor_positions:
+            anchors[element_path] = (elementAtIndexPath(root, parent_pos), elementAtIndexPath(root, element_pos))
+        return ET.ElementTree(root), anchors
+
+
+# TEMPLATES ALREADY PARSED BY THIS PROCESS, BY PATH
+isoTemplates = {}
+
+def getISOTemplate(template_path):
+    if template_path not in isoTemplates:
+        isoTemplates[template_path] = ISOTemplate(template_path)
+    return isoTemplates[template_path]
+
+
+# MAIN FUNCTION TO CRETE XML ELEMENTS BASED ON PATH LIST. THE PATH ELEMENTS ALREADY EXIST IN THE RECORD (SEE
+#  ISOTemplate), THIS ADDS THE VALUES OF record (AN ISORecordBuilder) UNDER THE LAST ONE
+def createElements(record, element_path):
+    parent, element = record.anchors[tuple(element_path)]
+    elem = element_path[-1]
+
+    # THE FOLLOWING IF STATEMENTS PROVIDE DIFFERENT FUNCTIONALITY BASED ON WHATEVER PATH WAS PASSED TO FUNCTION
+
+    # SET METADATA LANGUAGE ELEMENT
+    if element_path[0] == "gmd:language":
+        codelistlocation = r"http://www.isotc211.org/2005/resources/Codelist/gmxCodelists.xml#LanguageCode"
+        languagecode_elem = ET.SubElement(element, QN["gmd:LanguageCode"])
+        languagecode_elem.set("codeList", codelistlocation)
+        languagecode_elem.set("codeListValue", record.language)
+        languagecode_elem.set("codeSpace", "ISO639-2")
+        languagecode_elem.text = record.language
+
+    # SET HIERARCHY ELEMENT
+    elif element_path[0] == "gmd:hierarchyLevel":
+        setGMXCodeElemAttributes(element, "dataset", "MD_ScopeCode")
+
+    # CREATE CONTACT TREE
+    elif elem == "gmd:contact":
+        createContactTree(element, metadata_contact, "pointOfContact")
+
+    # SET METADATA MODIFIED DATE
+    elif elem == "gco:Date" and parent.tag == QN["gmd:dateStamp"]:
+        currentdate = datetime.now()
+        formatted_date = currentdate.strftime('%Y-%m-%dT%H:%M:%S')  # 2017-05-31T11:35:23
+        element.text = formatted_date
+
+    # CREATE CITATION SUBTREE UNDER identificationInfo ELEMENT
+    elif elem == "gmd:CI_Citation":
+        def createOrganizationElement(ele, val, type):
+            cited_reponse_party_elem = ET.SubElement(ele,
+                                                     QN["gmd:citedResponsibleParty"])
+            cirespon_party_elem = ET.SubElement(cited_reponse_party_elem,
+                                                QN["gmd:CI_ResponsibleParty"])
+            org_name_elem = ET.SubElement(cirespon_party_elem, QN["gmd:organisationName"])
+            createCharacterElem(org_name_elem, val)
+            role_elem = ET.SubElement(cirespon_party_elem,
+                                                QN["gmd:role"])
+            setGMXCodeElemAttributes(role_elem, type, "CI_RoleCode")
+
+        # CREATE TITLE ELEMENT
+        title_elem = ET.SubElement(element, QN["gmd:title"])
+        createCharacterElem(title_elem, record.title)
+
+        # CREATE PUBLICATION DATE
+        parentdate_elem = ET.SubElement(element, QN["gmd:date"])
+        cidate_elem = ET.SubElement(parentdate_elem, QN["gmd:CI_Date"])
+        date_elem = ET.SubElement(cidate_elem, QN["gmd:date"])
+        pubdate_elem = ET.SubElement(date_elem, QN["gco:Date"])
+        pubdate_elem.text = record.publicationDate
+        date_type_elem = ET.SubElement(cidate_elem, QN["gmd:dateType"])
+        setGMXCodeElemAttributes(date_type_elem, "publication", "CI_DateTypeCode")
+
+        # CREATE PUBLISHER ELEMENTS
+        createOrganizationElement(element, record.publisher, "publisher")
+
+        # CREATE ORIGINATOR ELEMENTS
+        for originator in record.originators:
+            createOrganizationElement(element, originator, "originator")
+
+        # CREATE PRESENTATION FORM ELEMENT
+        presentationform_elem = ET.SubElement(element, QN["gmd:presentationForm"])
+        setGMXCodeElemAttributes(presentationform_elem, record.presentation_form_code, "CI_PresentationFormCode")
+
+    # SET DATASET CONSTRAINTS. ACCESS AND USAGE CONTRAINTS ARE GROUPED INTO OTHER CONTRAINTS
+    elif elem == "gmd:otherConstraints":
+        createCharacterElem(element, record.isoconst_text)
+
+    elif elem == "gmd:MD_DataIdentification" and element_path[-1] == "gmd:MD_DataIdentification":
+        # SET LANGUAGE VALUE
+        language_elem = ET.SubElement(element, QN["gmd:language"])
+        setGMXCodeElemAttributes(language_elem, record.language, "LanguageCode")
+
+        # SET ABSTRACT VALUE
+        abstract_elem = ET.SubElement(element, QN["gmd:abstract"])
+        createCharacterElem(abstract_elem, record.abstract)
+
+        # SET MD PROGRESS VALUE
+        status_elem = ET.SubElement(element, QN["gmd:status"])
+        setGMXCodeElemAttributes(status_elem, record.metadata_progress, "MD_ProgressCode")
+
+        # SET MD MAINTENANCE FREQUENCY INFO
+        resourcemaint_elem = ET.SubElement(element, QN["gmd:resourceMaintenance"])
+        md_maintinfo_elem = ET.SubElement(resourcemaint_elem, QN["gmd:MD_MaintenanceInformation"])
+        mainandupdatefreq_elem = ET.SubElement(md_maintinfo_elem, QN["gmd:maintenanceAndUpdateFrequency"])
+        setGMXCodeElemAttributes(mainandupdatefreq_elem, record.maintenance_requency_code, "MD_MaintenanceFrequencyCode")
+
+        # SET KEYWORD ELEMENTS
+        for type, list in record.keywordArray.items():
+            descriptive_keywords_elem = ET.SubElement(element, QN["gmd:descriptiveKeywords"])
+            md_keywords_elem = ET.SubElement(descriptive_keywords_elem, QN["gmd:MD_Keywords"])
+            print(type, list)
+            for value in list:
+                keyword_elem = ET.SubElement(md_keywords_elem, QN["gmd:keyword"])
+                createCharacterElem(keyword_elem, rltw(value))
+            type_elem = ET.SubElement(md_keywords_elem, QN["gmd:type"])
+
+            if "theme" in type:
+                keywordType = "theme"
+            elif "place" in type:
+                keywordType = "place"
+
+            setGMXCodeElemAttributes(type_elem, keywordType, "MD_KeywordTypeCode")
+
+            thesaurusname_elem = ET.SubElement(md_keywords_elem, QN["gmd:thesaurusName"])
+            cicitation_elem = ET.SubElement(thesaurusname_elem, QN["gmd:CI_Citation"])
+            thesetitle_elem = ET.SubElement(cicitation_elem, QN["gmd:title"])
+            if "LCSH" in type:
+                thesaurus = "LCSH"
+            elif "GEOnet" in type:
+                thesaurus = "GEOnet"
+            else:
+                thesaurus = "None"
+            createCharacterElem(thesetitle_elem, thesaurus)
+
+        # ISO 19115 SUBJECT KEY VALUES
+        for topic in record.themeKey_ISOTopics:
+            topiccategory_elem = ET.SubElement(element, QN["gmd:topicCategory"])
+            mdtopiccategory_elem = ET.SubElement(topiccategory_elem, QN["gmd:MD_TopicCategoryCode"])
+            mdtopiccategory_elem.text = topic
+
+        # SPATIAL REPRESENTATION TYPE (vector, grid, tin,  textTable, steroModel, video officially supported)
+        spatialrepresentationtype_elem = ET.SubElement(element, QN["gmd:spatialRepresentationType"])
+        setGMXCodeElemAttributes(spatialrepresentationtype_elem, record.spatial_representation_type_code, "MD_SpatialRepresentationTypeCode")
+
+        # SET SPATIAL EXTENT
+        spatial_extent_parent_elem = ET.SubElement(element, QN["gmd:extent"])
+        ex_extent_elem = ET.SubElement(spatial_extent_parent_elem, QN["gmd:EX_Extent"])
+        geographicelem_elem = ET.SubElement(ex_extent_elem, QN["gmd:geographicElement"])
+        bounding_box_elem = ET.SubElement(geographicelem_elem, QN["gmd:EX_GeographicBoundingBox"])
+
+        def setSpatialBoundsValues(bounds, value):
+            bounds_elem = ET.SubElement(bounding_box_elem, QN["gmd:" + bounds])
+            decimal_elem = ET.SubElement(bounds_elem, "{gco}Decimal")
+            decimal_elem.text = value
+
+        setSpatialBoundsValues("westBoundLongitude", str(record.ds_extent["xmin"]))
+        setSpatialBoundsValues("eastBoundLongitude", str(record.ds_extent["xmax"]))
+        setSpatialBoundsValues("southBoundLatitude", str(record.ds_extent["ymin"]))
+        setSpatialBoundsValues("northBoundLatitude", str(record.ds_extent["ymax"]))
+
+        # SET TEMPORAL EXTENT
+        temporal_extent_parent_elem = ET.SubElement(element, QN["gmd:extent"])
+        ex_extent_elem = ET.SubElement(temporal_extent_parent_elem, QN["gmd:EX_Extent"])
+        temporalelement_elem = ET.SubElement(ex_extent_elem, QN["gmd:temporalElement"])
+        ex_temporalextent_elem = ET.SubElement(temporalelement_elem, QN["gmd:EX_TemporalExtent"])
+        textent_elem = ET.SubElement(ex_temporalextent_elem, QN["gmd:extent"])
+        if "beg_date" in record.dateOfContent:
+            time_perd_elem = ET.SubElement(textent_elem, QN["gml:TimePeriod"])
+            beg_pos_elem = ET.SubElement(time_perd_elem, QN["gml:beginPosition"])
+            end_pos_elem = ET.SubElement(time_perd_elem, QN["gml:endPosition"])
+            beg_pos_elem.text = record.dateOfContent["beg_date"]
+            end_pos_elem.text = record.dateOfContent["end_date"]
+        elif "instant_date" in record.dateOfContent:
+            time_inst_elem = ET.SubElement(textent_elem, QN["gml:TimeInstant"])
+            tim_pos_elem = ET.SubElement(time_inst_elem, QN["gml:timePosition"])
+            instant_date = record.dateOfContent["instant_date"]
+            tim_pos_elem.text = instant_date
+
+    # SET SPATIAL REPRESENTATION INFO FOR VECTOR DATASET
+    elif elem == "gmd:MD_GeometricObjects":
+        geometricobjtype_elem = ET.SubElement(element, QN["gmd:geometricObjectType"])
+        setGMXCodeElemAttributes(geometricobjtype_elem, record.objecttype, "MD_GeometricObjectTypeCode")
+
+        geometricobjcount_elem = ET.SubElement(element, QN["gmd:geometricObjectCount"])
+        integer_elem = ET.SubElement(geometricobjcount_elem, QN["gco:Integer"])
+        integer_elem.text = record.numobjects
+
+    # SET SPATIAL REPRESENTATION INFO FOR RASTER DATASET
+    elif elem == "gmd:MD_Georectified":
+        numberdimensions_elem = ET.SubElement(element, QN["gmd:numberOfDimensions"])
+        integer_elem = ET.SubElement(numberdimensions_elem, QN["gco:Integer"])
+        integer_elem.text = str(len(record.dimensions))
+
+        for k, v in record.dimensions.items():
+            axisdimensionproperties_elem = ET.SubElement(element, QN["gmd:axisDimensionProperties"])
+            md_dimension_elem = ET.SubElement(axisdimensionproperties_elem, QN["gmd:MD_Dimension"])
+            dimensionname_elem = ET.SubElement(md_dimension_elem, QN["gmd:dimensionName"])
+            setGMXCodeElemAttributes(dimensionname_elem, k, "MD_DimensionNameTypeCode")
+            dimensionsize_elem = ET.SubElement(md_dimension_elem, QN["gmd:dimensionSize"])
+            integer_elem = ET.SubElement(dimensionsize_elem, QN["gco:Integer"])
+            integer_elem.text = str(v)
+
+        cellgeometry_elem = ET.SubElement(element, QN["gmd:cellGeometry"])
+        setGMXCodeElemAttributes(cellgeometry_elem, "area", "MD_CellGeometryCode")
+
+    # CREATE DISTRIBUTOR INFO
+    elif elem == "gmd:MD_Distributor":
+        distribcontact_elem = ET.SubElement(element, QN["gmd:distributorContact"])
+        createContactTree(distribcontact_elem, dist_contact, "distributor")
+
+        distribformat_elem = ET.SubElement(element, QN["gmd:distributorFormat"])
+        md_format_elem = ET.SubElement(distribformat_elem, QN["gmd:MD_Format"])
+        formatname_elem = ET.SubElement(md_format_elem, QN["gmd:name"])
+        createCharacterElem(formatname_elem, record.distformat)
+        version_elem = ET.SubElement(md_format_elem, QN["gmd:version"])
+        createCharacterElem(version_elem, "Unknown")
+
+        distribtransfer_elem = ET.SubElement(element, QN["gmd:distributorTransferOptions"])
+        MD_DigitalTransferOptions = ET.SubElement(distribtransfer_elem, QN["gmd:MD_DigitalTransferOptions"])
+        online_elem = ET.SubElement(MD_DigitalTransferOptions, QN["gmd:onLine"])
+        ci_onlineres_elem = ET.SubElement(online_elem, QN["gmd:CI_OnlineResource"])
+        linkage_elem = ET.SubElement(ci_onlineres_elem, QN["gmd:linkage"])
+        url_elem = ET.SubElement(linkage_elem, QN["gco:URL"])
+        url_elem.text = record.purl
+
+    # SET URI ELEMENT
+    elif elem == "gmd:dataSetURI":
+        createCharacterElem(element, record.purl)
+
+    # SET PROJECTION CODE AND CODE SPACE (EPSG)
+    elif elem == "gmd:RS_Identifier":
+        code_elem = ET.SubElement(parent, QN["gmd:code"])
+        createCharacterElem(code_elem,record.referenceSystemCode)
+        codespace_elem = ET.SubElement(parent, QN["gmd:codeSpace"])
+        createCharacterElem(codespace_elem, record.referenceSystemCodeSpace)
+        version_elem = ET.SubElement(parent, QN["gmd:version"])
+        createCharacterElem(version_elem, record.referenceSystemVersion)
+
+    # CREATE LINEAGE ELEMENT IDENTIFYING THE OPERATION PERFORMED IN THIS SCRIPT
+    elif elem == "gmd:LI_Lineage":
+        processstep_elem = ET.SubElement(element, QN["gmd:processStep"])
+        li_processstep_elem = ET.SubElement(processstep_elem, QN["gmd:LI_ProcessStep"])
+        description_elem = ET.SubElement(li_processstep_elem, QN["gmd:description"])
+        process_description = "Metadata for this dataset has been updated or modified as part of an ingest into " + \
+                              metadata_contact["Organization Name"] + " geospatial data repository. As part of this" \
+                                                                      " process the dataset was renamed from " +\
+                              record.datasetname.split(".")[0] + " to " + record.filename + "."
+        createCharacterElem(description_elem, process_description)
+        datetime_elem = ET.SubElement(li_processstep_elem, QN["gmd:dateTime"])
+        gcodatetime_elem = ET.SubElement(datetime_elem, QN["gco:DateTime"])
+        currentdate = datetime.now()
+        formatted_date = currentdate.strftime('%Y-%m-%dT%H:%M:%S')  # 2017-05-31T11:35:23
+        gcodatetime_elem.text = formatted_date
+
+# COLUMNS ADDED TO THE REJECTED ROWS IN THE ERROR REPORT
+errorReportFields = ["Error Row", "Error Stage", "Error"]
+
+# SIMPLE VALIDATION OF CSV ROW VALUES. BASED ON CSV TEMPLATE. RETURNS False FOR A FULLY EMPTY ROW, RAISES ValueError
+#  IF A REQUIRED VALUE IS MISSING OR A VALUE CAN'T BE USED (TITLE, DATES, ISO TOPIC CATEGORIES)
 def validateRow(row, num):
     if all(v == "" for v in row.values()):  # is it a fully empty row?
-        exit()
+        return False
     for k,v in row.items():
         if k != "Metadata Fields" and k != "Feature and Attribute Definitions" and k != "Theme Keywords (Free Text)"\
-                and len(v)== 0:
-            print("ERROR: Empty values in row " + str(num) + " for column '" + k + "'. Exiting")
-            exit()
+                and k not in errorReportFields and len(v)== 0:
+            raise ValueError("Empty values in row " + str(num) + " for column '" + k + "'")
+
+    # THE FILE NAME IS BUILT FROM THE THEME, PLACE AND DATE OF THE TITLE
+    if len(row["Title"].split(",")) < 3:
+        raise ValueError("Title '" + row["Title"] + "' should be formatted Theme, Place, Date")
+    formatDate(row["Publication Date"])
+    formatDate(row["Date of Content"])
+    for themeCode in row['Topic Categories (ISO 19115)'].replace(" ", "").split(","):
+        if themeCode not in isoTopicCategories:
+            raise ValueError("Theme Keyword '" + themeCode + "' is invalid. Must be one of " +
+                             r"https://www2.usgs.gov/science/about/thesaurus-full.php?thcode=15")
+    return True
 
 
 def checkpath(path):
@@ -629,9 +906,245 @@ def checkpath(path):
         return path
 
 
-def csvtoISO(csvfile, data_loc=None, isotemplate=None, rename=True):
+def findDataset(datasetname, data_loc, dsfiles, csvdir):
+    # LOCATE THE ACTUAL DATASET PATH BASED ON FILE NAME. IF A DIRECTORY IS SPECIFIED, MATCH TO A FILE IN THAT
+    #   DIRECTORY. IF NOT, USE PARENT DIRECTORY OF CSV FILE
+    if data_loc != None:
+        # if data_loc is a file, use that as the path. If not, lookup path in dsfiles dictionary
+        if os.path.isfile(data_loc):
+            return data_loc
+        if datasetname not in dsfiles:
+            raise ValueError("Unable to find " + datasetname + " in input data directory " + data_loc)
+        return dsfiles[datasetname]
+
+    ds_path = os.path.join(csvdir, datasetname)
+    if not os.path.exists(ds_path):
+        raise ValueError("Dataset " + datasetname + " cannot be found. Not in the same directory at CSV.")
+    return ds_path
+
+
+class ErrorReport(object):
+    """csv report of the rows of a metadata csv that were rejected, written as they're rejected. Each row keeps all
+    of its original columns followed by errorReportFields, so the report can be fixed and converted again in place
+    of the original csv. The file is only created once there is an error."""
+
+    def __init__(self, report_path):
+        self.report_path = report_path
+        self.fieldnames = None
+        self.count = 0
+        self.file = None
+        self.writer = None
+        # A REPORT LEFT BY AN EARLIER RUN WOULD LIST ROWS THAT MAY SINCE HAVE BEEN FIXED
+        if os.path.exists(report_path):
+            os.remove(report_path)
+
+    def add(self, rownum, stage, row, error):
+        print("\tERROR: Row {} ({}): {}".format(rownum, row.get("Dataset Name"), error))
+        if self.writer is None:
+            fieldnames = [f for f in (self.fieldnames or list(row)) if f not in errorReportFields]
+            self.file = open(self.report_path, "w", newline="")
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames + errorReportFields, extrasaction="ignore")
+            self.writer.writeheader()
+        values = dict(row)
+        values.update({"Error Row": rownum, "Error Stage": stage, "Error": error})
+        self.writer.writerow(values)
+        # FLUSHED PER ROW SO THE REPORT CAN BE FOLLOWED WHILE A LONG RUN IS GOING
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def readMetadataRows(csvfile, data_loc, dsfiles, csvdir, report):
+    """Reads csvfile one row at a time and yields (row number, row, dataset path) for every metadata row that is
+    valid (validateRow) and whose dataset is found. Rejected rows are added to report (an ErrorReport) and skipped.
+    Field identifier, value specifier and example rows are skipped."""
+    with open(csvfile) as f:
+        reader = csv.DictReader(f)
+        report.fieldnames = reader.fieldnames
+        rowcount = 0
+        for row in reader:
+            rowcount += 1
+            if row['Metadata Fields'] == 'Metadata Fields' or row['Metadata Fields'] == 'Values' or row[
+                'Metadata Fields'] == 'Example':
+                continue
+            print(row["Metadata Fields"])
+            try:
+                if not validateRow(row, rowcount):
+                    continue
+                ds_path = findDataset(row["Dataset Name"], data_loc, dsfiles, csvdir)
+            except ValueError as e:
+                report.add(rowcount, "validation", row, str(e))
+                continue
+            yield rowcount, row, ds_path
+
+
+def titleFileName(title):
+    # THE NEW FILE NAME THAT WILL BE CREATED WILL BE BASED ON THE TITLE VALUE AND
+    #   FOLLOWS PLACE_THEME_DATE FORMAT.
+    #   E.G. FOR THE TITLE "Rivers, Arizona, 1993", THE FILE NAME WOULD BE Arizona_Rivers_1993
+    #  IF DATE IS A SPAN, SHOULD BE INDICATED WITH 'TO' (E.G. 2013 TO 2015)
+    title_parse = title.split(",")
+    filename = title_parse[1] + "_" + title_parse[0] + "_" + title_parse[2]
+    for character in filename:
+        if character.lower() not in "abcdefghijklmnopqrstuvwxyz0123456789_":
+            filename = filename.replace(character, "")
+    return filename
+
+
+class ISORecordBuilder(object):
+    """The values of the ISO 19139 record of one csv row, read from the row and its dataset, and the record built
+    from them. Everything a record needs is held here and passed to createElements, so any number of records can
+    be built at once in the same process (threads, async pipelines)."""
+
+    def __init__(self, row, ds_path):
+        self.row = row
+        self.ds_path = ds_path
+        self.tree = None
+        self.anchors = None
+
+        self.datasetname = row["Dataset Name"]
+        datasetname = self.datasetname
+        if os.path.isdir(ds_path):
+            # DIRECTORY OF RASTER TILES (IMAGE PYRAMID)
+            self.dataset_type = "raster"
+        elif datasetname.endswith(".shp") or datasetname.endswith(".gpkg"):
+            self.dataset_type = "vector"
+        elif datasetname.endswith(".tif"):
+            self.dataset_type = "raster"
+        else:
+            raise ValueError("Unknown Dataset Type for " + datasetname + ". Should be shp, gpkg, or tif)")
+        if datasetname.endswith(".shp"):
+            self.distformat = "Shapefile"
+        elif datasetname.endswith(".gpkg"):
+            self.distformat = "GeoPackage"
+
+        self.title = row['Title']  # DONE Field Value
+
+        filename = titleFileName(self.title)
+        self.filename = filename
+
+        self.abstract = row['Abstract']
+        # IF MULTIPLE ORIGINATORS, THEY'LL BE SEPARATED BY COMMAS
+        self.originators = row['Originator(s)'].split(",")
+        self.collection = row['Collection/Series Identification']
+        self.publisher = row['Publisher']
+        self.publicationDate = formatDate(row['Publication Date'])["instant_date"]
+        self.dateOfContent = formatDate(row['Date of Content'])
+        self.accessConstraint = row['Access Constraints']
+        useConstraint = row['Use Constraints']
+        self.isoconst_text = self.accessConstraint + "    |    " + useConstraint
+
+        themeKeywords_LCSH = row['Theme Keywords (LCSH)'].split(",")
+        themeKey_Free = row["Theme Keywords (Free Text)"].split(",")
+        themeKey_Free = [] if len(themeKey_Free) == 1 and len(themeKey_Free[0]) == 0 else themeKey_Free
+        placeKeywords_GEOnet = row['Place Keywords (GEOnet)'].split(",")
+        placeKeywords_LCSH = row['Place Keywords (LCSH)'].split(",")
+        self.keywordArray = {"themeLCSH": themeKeywords_LCSH, "themeFree": themeKey_Free,
+                             "placeGEOnet": placeKeywords_GEOnet, "placeLCSH": placeKeywords_LCSH}
+
+        self.themeKey_ISOTopics = row['Topic Categories (ISO 19115)'].replace(" ", "").split(",")
+        for themeCode in self.themeKey_ISOTopics:
+            if themeCode not in isoTopicCategories:
+                raise ValueError("Theme Keyword '" + themeCode + "' is invalid. Must be one of " +
+                                 r"https://www2.usgs.gov/science/about/thesaurus-full.php?thcode=15")
+        # ATTRIBUTES WILL BE A LIST OF ATTRIBUTES ASSIGNED WITH = AND SEPARATED BY COMMAS
+        #  e.g. zip5=US Zipcode, muKey=Geologic Key Code
+        # NOT CURRENTLY SUPPORTED FOR ISO
+        self.attributeDefinitions = row['Feature and Attribute Definitions'].split(",") if len(
+            row['Feature and Attribute Definitions']) > 0 else []
+
+        for featureDef in self.attributeDefinitions:
+            attribute = rltw(featureDef.split("=")[0])
+            attributeDef = rltw(featureDef.split("=")[1])
+
+        # ONE INSPECTION OF THE DATASET FOR EXTENT, CRS, LAYER INFO AND RASTER SIZE
+        ds_info = getDatasetInfo(ds_path)
+        self.ds_extent = ds_info["extent_wgs84"]
+
+        if self.dataset_type == "vector":
+            self.layerinfo = getLayerInfo(ds_info, self.dataset_type)
+            self.objecttype = self.layerinfo["Type"]
+            self.numobjects = self.layerinfo["Number of Features"]
+            self.spatial_representation_type_code = "vector"
+            self.spatialrepinfo_iso = vectorspatialrepinfo_iso
+        elif self.dataset_type == "raster":
+            # NOTE: ONLY SUPPORTING ROW AND COLUMN DIMENSIONS HERE, SIZED FROM THE RASTER.
+            #   MORE COMPLEX DIMENSION TYPES HERE: http://www.isotc211.org/2005/resources/Codelist/gmxCodelists.xml
+            #   THE SIZE OF AN IMAGE PYRAMID IS ONLY KNOWN IF ITS TILES SHARE A CRS AND RESOLUTION
+            self.dimensions = {}
+            if ds_info["raster_size"] is not None:
+                columns, rows, bands = ds_info["raster_size"]
+                self.dimensions = {"row": rows, "column": columns}
+            self.spatial_representation_type_code = "grid"
+            self.spatialrepinfo_iso = rasterspatialrepinfo_iso
+            self.distformat = "GEOTiff"
+
+        self.referenceSystemCode = str(getEPSGCode(ds_path, ds_info))
+        self.referenceSystemCodeSpace = "EPSG"
+        self.referenceSystemVersion = "9.2"
+
+        self.currentTime = datetime.now()
+
+        self.presentation_form_code = "mapDigital"
+        self.metadata_progress = "completed"
+        self.maintenance_requency_code = "notPlanned"
+
+        self.language = "eng"
+
+        self.purl = purl_prefix + filename.lower()
+
+        self.scope_code = "dataset"
+
+    def build(self, isotemplate):
+        """Builds the record from the template at isotemplate and returns its ElementTree."""
+        # COPY OF THE TEMPLATE SKELETON, PARSED ONCE PER PROCESS
+        self.tree, self.anchors = getISOTemplate(isotemplate).newRecord(self.spatialrepinfo_iso)
+
+        for element_path in recordElementPaths(self.spatialrepinfo_iso):
+            createElements(self, element_path)
+        return self.tree
+
+
+def convertRow(job):
+    """Builds the ISO 19139 record of one csv row and writes it next to the (renamed) dataset. Runs in a worker
+    process of csvtoISO. Returns {"dataset": dataset path, "metadata": xml path}."""
+    row, ds_path, isotemplate, rename, csvdir, staging = job
+
+    record = ISORecordBuilder(row, ds_path)
+    iso_tree = record.build(isotemplate)
+    filename = record.filename
+
+    newfile = filename + "." + ds_path.split(".")[-1] # add extension onto new name
+    if os.path.isdir(ds_path):
+        newfile = filename
+    if not rename:
+        # METADATA IS WRITTEN NEXT TO THE ORIGINAL DATASET
+        new_file_loc = ds_path
+    else:
+        new_file_loc = copyrenameDataset(ds_path, newfile, csvdir, staging=staging)
+
+    # WRITE NEW XML TREE TO FILE
+    print("FILENAME: ", filename)
+    out_xmlfile = new_file_loc + ".xml"
+    writeToFile(iso_tree, out_xmlfile)
+    print("Finished with ", filename)
+
+    return {"dataset": new_file_loc, "metadata": out_xmlfile}
+
+
+def csvtoISO(csvfile, data_loc=None, isotemplate=None, rename=True, processes=None, staging="reflink"):
+    """Converts every metadata row of csvfile to an ISO 19139 xml file. Rows are converted in parallel by a pool of
+    processes (os.cpu_count() by default): finding the dataset extent, EPSG code and layer info, building the xml
+    and staging the dataset (staging is the datasetStaging mode: hardlink, reflink or copy).
+
+    Returns a list of {"dataset": dataset path, "metadata": xml path}, one per converted row in csv order. Rows that
+    fail (validateRow, missing dataset, a renamed dataset name already used by an earlier row, or a conversion error)
+    are left out of the list and written with their row
+    number and the error to <csvfile name>_errors.csv (see ErrorReport), which can be fixed and converted again."""
     # GET PARENT DIRECTORY OF THE CSV FILE
-    global csvdir
     csvdir = os.path.abspath(os.path.join(os.path.abspath(csvfile), os.pardir))
 
     if isotemplate is None:
@@ -645,182 +1158,54 @@ def csvtoISO(csvfile, data_loc=None, isotemplate=None, rename=True):
                 if dsf.endswith(".shp") or dsf.endswith(".tif"):
                     dsf_path = os.path.join(root, dsf)
                     dsfiles[dsf] = dsf_path
-
-    # OPEN CSV FOR READING
-    with open(csvfile) as f:
-        reader = csv.DictReader(f)
-        rowcount = 0
-        # ITERATE ROWS. ALL ROWS THAT AREN'T FIELD IDENTIFIERS, VALUE SPECIFIERS, OR EXAMPLES ARE SKIPPED
-        for row in reader:
-            rowcount += 1
-            if row['Metadata Fields'] != 'Metadata Fields' and row['Metadata Fields'] != 'Values' and row[
-                'Metadata Fields'] != 'Example':
-                print(row["Metadata Fields"])
-                
-                # Initialize xml element value variables
-                global datasetname, filename, iso_tree, iso_troot, dataset_type, title, language, abstract, originators, collection, publisher, publicationDate, dateOfContent, accessConstraint, isoconst_text, keywordArray, themeKey_ISOTopics, attributeDefinitions, referenceSystemCode, referenceSystemCodeSpace, referenceSystemVersion, currentTime, presentation_form_code, metadata_progress, maintenance_requency_code, language, purl, scope_code, distformat, ds_extent, layerinfo, objecttype, numobjects, spatial_representation_type_code, spatialrepinfo_iso, dimensions
-                
-                validateRow(row, rowcount)
-                datasetname = row["Dataset Name"]
-                # LOCATE THE ACTUAL DATASET PATH BASED ON FILE NAME. IF A DIRECTORY IS SPECIFIED, MATCH TO A FILE IN THAT
-                #   DIRECTORY. IF NOT, USE PARENT DIRECTORY OF CSV FILE
-                if data_loc != None:
-                    try:
-                        # if data_loc is a file, use that as the path. If not, lookup path in dsfiles dictionary
-                        if os.path.isfile(data_loc):
-                            dspath = data_loc
-                        else:
-                            ds_path = dsfiles[datasetname]
-                    except KeyError:
-                        print("ERROR: Unable to find ", datasetname, "in input data directory", data_loc,
-                              ". Exiting")
-                        exit()
-                else:
-                    ds_path = os.path.join(csvdir, datasetname)
-                    if not os.path.exists(ds_path):
-                        print("ERROR: Dataset cannot be found. Not in the same directory at CSV.")
-                        exit()
-             
-                if datasetname.endswith(".shp") or datasetname.endswith(".gpkg"):
-                    dataset_type = "vector"
-                elif datasetname.endswith(".tif"):
-                    dataset_type = "raster"
-                else:
-                    print("ERROR: Unknown Dataset Type for " + datasetname + ". Should be shp, gpkg, or tif). Exiting.")
-                    exit()
-                if datasetname.endswith(".shp"):
-                    distformat = "Shapefile"
-                elif datasetname.endswith(".gpkg"):
-                    distformat = "GeoPackage"
-
-                title = row['Title']  # DONE Field Value
-
-                #  IF DATE IS A SPAN, SHOULD BE INDICATED WITH 'TO' (E.G. 2013 TO 2015)
-                title_parse = title.split(",")
-                # THE NEW FILE NAME THAT WILL BE CREATED WILL BE BASED ON THE TITLE VALUE AND
-                #   FOLLOWS PLACE_THEME_DATE FORMAT.
-                #   E.G. FOR THE TITLE "Rivers, Arizona, 1993", THE FILE NAME WOULD BE Arizona_Rivers_1993
-                filename = title_parse[1] + "_" + title_parse[0] + "_" + title_parse[2]
-                for character in filename:
-                    if character.lower() not in "abcdefghijklmnopqrstuvwxyz0123456789_":
-                        filename = filename.replace(character, "")
-
-                abstract = row['Abstract']
-                # IF MULTIPLE ORIGINATORS, THEY'LL BE SEPARATED BY COMMAS
-                originators = row['Originator(s)'].split(",")
-                collection = row['Collection/Series Identification']
-                if collection != "":
-                    collection.split(",")
-                publisher = row['Publisher']
-                publicationDate = formatDate(row['Publication Date'])["instant_date"]
-                dateOfContent = formatDate(row['Date of Content'])
-                accessConstraint = row['Access Constraints']
-                useConstraint = row['Use Constraints']
-                isoconst_text = accessConstraint + "    |    " + useConstraint
-
-                def processKeywordList(keylist):
-                    newlist = []
-                    for item in keylist:
-                        item = rltw(item)
-                        newlist.append(item)
-                    return newlist
-
-                themeKeywords_LCSH = row['Theme Keywords (LCSH)'].split(",")
-                themeKey_Free = row["Theme Keywords (Free Text)"].split(",")
-                themeKey_Free = [] if len(themeKey_Free) == 1 and len(themeKey_Free[0]) == 0 else themeKey_Free
-                placeKeywords_GEOnet = row['Place Keywords (GEOnet)'].split(",")
-                placeKeywords_LCSH = row['Place Keywords (LCSH)'].split(",")
-                keywordArray = {"themeLCSH": themeKeywords_LCSH, "themeFree": themeKey_Free,
-                                "placeGEOnet": placeKeywords_GEOnet, "placeLCSH": placeKeywords_LCSH}
-
-                themeKey_ISOTopics = row['Topic Categories (ISO 19115)'].replace(" ", "").split(",")
-                for themeCode in themeKey_ISOTopics:
-                    if themeCode not in isoTopicCategories:
-                        print("ERROR: Theme Keyword '" + themeCode + "' is invalid. Must be one of " +
-                              r"https://www2.usgs.gov/science/about/thesaurus-full.php?thcode=15")
-                        exit()
-                # ATTRIBUTES WILL BE A LIST OF ATTRIBUTES ASSIGNED WITH = AND SEPARATED BY COMMAS
-                #  e.g. zip5=US Zipcode, muKey=Geologic Key Code
-                # NOT CURRENTLY SUPPORTED FOR ISO
-                attributeDefinitions = row['Feature and Attribute Definitions'].split(",") if len(
-                    row['Feature and Attribute Definitions']) > 0 else []
-
-                for featureDef in attributeDefinitions:
-                    attribute = rltw(featureDef.split("=")[0])
-                    attributeDef = rltw(featureDef.split("=")[1])
-
-                if dataset_type == "vector":
-                    ds_extent = getVectorExtent(data_loc)
-                    layerinfo = getLayerInfo(data_loc)
-                    objecttype = layerinfo["Type"]
-                    numobjects = layerinfo["Number of Features"]
-                    spatial_representation_type_code = "vector"
-                    spatialrepinfo_iso = vectorspatialrepinfo_iso
-                elif dataset_type == "raster":
-                    ds_extent = getRasterExtent(data_loc)
-                    # NOTE: ONLY SUPPORTING MAX OF 4 DIMENSIONS HERE (X,Y,Z,TIME) WITH SINGLE DIMENSION SIZE FOR EACH.
-                    #   MORE COMPLEX DIMENSION TYPES HERE: http://www.isotc211.org/2005/resources/Codelist/gmxCodelists.xml
-                    num_dimensions = ""
-                    dimensions = {}
-                    for dimension in range(1, num_dimensions + 1):
-                        if dimension == 1:
-                            dimensions[dimension] = "row"
-                        elif dimension == 2:
-                            dimensions[dimension] = "column"
-                        elif dimension == 3:
-                            dimensions[dimension] = "vertical"
-                        elif dimension == 4:
-                            dimensions[dimension] = "time"
-                    spatial_representation_type_code = "grid"
-                    spatialrepinfo_iso = rasterspatialrepinfo_iso
-                    distformat = "GEOTiff"
-
-                referenceSystemCode = str(getEPSGCode(data_loc))
-                referenceSystemCodeSpace = "EPSG"
-                referenceSystemVersion = "9.2"
-
-                currentTime = datetime.now()
-
-                presentation_form_code = "mapDigital"
-                metadata_progress = "completed"
-                maintenance_requency_code = "notPlanned"
-
-                language = "eng"
-
-                purl = purl_prefix + filename.lower()
-
-                scope_code = "dataset"
-
-                iso_tree = ET.parse(isotemplate)
-                iso_troot = iso_tree.getroot()
-
-                createElements(mdlanguage_iso)
-                createElements(mdhierarchylevel_iso)
-                createElements(mdcontact_iso)
-                createElements(mddatestamp_iso)
-                createElements(cicitation_iso)
-                createElements(constraints_iso)
-                createElements(identificationinfo_iso)
-                createElements(spatialrepinfo_iso)
-                createElements(refsys_iso)
-                createElements(distributorinfo_iso)
-                createElements(dataquality_iso)
-                createElements(uri_iso)
-
-                
-                newfile = filename + "." + data_loc.split(".")[-1] # add extension onto new name
-                if not rename:
-                    outfile = newfile
-                else:
-                    new_file_loc = copyrenameDataset(data_loc, newfile)
-
-                # WRITE NEW XML TREE TO FILE
-                print("FILENAME: ", filename)
-                out_xmlfile = new_file_loc + ".xml"
-                writeToFile(iso_tree, out_xmlfile)
-                print("Finished with ", filename)
-
-                return {"dataset": new_file_loc, "metadata": out_xmlfile}
+            # DIRECTORIES CAN BE IMAGE PYRAMIDS. A FILE OF THE SAME NAME TAKES PRECEDENCE
+            for dsd in dirs:
+                dsfiles.setdefault(dsd, os.path.join(root, dsd))
+
+    # ROWS ARE STREAMED FROM THE CSV TO THE WORKERS. AT MOST maxPending ROWS ARE READ AHEAD OF THE OLDEST ROW STILL
+    #  BEING CONVERTED, SO MEMORY DOESN'T GROW WITH THE SIZE OF THE CSV
+    report = ErrorReport(os.path.splitext(os.path.abspath(csvfile))[0] + "_errors.csv")
+    results = []
+    workers = processes if processes else os.cpu_count()
+    maxPending = workers * 4
+    pending = deque()
+    # ROW NUMBER OF THE ROW STAGING EACH RENAMED DATASET NAME. ROWS RUN CONCURRENTLY, SO A SECOND ROW OF THE SAME NAME
+    #  WOULD OVERWRITE THE FIRST ONE'S FILES AND .sha256 IN RenamedDatasets
+    staged_names = {}
+
+    def collect(rownum, row, future):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            report.add(rownum, "conversion", row, "{}: {}".format(type(e).__name__, e))
+
+    print("\n...Converting csv rows with {} worker processes...".format(workers))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for rownum, row, ds_path in readMetadataRows(csvfile, data_loc, dsfiles, csvdir, report):
+                if rename:
+                    # COMPARED WITHOUT CASE, AS ON CASE INSENSITIVE FILESYSTEMS
+                    name = titleFileName(row["Title"]).lower()
+                    if name in staged_names:
+                        report.add(rownum, "validation", row, "Renamed dataset {} is already staged by row {}"
+                                   .format(titleFileName(row["Title"]), staged_names[name]))
+                        continue
+                    staged_names[name] = rownum
+                job = (row, ds_path, isotemplate, rename, csvdir, staging)
+                pending.append((rownum, row, executor.submit(convertRow, job)))
+                # COLLECT IN ROW ORDER SO THE RESULTS FOLLOW THE CSV
+                if len(pending) >= maxPending:
+                    collect(*pending.popleft())
+            while pending:
+                collect(*pending.popleft())
+    finally:
+        report.close()
+
+    print("\nFINISHED. {} rows converted, {} failed".format(len(results), report.count))
+    if report.count:
+        print("Rejected rows, with the error of each, are in " + report.report_path)
+
+    return results
 
 
 if __name__ == "__main__":
@@ -843,6 +1228,11 @@ if __name__ == "__main__":
                              "(shp or tif) should be copied and renamed to a"
                              " folder RenamedDatasets in the parent dir of"
                              " --csvfile argument. Default is False")
+    parser.add_argument("-p", "--processes", type=int,
+                        help="NUMBER OF WORKER PROCESSES CONVERTING ROWS IN PARALLEL. DEFAULT IS THE NUMBER OF CPUS.")
+    parser.add_argument("-s", "--staging", type=str, choices=stagingModes, default="reflink",
+                        help="HOW RENAMED DATASETS ARE STAGED: hardlink (SHARES THE ORIGINAL FILES), reflink (COPY ON"
+                             " WRITE CLONE WHERE SUPPORTED) OR copy. EACH FALLS BACK TO A PLAIN COPY. DEFAULT IS reflink.")
 
 
 
@@ -852,4 +1242,5 @@ if __name__ == "__main__":
 
     datasetdirectory = checkpath(args.datadir) if args.datadir else None
 
-    csvtoISO(csvfile, datasetdirectory, isotemplate=isotemplate, rename=args.rename)
+    csvtoISO(csvfile, datasetdirectory, isotemplate=isotemplate, rename=args.rename, processes=args.processes,
+             staging=args.staging)
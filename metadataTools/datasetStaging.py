@@ -0,0 +1,212 @@
+# STAGES A DATASET UNDER A NEW NAME (E.G. INTO RenamedDatasets) WITHOUT COPYING ITS BYTES WHERE THE FILESYSTEM ALLOWS
+#  IT. EVERY FILE OF THE DATASET GROUP (A SHAPEFILE'S .shp, .dbf, .shx, .prj, .cpg, .sbn, ..., A GEOTIFF'S .tfw,
+#  .tif.aux.xml, .ovr, OR EVERY TILE OF AN IMAGE PYRAMID DIRECTORY) IS STAGED IN A TEMPORARY DIRECTORY NEXT TO THE
+#  DESTINATION AND ONLY RENAMED INTO PLACE ONCE THE WHOLE GROUP IS THERE, SO A FAILED ROW NEVER LEAVES HALF A DATASET.
+#
+# STAGING MODES, EACH FALLING BACK TO THE NEXT METHOD IF THE FILESYSTEM DOESN'T SUPPORT IT
+#   hardlink    os.link, THEN AS reflink. NO DATA IS WRITTEN, BUT THE STAGED FILES ARE THE ORIGINAL FILES, SO EDITING
+#               ONE EDITS THE OTHER
+#   reflink     COPY ON WRITE CLONE (FICLONE ON btrfs, XFS, ...), THEN os.copy_file_range (DONE IN THE KERNEL, OR BY
+#               THE SERVER ON NFS/SMB), THEN A CHUNKED COPY. THE DEFAULT
+#   copy        CHUNKED COPY ONLY
+#
+# A SHA-256 CHECKSUM OF EVERY STAGED FILE IS COMPUTED AS IT'S COPIED (FOR LINKS AND CLONES THE SOURCE IS READ ONCE,
+#  NOTHING IS WRITTEN) AND WRITTEN TO <new name>.sha256 IN sha256sum FORMAT, SO THE STAGED DATASET CAN BE VERIFIED
+#  WITH sha256sum -c.
+
+import errno, hashlib, os, shutil, tempfile
+
+stagingModes = ("hardlink", "reflink", "copy")
+copyChunkSize = 8 * 1024 * 1024
+# _IOW(0x94, 9, int) FROM linux/fs.h
+FICLONE = 0x40049409
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+# FILES STAGED ALONG WITH A DATASET, BY THE EXTENSION OF ITS MAIN FILE. SUFFIXES ARE WHAT FOLLOWS THE STEM ("roads")
+sidecarSuffixes = {".shp": (".shx", ".dbf", ".prj", ".cpg", ".sbn", ".sbx", ".qix", ".shp.xml"),
+                   ".tif": (".tfw", ".tif.aux.xml", ".ovr", ".tif.ovr", ".tif.msk"),
+                   ".tiff": (".tfw", ".tiff.aux.xml", ".ovr", ".tiff.ovr", ".tiff.msk")}
+
+# ERRORS MEANING "NOT POSSIBLE HERE" (CROSS DEVICE, UNSUPPORTED BY THE FILESYSTEM, ...), AS OPPOSED TO A REAL I/O ERROR
+unsupportedErrors = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.EINVAL, errno.EPERM,
+                     errno.ENOTTY, errno.EBADF, errno.EMLINK)
+
+
+def gdalFileList(infile):
+    # FILES GDAL CONSIDERS PART OF infile, OR [] IF GDAL ISN'T AVAILABLE OR CAN'T OPEN IT
+    if gdal is None:
+        return []
+    try:
+        dataset = gdal.OpenEx(infile)
+    except RuntimeError:
+        return []
+    if dataset is None:
+        return []
+    files = dataset.GetFileList() or []
+    dataset = None
+    return [os.path.abspath(f) for f in files]
+
+
+def datasetGroup(infile):
+    """Returns [(source path, suffix)] of every file belonging to the dataset infile: for "roads.shp" the file itself
+    and the sidecars of its format (roads.dbf, roads.shx, roads.shp.xml, ... see sidecarSuffixes, plus any other file
+    GDAL lists for the dataset), with the suffix being the part after "roads". Other datasets sharing the stem
+    (roads.tif, roads.v2.shp) are left out. A directory (image pyramid) is returned as every file under it, with the
+    suffix being its relative path."""
+    if os.path.isdir(infile):
+        group = []
+        for root, dirs, files in os.walk(infile):
+            for file in files:
+                path = os.path.join(root, file)
+                group.append((path, os.sep + os.path.relpath(path, infile)))
+        return sorted(group)
+
+    infile = os.path.abspath(infile)
+    datadir = os.path.dirname(infile)
+    stem, ext = os.path.splitext(os.path.basename(infile))
+    suffixes = set(s.lower() for s in (ext,) + sidecarSuffixes.get(ext.lower(), ()))
+    gdal_files = set(gdalFileList(infile))
+
+    group = []
+    for file in os.listdir(datadir):
+        path = os.path.join(datadir, file)
+        if not file.lower().startswith(stem.lower()) or not os.path.isfile(path):
+            continue
+        suffix = file[len(stem):]
+        if suffix.lower() in suffixes or path in gdal_files:
+            group.append((path, suffix))
+    return sorted(group)
+
+
+def reflinkFile(src_fd, dst_fd):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "FICLONE not available")
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def copyFileRange(src_fd, dst_fd, size):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range not available")
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(src_fd, dst_fd, size - copied)
+        if count == 0:
+            break
+        copied += count
+    if copied != size:
+        raise OSError(errno.EIO, "copy_file_range copied {} of {} bytes".format(copied, size))
+
+
+def chunkedCopy(src, dst, digest):
+    # COPIES AND CHECKSUMS IN ONE READ OF THE SOURCE
+    buf = bytearray(copyChunkSize)
+    view = memoryview(buf)
+    with open(src, "rb") as ifile, open(dst, "wb") as ofile:
+        while True:
+            count = ifile.readinto(buf)
+            if not count:
+                break
+            if digest is not None:
+                digest.update(view[:count])
+            ofile.write(view[:count])
+
+
+def checksumFile(path, digest):
+    buf = bytearray(copyChunkSize)
+    view = memoryview(buf)
+    with open(path, "rb") as ifile:
+        while True:
+            count = ifile.readinto(buf)
+            if not count:
+                break
+            digest.update(view[:count])
+
+
+def stageFile(src, dst, mode="reflink", checksum=True):
+    """Stages src at dst (which must not exist) with the cheapest method mode allows. Returns (method, sha256 hex
+    digest or None)."""
+    if mode not in stagingModes:
+        raise ValueError("Unknown staging mode {}. Use one of {}".format(mode, ", ".join(stagingModes)))
+    digest = hashlib.sha256() if checksum else None
+
+    method = None
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            method = "hardlink"
+        except OSError as e:
+            if e.errno not in unsupportedErrors:
+                raise
+
+    if method is None and mode in ("hardlink", "reflink"):
+        size = os.path.getsize(src)
+        with open(src, "rb") as ifile, open(dst, "wb") as ofile:
+            for name, func in (("reflink", lambda: reflinkFile(ifile.fileno(), ofile.fileno())),
+                               ("copy_file_range", lambda: copyFileRange(ifile.fileno(), ofile.fileno(), size))):
+                try:
+                    func()
+                    method = name
+                    break
+                except OSError as e:
+                    if e.errno not in unsupportedErrors:
+                        raise
+                    # START OVER FROM AN EMPTY FILE
+                    ofile.seek(0)
+                    ofile.truncate()
+                    ifile.seek(0)
+
+    if method is None:
+        chunkedCopy(src, dst, digest)
+        method = "copy"
+    elif digest is not None:
+        # NOTHING WENT THROUGH PYTHON, SO THE SOURCE IS READ ONCE FOR THE CHECKSUM
+        checksumFile(src, digest)
+
+    if method != "hardlink":
+        shutil.copymode(src, dst)
+    return method, digest.hexdigest() if digest is not None else None
+
+
+def stageDataset(infile, outdir, newname, mode="reflink", checksum=True, exclude=()):
+    """Stages the dataset group of infile (see datasetGroup) in outdir under newname, e.g. roads.shp staged as
+    Roads_Arizona_2020.shp brings Roads_Arizona_2020.dbf, .shx, .prj, ... along. Source files in exclude are left
+    out. Existing files of the same names are replaced. Returns the path of the staged dataset."""
+    newstem = newname if os.path.isdir(infile) else os.path.splitext(newname)[0]
+    group = [(src, suffix) for src, suffix in datasetGroup(infile) if src not in exclude]
+    os.makedirs(outdir, exist_ok=True)
+
+    # STAGE NEXT TO THE DESTINATION (SAME FILESYSTEM) SO THE FINAL RENAMES CAN'T FAIL HALF WAY FOR LACK OF SPACE
+    tmpdir = tempfile.mkdtemp(prefix=".staging_" + newstem + "_", dir=outdir)
+    try:
+        staged = []
+        methods = {}
+        for src, suffix in group:
+            tmp = os.path.join(tmpdir, newstem + suffix)
+            os.makedirs(os.path.dirname(tmp), exist_ok=True)
+            method, sha256 = stageFile(src, tmp, mode=mode, checksum=checksum)
+            methods[method] = methods.get(method, 0) + 1
+            staged.append((tmp, os.path.join(outdir, newstem + suffix), sha256))
+
+        for tmp, dst, sha256 in staged:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(tmp, dst)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if checksum:
+        with open(os.path.join(outdir, newstem + ".sha256"), "w") as ofile:
+            for tmp, dst, sha256 in staged:
+                ofile.write("{}  {}\n".format(sha256, os.path.relpath(dst, outdir).replace(os.sep, "/")))
+
+    print("Staged {} file(s) of {} as {} ({})".format(len(staged), os.path.basename(infile), newstem,
+                                                    ", ".join("{} {}".format(n, m) for m, n in sorted(methods.items()))))
+    return os.path.join(outdir, newname)
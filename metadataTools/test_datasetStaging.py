@@ -0,0 +1,47 @@
+# TESTS OF datasetStaging.py. RUN WITH python -m pytest metadataTools OR python -m unittest FROM metadataTools
+
+import os, shutil, tempfile, unittest
+import datasetStaging
+from datasetStaging import datasetGroup, stageDataset
+
+
+class DatasetGroupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.datadir, ignore_errors=True)
+        # roads.shp, A RASTER SHARING ITS STEM AND A SECOND SHAPEFILE roads.v2 IN THE SAME DIRECTORY
+        for name in ("roads.shp", "roads.shx", "roads.dbf", "roads.prj", "roads.cpg", "roads.shp.xml",
+                     "roads.tif", "roads.tfw", "roads.tif.aux.xml",
+                     "roads.v2.shp", "roads.v2.shx", "roads.v2.dbf", "roads.v2.prj",
+                     "roadsides.shp", "notes.txt"):
+            with open(os.path.join(self.datadir, name), "w") as ofile:
+                ofile.write(name)
+        gdal, datasetStaging.gdal = datasetStaging.gdal, None
+        self.addCleanup(setattr, datasetStaging, "gdal", gdal)
+
+    def suffixes(self, name):
+        return [suffix for path, suffix in datasetGroup(os.path.join(self.datadir, name))]
+
+    def test_shapefile_group_is_its_sidecars(self):
+        self.assertEqual(self.suffixes("roads.shp"), [".cpg", ".dbf", ".prj", ".shp", ".shp.xml", ".shx"])
+
+    def test_raster_group_is_its_sidecars(self):
+        self.assertEqual(self.suffixes("roads.tif"), [".tfw", ".tif", ".tif.aux.xml"])
+
+    def test_dotted_stem(self):
+        self.assertEqual(self.suffixes("roads.v2.shp"), [".dbf", ".prj", ".shp", ".shx"])
+
+    def test_stage_renames_only_the_group(self):
+        outdir = os.path.join(self.datadir, "out")
+        staged = stageDataset(os.path.join(self.datadir, "roads.shp"), outdir, "Roads_2020.shp", mode="copy")
+        self.assertEqual(staged, os.path.join(outdir, "Roads_2020.shp"))
+        self.assertEqual(sorted(os.listdir(outdir)),
+                         ["Roads_2020.cpg", "Roads_2020.dbf", "Roads_2020.prj", "Roads_2020.sha256", "Roads_2020.shp",
+                          "Roads_2020.shp.xml", "Roads_2020.shx"])
+        with open(os.path.join(outdir, "Roads_2020.dbf")) as ifile:
+            self.assertEqual(ifile.read(), "roads.dbf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+# FOOTPRINT INDEX OF AN IMAGE PYRAMID DIRECTORY (E.G. A NAIP COLLECTION OF THOUSANDS OF GEOTIFF TILES). THE HEADER OF
+#  EACH TILE (GEOTRANSFORM, SIZE AND CRS) IS READ IN A POOL OF THREADS, ITS CORNERS ARE REPROJECTED TO WGS84, AND THE
+#  FOOTPRINTS ARE WRITTEN AS A GEOJSON FeatureCollection. BY DEFAULT THE INDEX IS KEPT WITH THE DATASET PROBE CACHE,
+#  NOT IN THE DATA TREE: <directory name>_<hash of its path>.geojson IN ~/.geoportaltools/tile_indexes, OR IN THE
+#  DIRECTORY NAMED BY THE GEOPORTAL_TILE_INDEX_DIR ENVIRONMENT VARIABLE. buildTileIndex CAN ALSO BE GIVEN ITS PATH.
+#
+# THE INDEX ALSO SERVES AS A CACHE: EVERY FEATURE KEEPS THE SIZE AND MODIFIED TIME OF ITS TILE, AND WHEN THE INDEX IS
+#  REBUILT ONLY TILES THAT ARE NEW OR CHANGED ARE OPENED. TILES NO LONGER IN THE DIRECTORY ARE DROPPED.
+
+import hashlib, json, os, time
+from concurrent.futures import ThreadPoolExecutor
+from osgeo import gdal, osr
+
+tileIndexLocation = os.environ.get("GEOPORTAL_TILE_INDEX_DIR",
+                                   os.path.join(os.path.expanduser("~"), ".geoportaltools", "tile_indexes"))
+tileExtensions = (".tif", ".tiff")
+
+
+def tileIndexPath(pyramid_dir, index_dir=None):
+    # DEFAULT INDEX FILE OF pyramid_dir. THE HASH OF THE ABSOLUTE PATH KEEPS PYRAMIDS OF THE SAME NAME APART
+    if index_dir is None:
+        index_dir = tileIndexLocation
+    pyramid_dir = os.path.abspath(pyramid_dir)
+    key = hashlib.sha1(pyramid_dir.encode("utf8")).hexdigest()[:16]
+    return os.path.join(index_dir, "{}_{}.geojson".format(os.path.basename(pyramid_dir), key))
+
+
+def findTiles(pyramid_dir):
+    # {PATH RELATIVE TO pyramid_dir: (SIZE, MTIME)} OF EVERY TILE UNDER pyramid_dir
+    tiles = {}
+    for root, dirs, files in os.walk(pyramid_dir):
+        for file in files:
+            if file.lower().endswith(tileExtensions):
+                path = os.path.join(root, file)
+                st = os.stat(path)
+                tiles[os.path.relpath(path, pyramid_dir).replace(os.sep, "/")] = (st.st_size, st.st_mtime)
+    return tiles
+
+
+def readTileHeader(tile_path):
+    """Returns the GeoJSON feature of a tile: its WGS84 footprint (the four corners of the geotransform) with the
+    EPSG code, geotransform and size of the tile as properties. Only the tile header is read."""
+    ds = gdal.Open(tile_path)
+    if ds is None:
+        raise ValueError("Unable to open tile {}".format(tile_path))
+    gt = ds.GetGeoTransform()
+    cols, rows = ds.RasterXSize, ds.RasterYSize
+
+    # CHECKED HERE, AS AN EMPTY CRS MAY FAIL LATER WITH ANY KIND OF ERROR
+    if not ds.GetProjection():
+        raise ValueError("tile has no CRS")
+    src_srs = osr.SpatialReference()
+    src_srs.ImportFromWkt(ds.GetProjection())
+    if src_srs.IsEmpty():
+        raise ValueError("tile has no CRS")
+    try:
+        src_srs.AutoIdentifyEPSG()
+    except RuntimeError:
+        pass
+    epsg = src_srs.GetAuthorityCode(None)
+    tgt_srs = osr.SpatialReference()
+    tgt_srs.ImportFromEPSG(4326)
+    for srs in (src_srs, tgt_srs):
+        # LONGITUDE, LATITUDE ORDER WITH GDAL 3+
+        if hasattr(srs, "SetAxisMappingStrategy"):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(src_srs, tgt_srs)
+
+    corners = []
+    for px, py in ((0, 0), (cols, 0), (cols, rows), (0, rows)):
+        corners.append((gt[0] + px * gt[1] + py * gt[2], gt[3] + px * gt[4] + py * gt[5]))
+    ring = [list(p[:2]) for p in transform.TransformPoints(corners)]
+    ring.append(ring[0])
+
+    return {"type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+            "properties": {"epsg": epsg, "geotransform": list(gt), "columns": cols, "rows": rows,
+                           "bands": ds.RasterCount}}
+
+
+def loadTileIndex(index_path):
+    # {TILE PATH: FEATURE} OF AN EXISTING INDEX
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r") as ifile:
+        try:
+            collection = json.load(ifile)
+        except ValueError:
+            print("WARNING: Unreadable tile index {}. Rebuilding it.".format(index_path))
+            return {}
+    return {feature["properties"]["tile"]: feature for feature in collection.get("features", [])}
+
+
+def buildTileIndex(pyramid_dir, index_path=None, threads=16):
+    """Indexes the tiles of pyramid_dir (see module notes) and returns a summary with the WGS84 union extent
+    (extent_wgs84), the EPSG code shared by all tiles (epsg, None if they differ), the size of the mosaic as
+    [columns, rows, bands] (raster_size, None unless all tiles share a CRS and pixel size), the number of tiles and
+    how many of them had to be read. The index is written to index_path, by default tileIndexPath(pyramid_dir)."""
+    if index_path is None:
+        index_path = tileIndexPath(pyramid_dir)
+    start = time.time()
+
+    tiles = findTiles(pyramid_dir)
+    indexed = loadTileIndex(index_path)
+
+    features = {}
+    to_read = []
+    for tile, (size, mtime) in tiles.items():
+        feature = indexed.get(tile)
+        if feature is not None and feature["properties"]["size"] == size and feature["properties"]["mtime"] == mtime:
+            features[tile] = feature
+        else:
+            to_read.append(tile)
+
+    def readTile(tile):
+        try:
+            return tile, readTileHeader(os.path.join(pyramid_dir, tile))
+        except (ValueError, RuntimeError) as e:
+            print("WARNING: Skipping tile {}: {}".format(tile, e))
+            return tile, None
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for tile, feature in executor.map(readTile, to_read):
+            if feature is None:
+                continue
+            feature["properties"]["tile"] = tile
+            feature["properties"]["size"], feature["properties"]["mtime"] = tiles[tile]
+            features[tile] = feature
+
+    if len(features) == 0:
+        print("ERROR: No readable tiles found in {}".format(pyramid_dir))
+        raise ValueError
+
+    ordered = [features[tile] for tile in sorted(features)]
+    if os.path.dirname(index_path):
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmpfile = index_path + ".tmp"
+    with open(tmpfile, "w") as ifile:
+        json.dump({"type": "FeatureCollection", "features": ordered}, ifile)
+    os.replace(tmpfile, index_path)
+
+    summary = summarizeTiles(ordered)
+    summary["tiles"] = len(ordered)
+    summary["tiles_read"] = len(to_read)
+    summary["index"] = index_path
+    print("Indexed {} tiles of {} ({} read, {} unchanged) in {:.1f}s".format(len(ordered), pyramid_dir, len(to_read),
+                                                                          len(ordered) - len(to_read),
+                                                                          time.time() - start))
+    return summary
+
+
+def summarizeTiles(features):
+    xvalues = [p[0] for f in features for p in f["geometry"]["coordinates"][0]]
+    yvalues = [p[1] for f in features for p in f["geometry"]["coordinates"][0]]
+    extent = {"xmin": min(xvalues), "xmax": max(xvalues), "ymin": min(yvalues), "ymax": max(yvalues)}
+
+    epsgs = set(f["properties"]["epsg"] for f in features)
+    epsg = epsgs.pop() if len(epsgs) == 1 else None
+
+    # MOSAIC SIZE FROM THE NATIVE UNION OF THE TILES, IF THEY LINE UP ON THE SAME GRID RESOLUTION
+    raster_size = None
+    resolutions = set((f["properties"]["geotransform"][1], f["properties"]["geotransform"][5]) for f in features)
+    if epsg is not None and len(resolutions) == 1:
+        xres, yres = resolutions.pop()
+        xs, ys = [], []
+        for f in features:
+            gt, p = f["properties"]["geotransform"], f["properties"]
+            xs.extend([gt[0], gt[0] + p["columns"] * gt[1]])
+            ys.extend([gt[3], gt[3] + p["rows"] * gt[5]])
+        raster_size = [int(round((max(xs) - min(xs)) / abs(xres))), int(round((max(ys) - min(ys)) / abs(yres))),
+                       max(f["properties"]["bands"] for f in features)]
+
+    return {"extent_wgs84": extent, "epsg": epsg, "raster_size": raster_size}
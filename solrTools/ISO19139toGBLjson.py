@@ -6,18 +6,40 @@
 #  TO A NEW DIRECTORY BASED ON THE HASH. SEE THE setOutDir FUNCTION FOR MORE INFO.
 
 # VARIABLES OF NOTE
-#   IF THE tosolr ARGUMENT IS PASSED THE JSON STRING WILL BE POSTED IN AN UPDATE REQUEST TO THE SOLR COLLECTION URL
-#  SPECIFIED IN THE solr_loc variable
+#   IF THE tosolr ARGUMENT IS PASSED THE RECORDS WILL BE POSTED IN BATCHED UPDATE REQUESTS TO THE SOLR COLLECTION URL
+#  SPECIFIED IN THE solr_loc variable (SEE solrSink.py)
 #   THE LIST OF COLLECTIONS (collections) WHICH THE RECORD BELONGS TO IS DERIVED FROM THE EXISTING DIRECTORY STRUCTURE
 #  WHERE THE XML FILE IS HELD. E.G. IF THE XML FILE IS IN "./imagery/aerial photographs/USDA/NAIP/" THE COLLECTION LIST
 #  IN THE JSON WILL BE [imagery, aerial photographs, USDA, NAIP]
 
-import json, os, ogr, re, shutil, requests, argparse, struct, base64
+import json, os, sys, re, shutil, argparse, time, threading, inspect, importlib.util
 from lxml import etree as ET
 from collections import OrderedDict
-from xml.dom import minidom as md
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from fnv64basedhash import hash_dn
-import geopandas as gpd
+from layersIndex import appendLayersJournal, compactLayersJournal
+from solrSink import SolrSink
+from conversionManifest import manifestFileName, loadManifest, saveManifest, checkRecord, deletedRecords
+from pathPlanner import cleanHash, resaltHash, hashedDirList, planHashedPaths
+
+def importShared(name):
+    # LOADS A MODULE SHARED BY metadataTools AND solrTools FROM THE ROOT OF THE REPOSITORY WITHOUT ADDING THE ROOT TO
+    #  sys.path. A MODULE ALREADY IMPORTED UNDER THAT NAME (E.G. BY A CALLER WITH THE ROOT ON ITS PATH) IS REUSED
+    if name not in sys.modules:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, name + ".py")
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[name]
+            raise
+    return sys.modules[name]
+
+
+# datasetProbe.py (SHARED WITH metadataTools) IS AT THE ROOT OF THE REPOSITORY
+getDatasetFacts = importShared("datasetProbe").getDatasetFacts
 
 
 isoTopicCategoriesMap = {"farming": "Farming",
@@ -56,6 +78,11 @@ ET.register_namespace("gml", gml)
 ET.register_namespace("gco", gco)
 ET.register_namespace("gts", gts)
 
+# Apache Solr Collection URL. E.g. http://localhost:8080/solr/collection1
+solr_loc = "http://geotest.library.arizona.edu:8983/solr/UAL_GeospatialRecords"
+# RECORDS SOLR DIDN'T ACCEPT ARE APPENDED TO THIS FILE IN THE OUTPUT DIRECTORY, ONE JSON DOCUMENT PER LINE
+solrFailedFileName = "solr_failed.jsonl"
+
 def checkpath(path):
     path = os.path.abspath(path)
     if not os.path.exists(path):
@@ -65,14 +92,13 @@ def checkpath(path):
         return path
 
 
-def findFile(xmlFile, filelist):
-    dataName = xmlFile[:-4]  # Remove xml extension, should still have data extension (.tif or .shp)
-    try:
-        fpath = filelist[dataName]
-        return fpath
-    except:
-        print("ERROR: Unable to find the geospatial dataset %s in the data directory %s. Exiting." % (dataName, datadir))
-        exit()
+def findFile(xmlFile, filelist, datadir=None):
+    # datadir IS ONLY USED IN THE ERROR MESSAGE
+    dataName = os.path.basename(xmlFile)[:-4]  # Remove xml extension, should still have data extension (.tif or .shp)
+    if dataName not in filelist:
+        raise ValueError("Unable to find the geospatial dataset %s in the data directory %s"
+                         % (dataName, datadir if datadir else "list"))
+    return filelist[dataName]
 
 
 def getDatasetDataTypes(datafile, single_layer=True):
@@ -88,8 +114,8 @@ def getDatasetDataTypes(datafile, single_layer=True):
     if ext == "tif":
         return "Raster", "Image", single_layer
     elif ext == "shp" or ext == "gpkg":
-        df = gpd.read_file(datafile)
-        geom_type = df.geometry.iloc[0].geom_type
+        # HEADER PROBE, CACHED ACROSS RUNS BY PATH, SIZE AND MODIFIED TIME (SEE datasetProbe.py)
+        geom_type = getDatasetFacts(datafile)["geom_type"]
        
         if "point" in geom_type.lower():
             geomFormat = "Point"
@@ -97,6 +123,9 @@ def getDatasetDataTypes(datafile, single_layer=True):
             geomFormat = "Line"
         elif "polygon" in geom_type.lower():
             geomFormat = "Polygon"
+        else:
+            print("ERROR: Unknown geometry type {} for dataset {}".format(geom_type, datafile))
+            raise ValueError
             
         return geomFormat, "Dataset", single_layer
 
@@ -109,63 +138,176 @@ def getSlugWords(file):
     return (wordstring)
 
 
-def getSingleValue(etroot, path):
-    path_string = ""
-    for i in range(0, len(path) - 1):
-        path_string += path[i]
-        if i != len(path) - 1:
-            path_string += "/"
-    element = etroot.find(path_string, namespaces)
-    text = element.text
-
-    return (text)
-
-
-def getMultipleValues(etroot, path):
-    values = []
-    path_string = ""
-    for i in range(0, len(path) - 1):
-        path_string += path[i]
-        if i != len(path) - 1:
-            path_string += "/"
-    elements = etroot.findall(path_string, namespaces)
-    for element in elements:
-        value = element.text
-        values.append(value)
-    return (values)
-
-
-def getKeywordList(etroot, type):
+# GEOBLACKLIGHT VALUES READ FROM THE ISO RECORD, AS XPATHS TO THE ELEMENT HOLDING THE VALUE. WHERE A PATH ENDS IN
+#  /* THE VALUE IS THE TEXT OF THE FIRST CHILD, WHATEVER gco TYPE WRAPS IT (gco:CharacterString, gco:Date, ...).
+#  PATHS ARE COMPILED ONCE AT IMPORT.
+# PATHS RELATIVE TO THE ROOT gmd:MD_Metadata ELEMENT
+rootFieldPaths = OrderedDict([
+    ("dc_identifier_s", "gmd:dataSetURI/*"),
+    ("layer_modified_dt", "gmd:dateStamp/*"),
+    ("dc_format_s", "gmd:distributionInfo/gmd:MD_Distribution/gmd:distributor/gmd:MD_Distributor/gmd:distributorFormat/"
+                    "gmd:MD_Format/gmd:name/*"),
+    ("dc_language_s", "gmd:language/*"),
+])
+
+# PATH TO THE gmd:MD_DataIdentification ELEMENT. IT'S RESOLVED ONCE PER RECORD AND THE PATHS BELOW ARE RELATIVE TO IT
+dataIdentificationPath = "gmd:identificationInfo/gmd:MD_DataIdentification"
+
+dataIdentificationFieldPaths = OrderedDict([
+    ("dc_title_s", "gmd:citation/gmd:CI_Citation/gmd:title/*"),
+    ("dc_description_s", "gmd:abstract/*"),
+    ("dct_issued_s", "gmd:citation/gmd:CI_Citation/gmd:date/gmd:CI_Date/gmd:date/*"),
+    ("begin_date", "gmd:extent/gmd:EX_Extent/gmd:temporalElement/gmd:EX_TemporalExtent/gmd:extent/gml:TimePeriod/"
+                   "gml:beginPosition"),
+    ("end_date", "gmd:extent/gmd:EX_Extent/gmd:temporalElement/gmd:EX_TemporalExtent/gmd:extent/gml:TimePeriod/"
+                 "gml:endPosition"),
+    ("instant_date", "gmd:extent/gmd:EX_Extent/gmd:temporalElement/gmd:EX_TemporalExtent/gmd:extent/gml:TimeInstant/"
+                     "gml:timePosition"),
+    ("west_bound", "gmd:extent/gmd:EX_Extent/gmd:geographicElement/gmd:EX_GeographicBoundingBox/gmd:westBoundLongitude/*"),
+    ("east_bound", "gmd:extent/gmd:EX_Extent/gmd:geographicElement/gmd:EX_GeographicBoundingBox/gmd:eastBoundLongitude/*"),
+    ("north_bound", "gmd:extent/gmd:EX_Extent/gmd:geographicElement/gmd:EX_GeographicBoundingBox/gmd:northBoundLatitude/*"),
+    ("south_bound", "gmd:extent/gmd:EX_Extent/gmd:geographicElement/gmd:EX_GeographicBoundingBox/gmd:southBoundLatitude/*"),
+])
+
+topicCategoryPath = "gmd:topicCategory/*"
+
+# KEYWORDS OF A GIVEN gmd:MD_KeywordTypeCode ($type) AND ORGANISATION NAME OF A GIVEN gmd:CI_RoleCode ($role)
+keywordPath = "gmd:descriptiveKeywords/gmd:MD_Keywords[gmd:type/gmd:MD_KeywordTypeCode = $type]/gmd:keyword/*[1]"
+organizationPath = "gmd:citation/gmd:CI_Citation/gmd:citedResponsibleParty/gmd:CI_ResponsibleParty" \
+                   "[gmd:role/gmd:CI_RoleCode = $role][1]/gmd:organisationName/gco:CharacterString"
+
+
+def compileFieldPaths(field_paths):
+    return OrderedDict((field, ET.XPath(path, namespaces=namespaces)) for field, path in field_paths.items())
+
+
+rootFieldXPaths = compileFieldPaths(rootFieldPaths)
+dataIdentificationFieldXPaths = compileFieldPaths(dataIdentificationFieldPaths)
+dataIdentificationXPath = ET.XPath(dataIdentificationPath, namespaces=namespaces)
+topicCategoryXPath = ET.XPath(topicCategoryPath, namespaces=namespaces)
+keywordXPath = ET.XPath(keywordPath, namespaces=namespaces)
+organizationXPath = ET.XPath(organizationPath, namespaces=namespaces)
+
+
+def getClarkPath(path):
+    # "gmd:a/gmd:b" -> ("{http://www.isotc211.org/2005/gmd}a", "{http://www.isotc211.org/2005/gmd}b")
+    clark = []
+    for step in path.split("/"):
+        prefix, name = step.split(":")
+        clark.append("{" + namespaces[prefix] + "}" + name)
+    return tuple(clark)
+
+
+# SUBTREES (RELATIVE TO THE ROOT) THAT createDictionary READS FROM, DERIVED FROM THE FIELD PATHS ABOVE. THE STREAMING
+#  PARSER KEEPS ONLY THESE AND THEIR ANCESTORS, EVERYTHING ELSE (LINEAGE, FEATURE CATALOGUES, ...) IS DROPPED AS IT'S READ
+streamKeepPaths = [path[:-2] if path.endswith("/*") else path for path in rootFieldPaths.values()]
+streamKeepPaths += [dataIdentificationPath + "/" + (path[:-2] if path.endswith("/*") else path)
+                    for path in dataIdentificationFieldPaths.values()]
+streamKeepPaths += [dataIdentificationPath + "/" + keywordPath.split("/")[0],
+                    dataIdentificationPath + "/" + organizationPath.split("[")[0],
+                    dataIdentificationPath + "/" + topicCategoryPath[:-2]]
+streamKeepLeaves = set(getClarkPath(path) for path in streamKeepPaths)
+streamKeepAncestors = set(leaf[:i] for leaf in streamKeepLeaves for i in range(1, len(leaf)))
+# TOP LEVEL ELEMENTS HOLDING THE VALUES. ONCE ALL OF THEM HAVE BEEN READ THE REST OF THE FILE IS SKIPPED
+streamTopLevelTags = set(leaf[0] for leaf in streamKeepLeaves)
+dataIdentificationClarkPath = getClarkPath(dataIdentificationPath)
+
+
+def parseRecordStreaming(in_file):
+    """Reads an ISO 19139 file with lxml iterparse, keeping only the subtrees listed in streamKeepPaths, and returns
+    the pruned root element. Every other element is removed from the tree as soon as it has been read, so memory stays
+    bounded for records with very large lineage, feature catalogue or attribute sections, and parsing stops once the
+    first of each top level element holding values has been read. createDictionary gives the same result on the
+    pruned root as on the fully parsed file."""
+    root = None
+    path = []
+    keep_depth = None  # DEPTH OF THE KEPT SUBTREE THE PARSER IS CURRENTLY INSIDE
+    drop_depth = 0  # DEPTH INSIDE A SUBTREE THAT ISN'T KEPT. NO PATH BOOKKEEPING IS NEEDED THERE
+    found_data_ident = False
+    remaining_tags = set(streamTopLevelTags)
+
+    with open(in_file, "rb") as xfile:
+        for event, elem in ET.iterparse(xfile, events=("start", "end")):
+            if event == "start":
+                if drop_depth > 0:
+                    drop_depth += 1
+                    continue
+                if root is None:
+                    root = elem
+                    continue
+                path.append(elem.tag)
+                if keep_depth is None:
+                    relpath = tuple(path)
+                    if relpath in streamKeepLeaves:
+                        keep_depth = len(path)
+                    elif relpath not in streamKeepAncestors:
+                        drop_depth = 1
+                continue
+
+            if drop_depth > 0:
+                # REMOVE EVERY ELEMENT OF A DROPPED SUBTREE AS SOON AS IT'S READ
+                elem.getparent().remove(elem)
+                drop_depth -= 1
+                if drop_depth > 0:
+                    continue
+            elif elem is root:
+                break
+            elif keep_depth == len(path):
+                keep_depth = None
+            elif keep_depth is None and tuple(path) == dataIdentificationClarkPath:
+                found_data_ident = True
+            path.pop()
+
+            # FINISHED A TOP LEVEL ELEMENT. AN identificationInfo ONLY COUNTS IF IT HELD THE gmd:MD_DataIdentification
+            if len(path) == 0:
+                if elem.tag == dataIdentificationClarkPath[0] and not found_data_ident:
+                    continue
+                remaining_tags.discard(elem.tag)
+                if len(remaining_tags) == 0:
+                    break
+
+    return root
+
+
+def getFirstText(elements):
+    # TEXT OF THE FIRST MATCHED ELEMENT, OR None IF THE PATH DIDN'T MATCH
+    if len(elements) == 0:
+        return None
+    return elements[0].text
+
+
+def getFieldValues(et_root):
+    """Returns a dictionary of every value in rootFieldPaths and dataIdentificationFieldPaths for the record, along
+    with the resolved gmd:MD_DataIdentification element (None if the record doesn't have one)."""
+    values = {}
+    for field, xpath in rootFieldXPaths.items():
+        values[field] = getFirstText(xpath(et_root))
+
+    data_ident = dataIdentificationXPath(et_root)
+    data_ident = data_ident[0] if len(data_ident) > 0 else None
+    for field, xpath in dataIdentificationFieldXPaths.items():
+        values[field] = getFirstText(xpath(data_ident)) if data_ident is not None else None
+
+    return values, data_ident
+
+
+def getKeywordList(data_ident, type):
     klist = []
-    keywordTypes = etroot.findall(
-        "gmd:identificationInfo/gmd:MD_DataIdentification/gmd:descriptiveKeywords/gmd:MD_Keywords/gmd:type/gmd:MD_KeywordTypeCode",
-        namespaces)
-    for keywordType in keywordTypes:
-        if keywordType.text == type:
-            parent = keywordType.getparent().getparent()
+    for keywordElement in keywordXPath(data_ident, type=type):
+        value = keywordElement.text
+        if value is not None:
+            klist.append(value)
 
-            keywordElements = parent.findall("gmd:keyword", namespaces)
-            for keywordElement in keywordElements:
+    # DE-DUPLICATE WHILE KEEPING DOCUMENT ORDER SO THE OUTPUT DOESN'T DEPEND ON THE PROCESS HASH SEED
+    return (list(OrderedDict.fromkeys(klist)))
 
-                value = keywordElement.getchildren()[0].text
-                if value is not None:
-                    for words in value.split(","):
-                        klist.append(value)
 
-    return (list(set(klist)))
+def getOrganizationName(data_ident, type):
+    return getFirstText(organizationXPath(data_ident, role=type))
 
 
-def getOrganizationName(etroot, type):
-    organizationTypes = etroot.findall(
-        "gmd:identificationInfo/gmd:MD_DataIdentification/gmd:citation/gmd:CI_Citation/gmd:citedResponsibleParty/gmd:CI_ResponsibleParty/gmd:role/gmd:CI_RoleCode",
-        namespaces)
-    for orgType in organizationTypes:
-        if orgType.text == type:
-            parent = orgType.getparent().getparent()
-            org_element = parent.find("gmd:organisationName", namespaces)  # /gco:CharacterString", namespaces)
-            char_element = org_element.find("gco:CharacterString", namespaces)  #
-            text = char_element.text
-            return (text)
+def getTopicCategories(data_ident):
+    return [element.text for element in topicCategoryXPath(data_ident)]
 
 
 def mapIsoSubjects(list):
@@ -188,177 +330,78 @@ def setOutDir(lyr_id, odir):
     """
     sep = os.sep # \ or /, depending on OS
 
-    if not os.path.exists(odir):
-        # print(dir)
-        os.mkdir(odir)
+    # makedirs WITH exist_ok SO CONCURRENT CONVERSIONS CREATING THE SAME PARENT DIRECTORY DON'T FAIL
+    os.makedirs(odir, exist_ok=True)
 
-    illegal_folder_names = ["CON", "PRN", "AUX", "NUL", "COM1", "COM2", "COM3", "COM4", "COM5", "COM6", "COM7",
-                           "COM8", "COM9", "LPT1", "LPT2", "LPT3", "LPT4", "LPT5", "LPT6", "LPT7", "LPT8", "LPT9"]
-    salt = ""
-    hash = hash_dn(lyr_id, salt).replace("_", "").replace("-", "")
-    for iffn in illegal_folder_names:
-        while iffn.lower() in hash.lower():
-            salt += " "
-            hash = hash_dn(lyr_id, salt).replace("_", "").replace("-", "")
+    # RE-SALT THE HASH WHILE IT CONTAINS A RESERVED FOLDER NAME (CON, NUL, ...). SEE pathPlanner.py
+    hash, salt = resaltHash(lyr_id, cleanHash(hash_dn(lyr_id, "")))
 
-    dirlist = [hash[0:3], hash[3:6], hash[6:8], hash[8:10]]
+    dirlist = hashedDirList(hash)
     dirstring = hash[0:3] + sep + hash[3:6] + sep + hash[6:8] + sep + hash[8:10]
 
     for dir in dirlist:
         odir = os.path.join(odir,dir)
-        if not os.path.exists(odir):
-            # print(dir)
-            os.mkdir(odir)
+        os.makedirs(odir, exist_ok=True)
 
     return dirstring
 
 
 def createDictionary(dict, geometry_type, dataset_type, single_lyr_dataset, et_root, 
-                     institution, geoserver_workspace, geoserver_loc, download_url_prefix, rights):
+                     institution, geoserver_workspace, geoserver_loc, download_url_prefix, rights, file_basename):
     
-    dict["dc_identifier_s"] = getSingleValue(et_root, ["gmd:dataSetURI",
-                                                       "gco:CharacterString"])
+    # ALL XPATH VALUES OF THE RECORD. gmd:MD_DataIdentification IS RESOLVED ONCE AND THE REST ARE READ RELATIVE TO IT
+    values, data_ident = getFieldValues(et_root)
+
+    dict["dc_identifier_s"] = values["dc_identifier_s"]
 
-    dict["dc_title_s"] = getSingleValue(et_root, ["gmd:identificationInfo",
-                                                  "gmd:MD_DataIdentification",
-                                                  "gmd:citation",
-                                                  "gmd:CI_Citation",
-                                                  "gmd:title",
-                                                  "gco:CharacterString"])
+    dict["dc_title_s"] = values["dc_title_s"]
 
-    dict["dc_description_s"] = getSingleValue(et_root, ["gmd:identificationInfo",
-                                                        "gmd:MD_DataIdentification",
-                                                        "gmd:abstract",
-                                                        "gco:CharacterString"])
+    dict["dc_description_s"] = values["dc_description_s"]
 
     # Point, Line, Polygon, or Raster
     dict["layer_geom_type_s"] = geometry_type
 
     # Metadata Modifed date
-    dict["layer_modified_dt"] = getSingleValue(et_root, ["gmd:dateStamp",
-                                                         "gco:Date"]) + "Z"  # for solr date formatting
+    dict["layer_modified_dt"] = values["layer_modified_dt"] + "Z"  # for solr date formatting
     # Data format
-    dict["dc_format_s"] = getSingleValue(et_root, ["gmd:distributionInfo",
-                                                   "gmd:MD_Distribution",
-                                                   "gmd:distributor",
-                                                   "gmd:MD_Distributor",
-                                                   "gmd:distributorFormat",
-                                                   "gmd:MD_Format",
-                                                   "gmd:name",
-                                                   "gco:CharacterString"])
+    dict["dc_format_s"] = values["dc_format_s"]
 
     # Metadata Language
-    dict["dc_language_s"] = getSingleValue(et_root, ["gmd:language",
-                                                     "gmd:LanguageCode"])
+    dict["dc_language_s"] = values["dc_language_s"]
 
     # "Dataset" or "Image" or "PhysicalObject"
     dict["dc_type_s"] = dataset_type
 
-    role = getSingleValue(et_root, ["gmd:identificationInfo",
-                                    "gmd:MD_DataIdentification",
-                                    "gmd:citation",
-                                    "gmd:CI_Citation",
-                                    "gmd:citedResponsibleParty",
-                                    "gmd:CI_ResponsibleParty",
-                                    "gmd:role",
-                                    "gmd:CI_RoleCode"])
-
     # Publisher Name
     # if role = publisher
-    dict["dc_publisher_s"] = getOrganizationName(et_root, "publisher")
-    dict["dc_creator_sm"] = getOrganizationName(et_root, "originator")
+    dict["dc_publisher_s"] = getOrganizationName(data_ident, "publisher")
+    dict["dc_creator_sm"] = getOrganizationName(data_ident, "originator")
 
     # Place Names.  May need to be geonames.
-    dict["dct_spatial_sm"] = getKeywordList(et_root, "place")
+    dict["dct_spatial_sm"] = getKeywordList(data_ident, "place")
     # A list of all subject keywords including topic Categories (topicCategory)
-    descritiveKeywords = getKeywordList(et_root, "theme")
+    descritiveKeywords = getKeywordList(data_ident, "theme")
 
-    topicCategories = mapIsoSubjects(getMultipleValues(et_root, ["gmd:identificationInfo",
-                                                                 "gmd:MD_DataIdentification",
-                                                                 "gmd:topicCategory",
-                                                                 "gmd:MD_TopicCategoryCode"]))
+    topicCategories = mapIsoSubjects(getTopicCategories(data_ident))
 
     keywords = descritiveKeywords + topicCategories
     # LIST OF KEYWORDS
     dict["dc_subject_sm"] = keywords
 
     # Date issued, Issued date for the layer, using XML Schema dateTime format (YYYY-MM-DDThh:mm:ssZ). OPTIONAL
-    dict["dct_issued_s"] = getSingleValue(et_root, ["gmd:identificationInfo",
-                                                    "gmd:MD_DataIdentification",
-                                                    "gmd:citation",
-                                                    "gmd:CI_Citation",
-                                                    "gmd:date",
-                                                    "gmd:CI_Date",
-                                                    "gmd:date",
-                                                    "gco:Date"])
+    dict["dct_issued_s"] = values["dct_issued_s"]
 
     # Date or range of dates of content (years only). If range, separated by hyphen
-    try:
-        begDate = getSingleValue(et_root, ["gmd:identificationInfo",
-                                           "gmd:MD_DataIdentification",
-                                           "gmd:extent",
-                                           "gmd:EX_Extent",
-                                           "gmd:temporalElement",
-                                           "gmd:EX_TemporalExtent",
-                                           "gmd:extent",
-                                           "gml:TimePeriod",
-                                           "gml:beginPosition"])
-
-        endDate = getSingleValue(et_root, ["gmd:identificationInfo",
-                                           "gmd:MD_DataIdentification",
-                                           "gmd:extent",
-                                           "gmd:EX_Extent",
-                                           "gmd:temporalElement",
-                                           "gmd:EX_TemporalExtent",
-                                           "gmd:extent",
-                                           "gml:TimePeriod",
-                                           "gml:endPosition"])
-    except:
-        endDate = getSingleValue(et_root, ["gmd:identificationInfo",
-                                           "gmd:MD_DataIdentification",
-                                           "gmd:extent",
-                                           "gmd:EX_Extent",
-                                           "gmd:temporalElement",
-                                           "gmd:EX_TemporalExtent",
-                                           "gmd:extent",
-                                           "gml:TimeInstant",
-                                           "gml:timePosition"])
-
-    wbound = getSingleValue(et_root, ["gmd:identificationInfo",
-                                      "gmd:MD_DataIdentification",
-                                      "gmd:extent",
-                                      "gmd:EX_Extent",
-                                      "gmd:geographicElement",
-                                      "gmd:EX_GeographicBoundingBox",
-                                      "gmd:westBoundLongitude",
-                                      "gco:Decimal"])
-
-    ebound = getSingleValue(et_root, ["gmd:identificationInfo",
-                                      "gmd:MD_DataIdentification",
-                                      "gmd:extent",
-                                      "gmd:EX_Extent",
-                                      "gmd:geographicElement",
-                                      "gmd:EX_GeographicBoundingBox",
-                                      "gmd:eastBoundLongitude",
-                                      "gco:Decimal"])
-
-    nbound = getSingleValue(et_root, ["gmd:identificationInfo",
-                                      "gmd:MD_DataIdentification",
-                                      "gmd:extent",
-                                      "gmd:EX_Extent",
-                                      "gmd:geographicElement",
-                                      "gmd:EX_GeographicBoundingBox",
-                                      "gmd:northBoundLatitude",
-                                      "gco:Decimal"])
-
-    sbound = getSingleValue(et_root, ["gmd:identificationInfo",
-                                      "gmd:MD_DataIdentification",
-                                      "gmd:extent",
-                                      "gmd:EX_Extent",
-                                      "gmd:geographicElement",
-                                      "gmd:EX_GeographicBoundingBox",
-                                      "gmd:southBoundLatitude",
-                                      "gco:Decimal"])
+    begDate = values["begin_date"]
+    endDate = values["end_date"]
+    if endDate is None:
+        begDate = None
+        endDate = values["instant_date"]
+
+    wbound = values["west_bound"]
+    ebound = values["east_bound"]
+    nbound = values["north_bound"]
+    sbound = values["south_bound"]
 
     # Bounding box as maximum values for S W N E.
     # dict["georss_box_s"] = sbound + " " + wbound + " " + nbound + " " + ebound
@@ -374,11 +417,11 @@ def createDictionary(dict, geometry_type, dataset_type, single_lyr_dataset, et_r
     dict["dct_provenance_s"] = institution
     dict["geoblacklight_version"] = "1.0"
     # GeoserverWorkspace:LayerName.  University of Arizona Unique
-    fileName_noext = filebasename.split(".")[0]  # Removing path from file path
+    fileName_noext = file_basename.split(".")[0]  # Removing path from file path
     dict["layer_id_s"] = geoserver_workspace + ":" + fileName_noext
 
     # temporal (year only)
-    if 'begDate' in locals():
+    if begDate is not None:
         if begDate[:4] == endDate[:4]:
             date = endDate[0:4]
         else:
@@ -436,12 +479,34 @@ def createDictionary(dict, geometry_type, dataset_type, single_lyr_dataset, et_r
     return (dict)
 
 
-def createGBLFile(in_file, geom_type,  ds_type, sl_ds, instiution, gs_workspace, tosolr, metadata_repo, isometadata_link, gs_loc, dwnld_prefix, rights):
-    global filebasename
+def checkToSolr(tosolr):
+    # THE tosolr ARGUMENT ("True"/"False" IN ANY CASE, OR A bool) AS A bool
+    value = str(tosolr).lower()
+    if value != "true" and value != "false":
+        raise ValueError("tosolr should be either \"True\" or \"False\", not \"{}\"".format(tosolr))
+    return value == "true"
+
+
+def checkRights(rights):
+    # ACCESS RIGHTS MUST BE "Public" OR "Restricted" (IN ANY CASE)
+    if rights.lower() != "public" and rights.lower() != "restricted":
+        raise ValueError("Access rights value should be one of \"Public\" or \"Restricted\", not \"{}\""
+                         .format(rights))
+    return rights
+
+
+def createGBLFile(in_file, geom_type,  ds_type, sl_ds, instiution, gs_workspace, tosolr, metadata_repo, isometadata_link, gs_loc, dwnld_prefix, rights,
+                  solr_sink=None, stream=False, outpath=None):
+    # ALL STATE FOR THE RECORD IS PASSED IN EXPLICITLY SO MULTIPLE CONVERSIONS CAN RUN AT ONCE IN THREADS
+    # outpath IS THE HASHED DIRECTORY PLANNED (AND CREATED) BY planHashedPaths. IF NOT GIVEN IT'S WORKED OUT HERE
+    tosolr = checkToSolr(tosolr)
     filebasename = os.path.basename(in_file).split(".")[0]
 
-    tree = ET.parse(in_file)
-    root = tree.getroot()
+    if stream:
+        root = parseRecordStreaming(in_file)
+    else:
+        tree = ET.parse(in_file)
+        root = tree.getroot()
     gblschema = OrderedDict({
         "layer_slug_s": "",
         "dc_identifier_s": "",
@@ -468,10 +533,12 @@ def createGBLFile(in_file, geom_type,  ds_type, sl_ds, instiution, gs_workspace,
         "geoblacklight_version": ""
     })
 
-    gblSchemaDict = createDictionary(gblschema, geom_type, ds_type, sl_ds, root, instiution, gs_workspace, gs_loc, dwnld_prefix, rights)
+    gblSchemaDict = createDictionary(gblschema, geom_type, ds_type, sl_ds, root, instiution, gs_workspace, gs_loc, dwnld_prefix, rights,
+                                     filebasename)
     layerid = gblSchemaDict["layer_id_s"]
     # print("metadata_repo parent", metadata_repo)
-    outpath = setOutDir(layerid, metadata_repo)
+    if outpath is None:
+        outpath = setOutDir(layerid, metadata_repo)
     foutdir = os.path.join(metadata_repo, outpath)
     # print("foutdir hash", foutdir)
 
@@ -493,13 +560,9 @@ def createGBLFile(in_file, geom_type,  ds_type, sl_ds, instiution, gs_workspace,
     outfile_json = os.path.join(foutdir, "geoblacklight.json")
     outfile_isoxml = os.path.join(foutdir, "iso19139.xml")
 
-    # UPLOAD RECORD TO SOLR INDEX
-    if tosolr.lower() == "true":
-        solrDict = {"add": {"doc": gblSchemaDict}}
-        solrString = json.dumps(solrDict, indent=4, sort_keys=False)
-        headers = {"content-type": "application/json"}
-        print("Pushing record to Solr at {} ...".format(solrURL))
-        r = requests.post(solrURL, data=solrString, headers=headers)
+    # UPLOAD RECORD TO SOLR INDEX. THE SINK SENDS IT WITH THE NEXT BATCH
+    if tosolr:
+        solr_sink.add(gblSchemaDict)
 
     # write geoblacking schema values to json file
     with open(outfile_json, 'w') as jfile:
@@ -513,24 +576,36 @@ def createGBLFile(in_file, geom_type,  ds_type, sl_ds, instiution, gs_workspace,
     return layers_json_entry, gblSchemaDict
 
 
-def isoToGBL(metadata_repo, xmlfile_loc, dataset_loc,
-             rights="public",
-             institution="UArizona",
-             gbl_schema_version="1.0",
-             geoserver_workspace="UniversityLibrary",
-             tosolr="True",
-             isometadata_link=None,
-             geoserver_url="https://geo.library.arizona.edu/geoserver",
-             dwnld_url_prefix="http://sequoia.library.arizona.edu/geospatial"):
+def convertISOFile(metadata_repo, xmlfile_loc, dataset_loc,
+                   rights="public",
+                   institution="UArizona",
+                   gbl_schema_version="1.0",
+                   geoserver_workspace="UniversityLibrary",
+                   tosolr="True",
+                   isometadata_link=None,
+                   geoserver_url="https://geo.library.arizona.edu/geoserver",
+                   dwnld_url_prefix="http://sequoia.library.arizona.edu/geospatial",
+                   solr_loc=solr_loc,
+                   solr_sink=None,
+                   stream=False,
+                   outpath=None):
+    """Converts a single ISO 19139 xml file and writes its geoblacklight.json and iso19139.xml into the hashed
+    directory structure. The layers.json index is NOT touched, the entry for it is returned along with the
+    geoblacklight dictionary so the caller can decide when to write the index.
+
+    If tosolr is "True" (in any case, or True) the record is added to solr_sink. If no sink is given, one is opened
+    for this record alone and the record is sent and committed to solr_loc before returning. Any value other than
+    "True" or "False" raises a ValueError, as does rights other than "Public" or "Restricted".
+
+    If stream is True the xml file is read with parseRecordStreaming instead of being loaded whole, which keeps
+    memory bounded for very large records.
+
+    outpath is the hashed directory of the record if it was already planned with planHashedPaths."""
 
     if isometadata_link is None:
         isometadata_link = "https://raw.githubusercontent.com/OpenGeoMetadata/edu." + institution.lower()
-    if tosolr != "True" and tosolr != "False":
-        print("ERROR: tosolr variable should be either \"True\" or \"False\". Exiting.")
-        exit()
-    if rights.lower() != "public" and rights.lower() != "restricted":
-        print("ERROR: Access rights value should be one of \"Public\" or \"Restricted\". Exiting.")
-        exit()
+    tosolr = checkToSolr(tosolr)
+    checkRights(rights)
 
     print(f"""Beginning execution on file {xmlfile_loc} with variables:
           \n\tMetadata Directory: {metadata_repo}
@@ -542,36 +617,247 @@ def isoToGBL(metadata_repo, xmlfile_loc, dataset_loc,
           \n\tGeoserver URL: {geoserver_url}
           \n\tDownload URL Prefix: {dwnld_url_prefix}
           \n\tMetadata Url Prefix: {isometadata_link}
-          \n\tPOST to Solr: {tosolr}""")
+          \n\tPOST to Solr: {tosolr}
+          \n\tSolr URL: {solr_loc}""")
+
+    record_sink = None
+    if tosolr and solr_sink is None:
+        record_sink = solr_sink = SolrSink(solr_loc, batch_size=1, commit_within=None)
+
+    try:
+        geometry_type, dataset_type, single_layer_ds = getDatasetDataTypes(dataset_loc)
+        layers_json_e, gbl_dict = createGBLFile(xmlfile_loc, geometry_type, dataset_type, single_layer_ds, institution,
+                                                geoserver_workspace, tosolr, metadata_repo, isometadata_link, geoserver_url, dwnld_url_prefix, rights,
+                                                solr_sink=solr_sink, stream=stream, outpath=outpath)
+    finally:
+        if record_sink is not None:
+            record_sink.close()
+
+    return layers_json_e, gbl_dict
+
+
+def isoToGBL(metadata_repo, xmlfile_loc, dataset_loc,
+             rights="public",
+             institution="UArizona",
+             gbl_schema_version="1.0",
+             geoserver_workspace="UniversityLibrary",
+             tosolr="True",
+             isometadata_link=None,
+             geoserver_url="https://geo.library.arizona.edu/geoserver",
+             dwnld_url_prefix="http://sequoia.library.arizona.edu/geospatial",
+             solr_loc=solr_loc,
+             solr_sink=None,
+             stream=False,
+             compact_index=True):
+    """Converts a single ISO 19139 xml file (see convertISOFile) and records its layer_id_s -> hashed path entry in
+    the layers.json index. The entry is appended to the index journal, and unless compact_index is False the journal
+    is then compacted into layers.json. When converting many files, pass compact_index=False and call
+    compactLayersJournal(metadata_repo) once at the end."""
+
+    layers_json_e, gbl_dict = convertISOFile(metadata_repo, xmlfile_loc, dataset_loc,
+                                             rights=rights,
+                                             institution=institution,
+                                             gbl_schema_version=gbl_schema_version,
+                                             geoserver_workspace=geoserver_workspace,
+                                             tosolr=tosolr,
+                                             isometadata_link=isometadata_link,
+                                             geoserver_url=geoserver_url,
+                                             dwnld_url_prefix=dwnld_url_prefix,
+                                             solr_loc=solr_loc,
+                                             solr_sink=solr_sink,
+                                             stream=stream)
 
     # INDEX FILE OF GEOBLACKLIGHT layer_id_s AND CALCULATED HASH. USED TO ALLOW REFERENCE OF ORIGINAL DATASET NAME TO
     #  OPENGEOMETADATA DIRECTORY STRUCTURE.
-    geometry_type, dataset_type, single_layer_ds = getDatasetDataTypes(dataset_loc)
-    layers_json_e, gbl_dict = createGBLFile(xmlfile_loc, geometry_type, dataset_type, single_layer_ds, institution,
-                                            geoserver_workspace, tosolr, metadata_repo, isometadata_link, geoserver_url, dwnld_url_prefix, rights)
-
     # WRITE the layers.json with a line noting the file name and the hash association
-    
-    ljsonfile = os.path.join(metadata_repo, "layers.json")
-    with open(ljsonfile, 'r') as lfile:
-        layersdict = json.load(lfile)
-        
-    with open(ljsonfile, 'w') as lfile:
-        updated_layersdict = {**layersdict, **layers_json_e}
-        jstring = json.dumps(updated_layersdict, indent=4, sort_keys=False)
-        lfile.write(jstring)
-
-    print("FINISHED CREATING GBL FILE. UPDATED INDEX FILE {}".format(ljsonfile))
+    appendLayersJournal(metadata_repo, [layers_json_e])
+    if compact_index:
+        ljsonfile = compactLayersJournal(metadata_repo)
+        print("FINISHED CREATING GBL FILE. UPDATED INDEX FILE {}".format(ljsonfile))
+    else:
+        print("FINISHED CREATING GBL FILE. ADDED ENTRY TO INDEX JOURNAL")
     
     return gbl_dict
 
 
+def convertBatchFile(job):
+    # RUN IN A WORKER PROCESS OR THREAD. RETURNS THE WORKER ID AND TIME SPENT SO THROUGHPUT CAN BE REPORTED PER WORKER
+    metadata_repo, xmlfile_loc, dataset_loc, outpath, isoargs = job
+    start = time.time()
+    layers_json_e, gbl_dict = convertISOFile(metadata_repo, xmlfile_loc, dataset_loc, outpath=outpath, **isoargs)
+    worker = "{}:{}".format(os.getpid(), threading.current_thread().name)
+    return worker, time.time() - start, layers_json_e, gbl_dict
+
+
+def findMetadataFiles(metadata_dir, datasetlist):
+    # LIST OF (XML FILE, DATASET) FOR EVERY XML FILE UNDER metadata_dir, AND LIST OF THE XML FILES WHOSE DATASET ISN'T
+    #  IN datasetlist, WHICH ARE REPORTED AND LEFT OUT
+    xmlfiles = []
+    missing = []
+    for dir_root, dirs, files in os.walk(metadata_dir):
+        for file in files:
+            if file.endswith(".xml"):
+                fpath = os.path.join(dir_root, file)
+                try:
+                    xmlfiles.append((fpath, findFile(fpath, datasetlist)))
+                except ValueError as e:
+                    print("ERROR: {}. Skipping {}".format(e, fpath))
+                    missing.append(fpath)
+    return xmlfiles, missing
+
+
+# PARAMETERS OF convertISOFile THAT CHANGE THE OUTPUT OF A RECORD. A CHANGE IN ANY OF THEM MEANS A RECORD HAS TO BE
+#  RECONVERTED IN INCREMENTAL MODE
+manifestParams = ["rights", "institution", "gbl_schema_version", "geoserver_workspace", "isometadata_link",
+                  "geoserver_url", "dwnld_url_prefix"]
+
+
+def predictLayerId(xmlfile_loc, isoargs):
+    # SAME layer_id_s AS createDictionary BUILDS FROM THE GEOSERVER WORKSPACE AND THE XML FILE NAME
+    workspace = isoargs.get("geoserver_workspace",
+                            inspect.signature(convertISOFile).parameters["geoserver_workspace"].default)
+    return workspace + ":" + os.path.basename(xmlfile_loc).split(".")[0]
+
+
+def conversionParams(metadata_repo, isoargs):
+    defaults = inspect.signature(convertISOFile).parameters
+    params = {name: isoargs.get(name, defaults[name].default) for name in manifestParams}
+    params["metadata_repo"] = os.path.abspath(metadata_repo)
+    return params
+
+
+def convert_directory(metadata_dir, metadata_repo, datasetlist, processes=None, threads=None, solr_sink=None,
+                      incremental=False, manifest_path=None, **isoargs):
+    """Converts every xml file found under metadata_dir using a pool of worker processes. Each worker converts
+    and writes its records, and the layers.json entries are returned to the parent which appends them to the index
+    journal in crawl order and compacts it into layers.json once at the end, so the output is the same as converting
+    the files one at a time with isoToGBL. The hashed directories of all the records are planned and created before
+    the workers start (see pathPlanner.py), which also reports layer ids sharing a directory. Any extra keyword arguments are passed on to convertISOFile (rights, institution, tosolr, etc.)
+    xml files whose dataset isn't in datasetlist are reported and skipped.
+
+    If threads is given, a pool of that many threads is used instead of processes. The conversion is mostly I/O
+    (xml parse, json write, Solr POST) so threads avoid the cost of starting processes for smaller batches.
+
+    If tosolr is "True", the records returned by the workers are sent to Solr from the parent process in batches,
+    through solr_sink if one is given (the caller closes it) or a SolrSink on solr_loc that is closed at the end.
+
+    If incremental is True, a manifest of every converted xml file (content digest, dataset and conversion
+    parameters, see conversionManifest.py) is kept at manifest_path, by default conversion_manifest.json in
+    metadata_repo. Files whose entry is unchanged are skipped, and files in the manifest that are no longer in
+    metadata_dir are reported as deleted and dropped from the manifest.
+
+    datasetlist is the dictionary of dataset file name -> dataset path used by findFile."""
+
+    # INVALID PARAMETERS FAIL HERE, BEFORE ANY RECORD IS SUBMITTED
+    if "rights" in isoargs:
+        checkRights(isoargs["rights"])
+
+    # WORKERS DON'T POST TO SOLR THEMSELVES, THE PARENT BATCHES THE RECORDS THEY RETURN
+    tosolr = checkToSolr(isoargs.pop("tosolr", "True"))
+    batch_solr_loc = isoargs.pop("solr_loc", solr_loc)
+    isoargs["tosolr"] = "False"
+    batch_sink = None
+    if tosolr and solr_sink is None:
+        batch_sink = solr_sink = SolrSink(batch_solr_loc, failed_path=os.path.join(metadata_repo, solrFailedFileName))
+
+    jobs = []
+    job_keys = []
+    manifest_entries = {}
+    skipped = 0
+    if incremental:
+        if manifest_path is None:
+            manifest_path = os.path.join(metadata_repo, manifestFileName)
+        manifest = loadManifest(manifest_path)
+        params = conversionParams(metadata_repo, isoargs)
+
+    xmlfiles, missing = findMetadataFiles(metadata_dir, datasetlist)
+    if incremental:
+        # A RECORD WHOSE DATASET IS MISSING ISN'T CONVERTED, BUT ISN'T DELETED EITHER
+        for fpath in missing:
+            key = os.path.relpath(fpath, metadata_dir).replace(os.sep, "/")
+            if key in manifest:
+                manifest_entries[key] = manifest[key]
+
+    for fpath, dataset in xmlfiles:
+        key = os.path.relpath(fpath, metadata_dir).replace(os.sep, "/")
+        if incremental:
+            changed, manifest_entries[key] = checkRecord(manifest, key, fpath, dataset, params)
+            if not changed:
+                skipped += 1
+                continue
+        jobs.append([metadata_repo, fpath, dataset, None, isoargs])
+        job_keys.append(key)
+
+    # HASH EVERY layer_id_s AND CREATE THE WHOLE DIRECTORY TREE UP FRONT, SO WORKERS DON'T EACH STAT AND CREATE THEIR
+    #  FOUR DIRECTORY LEVELS
+    os.makedirs(metadata_repo, exist_ok=True)
+    layer_ids = [predictLayerId(job[1], isoargs) for job in jobs]
+    planned_paths, path_report = planHashedPaths(layer_ids, metadata_repo)
+    for job, lyr_id in zip(jobs, layer_ids):
+        job[3] = planned_paths[lyr_id]
+
+    if incremental:
+        print("\n...{} xml files unchanged since the last run, {} new or changed...".format(skipped, len(jobs)))
+
+    if threads:
+        workers = threads
+        executor = ThreadPoolExecutor(max_workers=threads)
+        print("\n...Converting {} xml files with {} worker threads...".format(len(jobs), threads))
+    else:
+        workers = processes if processes else os.cpu_count()
+        executor = ProcessPoolExecutor(max_workers=workers)
+        print("\n...Converting {} xml files with {} worker processes...".format(len(jobs), workers))
+
+    worker_stats = OrderedDict()
+    layers_json_entries = []
+    start = time.time()
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with executor:
+        # map RETURNS RESULTS IN SUBMISSION ORDER, WHICH KEEPS THE layers.json ORDER THE SAME AS A SERIAL RUN
+        results = executor.map(convertBatchFile, jobs, chunksize=chunksize)
+        for key, (worker, elapsed, layers_json_e, gbl_dict) in zip(job_keys, results):
+            stats = worker_stats.setdefault(worker, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            layers_json_entries.append(layers_json_e)
+            if incremental:
+                layerid, outpath = list(layers_json_e.items())[0]
+                manifest_entries[key]["layer_id"] = layerid
+                manifest_entries[key]["outpath"] = outpath
+            if tosolr:
+                solr_sink.add(gbl_dict)
+
+    if batch_sink is not None:
+        batch_sink.close()
+    elif solr_sink is not None:
+        solr_sink.flush()
+
+    appendLayersJournal(metadata_repo, layers_json_entries)
+    ljsonfile = compactLayersJournal(metadata_repo)
+    total = time.time() - start
+
+    print("\nFINISHED BATCH CONVERSION. UPDATED INDEX FILE {}".format(ljsonfile))
+    for worker, (count, elapsed) in worker_stats.items():
+        rate = count / elapsed if elapsed > 0 else 0
+        print("\tWorker {}: {} files in {:.1f}s ({:.2f} files/s)".format(worker, count, elapsed, rate))
+    rate = len(jobs) / total if total > 0 else 0
+    print("\tTotal: {} files in {:.1f}s ({:.2f} files/s)".format(len(jobs), total, rate))
+    if missing:
+        print("\tSkipped {} xml files whose dataset wasn't found".format(len(missing)))
+
+    if incremental:
+        deleted = deletedRecords(manifest, manifest_entries)
+        for key, entry in deleted.items():
+            print("\tDELETED: {} (layer {} at {})".format(key, entry.get("layer_id"), entry.get("outpath")))
+        saveManifest(manifest_path, manifest_entries)
+        print("\tUpdated manifest {}".format(manifest_path))
+
+    return layers_json_entries
+
+
 
 if __name__ == "__main__":
     print("Starting translation of xml files in folder")
-    # Apache Solr Collection URL. E.g. http://localhost:8080/solr/collection1
-    solr_loc = "http://geotest.library.arizona.edu:8983/solr/UAL_GeospatialRecords"
-    solrURL = solr_loc + "/update?commit=true"
     # GeoServer Location
     geoserver_loc = "https://geo.library.arizona.edu/geoserver"
     download_url_prefix = "http://sequoia.library.arizona.edu/geospatial"
@@ -597,6 +883,23 @@ if __name__ == "__main__":
     parser.add_argument("-t", "--tosolr", type=str, help="True/False value indicating if the composed gbl schema should be"
                                                          " posted to the url identified by the solr_loc variable. Default is"
                                                          " False.")
+    parser.add_argument("-p", "--processes", type=int, help="Convert the xml files in batch mode using a pool of this"
+                                                            " many worker processes. If not given the files are"
+                                                            " converted one at a time.")
+    parser.add_argument("-b", "--solrbatch", type=int, default=500, help="Number of records sent to Solr per update"
+                                                                         " request when --tosolr is True. Default is"
+                                                                         " 500.")
+    parser.add_argument("-s", "--stream", action="store_true", help="Read the xml files with a streaming parser that only"
+                                                                    " keeps the elements used in the GeoBlacklight record."
+                                                                    " Keeps memory bounded for very large ISO records.")
+    parser.add_argument("--incremental", action="store_true", help="Only convert xml files that are new or changed"
+                                                                   " (contents, dataset or parameters) since the last"
+                                                                   " incremental run, based on the manifest file"
+                                                                   " conversion_manifest.json in the output directory."
+                                                                   " Records no longer in the metadata directory are"
+                                                                   " reported as deleted.")
+    parser.add_argument("--threads", type=int, help="Convert the xml files in batch mode using a pool of this many"
+                                                    " threads instead of processes.")
 
     args = parser.parse_args()
     outdir = checkpath(args.outdir) if args.outdir else "./hashedDir"
@@ -609,7 +912,11 @@ if __name__ == "__main__":
     gbl_schema_version = args.version if args.version else "1.0"
     layerid_prefix = args.workspace if args.workspace else "UniversityLibrary"    # Corresponds to Geoserver Workspace
     metadata_link = args.mdurl if args.mdurl else r"https://raw.githubusercontent.com/OpenGeoMetadata/edu." + prov_institution.lower()   # Location of metadata files
-    to_solr = args.tosolr if args.tosolr else "False"
+    try:
+        checkRights(rights)
+        to_solr = checkToSolr(args.tosolr) if args.tosolr else False
+    except ValueError as e:
+        parser.error(str(e))
 
     # BUILD LIST OF DATA FILES TO MATCH FROM
     datasetlist = {}
@@ -623,12 +930,39 @@ if __name__ == "__main__":
     print("\n...Finished building file list from data directory...")
 
 
+    # THE SAME CONVERSION PARAMETERS FOR THE SERIAL AND THE BATCH CRAWL
+    isoargs = {"rights": rights,
+               "institution": prov_institution,
+               "gbl_schema_version": gbl_schema_version,
+               "geoserver_workspace": layerid_prefix,
+               "isometadata_link": metadata_link,
+               "geoserver_url": geoserver_loc,
+               "dwnld_url_prefix": download_url_prefix,
+               "tosolr": to_solr,
+               "stream": args.stream}
+
     print("\n...Beginning crawl of metadata directory...")
-    for dir_root, dirs, files in os.walk(metadatadir):
-        for file in files:
-            if file.endswith(".xml"):
-                print("Starting", file)
-                fpath = os.path.join(dir_root, file)
-                dataset = findFile(fpath, datasetlist)
-                isoToGBL(outdir, fpath, dataset)
+    # ONE SINK FOR THE WHOLE CRAWL SO RECORDS ARE SENT IN BATCHES WITH A SINGLE COMMIT AT THE END
+    sink = SolrSink(solr_loc, batch_size=args.solrbatch, failed_path=os.path.join(outdir, solrFailedFileName)) \
+        if to_solr else None
+    if args.processes or args.threads or args.incremental:
+        # INCREMENTAL RUNS WITHOUT A POOL SIZE CONVERT ON A SINGLE THREAD
+        threads = args.threads if args.threads or args.processes else 1
+        convert_directory(metadatadir, outdir, datasetlist, processes=args.processes, threads=threads,
+                          solr_sink=sink, incremental=args.incremental, **isoargs)
+    else:
+        for dir_root, dirs, files in os.walk(metadatadir):
+            for file in files:
+                if file.endswith(".xml"):
+                    print("Starting", file)
+                    fpath = os.path.join(dir_root, file)
+                    try:
+                        dataset = findFile(fpath, datasetlist, datadir)
+                    except ValueError as e:
+                        print("ERROR: {}. Skipping {}".format(e, fpath))
+                        continue
+                    isoToGBL(outdir, fpath, dataset, solr_sink=sink, compact_index=False, **isoargs)
+        compactLayersJournal(outdir)
+    if sink is not None:
+        sink.close()
 
@@ -0,0 +1,69 @@
+# MANIFEST OF THE LAST ISO -> GEOBLACKLIGHT CONVERSION OF EACH XML FILE. FOR EVERY XML FILE (KEYED BY ITS PATH RELATIVE
+#  TO THE METADATA DIRECTORY) IT HOLDS THE SHA-1 DIGEST OF THE FILE, THE DATASET IT RESOLVED TO AND THE CONVERSION
+#  PARAMETERS USED, ALONG WITH THE layer_id_s AND HASHED PATH THAT WERE WRITTEN. A RECORD ONLY NEEDS TO BE RECONVERTED
+#  IF ONE OF THOSE CHANGED, AND FILES IN THE MANIFEST THAT ARE NO LONGER ON DISK ARE RECORDS THAT WERE DELETED.
+
+import json, os, hashlib
+
+manifestFileName = "conversion_manifest.json"
+
+
+def loadManifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as mfile:
+        return json.load(mfile)
+
+
+def saveManifest(manifest_path, manifest):
+    # WRITE TO A TEMPORARY FILE AND MOVE INTO PLACE SO AN INTERRUPTED RUN DOESN'T LEAVE A PARTIAL MANIFEST
+    tmpfile = manifest_path + ".tmp"
+    with open(tmpfile, 'w') as mfile:
+        mfile.write(json.dumps(manifest, indent=4, sort_keys=True))
+    os.replace(tmpfile, manifest_path)
+
+
+def fileDigest(path, blocksize=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def datasetSignature(dataset_loc):
+    # THE DATASET ISN'T HASHED (IT MAY BE GIGABYTES), ITS PATH, SIZE AND MODIFIED TIME ARE ENOUGH TO NOTICE A CHANGE
+    st = os.stat(dataset_loc)
+    return {"path": os.path.abspath(dataset_loc), "size": st.st_size, "mtime": st.st_mtime}
+
+
+def checkRecord(manifest, key, xml_path, dataset_loc, params):
+    """Returns (changed, entry) for the xml file. entry is the new manifest entry for the file and changed is True
+    if the file is new, or its contents, dataset or conversion parameters differ from the manifest. The digest of
+    the xml file is only recomputed when its size or modified time changed."""
+    old = manifest.get(key)
+    st = os.stat(xml_path)
+    if old is not None and old["xml_size"] == st.st_size and old["xml_mtime"] == st.st_mtime:
+        digest = old["digest"]
+    else:
+        digest = fileDigest(xml_path)
+
+    entry = {"xml_size": st.st_size,
+             "xml_mtime": st.st_mtime,
+             "digest": digest,
+             "dataset": datasetSignature(dataset_loc),
+             "params": params}
+
+    if old is None:
+        return True, entry
+    changed = any(old.get(k) != entry[k] for k in ("digest", "dataset", "params"))
+    if not changed:
+        # KEEP THE layer_id_s AND PATH WRITTEN BY THE LAST CONVERSION
+        entry["layer_id"] = old.get("layer_id")
+        entry["outpath"] = old.get("outpath")
+    return changed, entry
+
+
+def deletedRecords(manifest, seen_keys):
+    """Returns the {key: entry} of every record in the manifest whose xml file wasn't seen in this crawl."""
+    return {key: entry for key, entry in manifest.items() if key not in seen_keys}
@@ -0,0 +1,103 @@
+# WRITER FOR THE layers.json INDEX OF layer_id_s -> HASHED DIRECTORY PATH KEPT AT THE ROOT OF THE METADATA REPOSITORY.
+#  INSTEAD OF READING AND REWRITING THE WHOLE layers.json FOR EVERY RECORD, NEW ENTRIES ARE APPENDED TO A JOURNAL FILE
+#  (ONE JSON OBJECT PER LINE) AND THE JOURNAL IS COMPACTED INTO layers.json ONCE PER BATCH. BOTH OPERATIONS TAKE AN
+#  EXCLUSIVE LOCK ON A LOCK FILE NEXT TO layers.json SO SEVERAL CONVERTERS (PROCESSES OR THREADS) CAN SHARE THE INDEX.
+
+import json, os, threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # WINDOWS
+    fcntl = None
+    import msvcrt
+
+layersFileName = "layers.json"
+journalFileName = "layers.journal"
+lockFileName = "layers.json.lock"
+
+# flock IS PER OPEN FILE, SO THREADS OF THE SAME PROCESS ALSO NEED TO BE SERIALIZED
+threadLock = threading.Lock()
+
+
+@contextmanager
+def indexLock(metadata_repo):
+    """Holds an exclusive lock on the layers.json index of metadata_repo for the duration of the with block."""
+    lockpath = os.path.join(metadata_repo, lockFileName)
+    with threadLock:
+        with open(lockpath, "a+") as lfile:
+            if fcntl is not None:
+                fcntl.flock(lfile.fileno(), fcntl.LOCK_EX)
+            else:
+                # msvcrt.locking GIVES UP AFTER 10 SECONDS, SO KEEP TRYING UNTIL THE LOCK IS FREE
+                lfile.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(lfile.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lfile.fileno(), fcntl.LOCK_UN)
+                else:
+                    lfile.seek(0)
+                    msvcrt.locking(lfile.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def appendLayersJournal(metadata_repo, layers_json_entries):
+    """Appends the given list of {layer_id_s: hashed path} entries, in order, to the journal of metadata_repo."""
+    lines = "".join(json.dumps(layers_json_e) + "\n" for layers_json_e in layers_json_entries)
+    with indexLock(metadata_repo):
+        with open(os.path.join(metadata_repo, journalFileName), "a") as jfile:
+            jfile.write(lines)
+            jfile.flush()
+
+
+def readLayersJournal(journalfile):
+    entries = []
+    if not os.path.exists(journalfile):
+        return entries
+    with open(journalfile, "r") as jfile:
+        for line in jfile:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # PARTIAL LINE LEFT BY A WRITER THAT WAS KILLED MID-WRITE
+                print("WARNING: Skipping unreadable line in {}: {}".format(journalfile, line.strip()))
+    return entries
+
+
+def compactLayersJournal(metadata_repo):
+    """Merges every journal entry, in the order they were appended, into layers.json and empties the journal.
+    The new layers.json is written to a temporary file and moved into place, so readers never see a partial file.
+    Returns the path of layers.json."""
+    ljsonfile = os.path.join(metadata_repo, layersFileName)
+    journalfile = os.path.join(metadata_repo, journalFileName)
+
+    with indexLock(metadata_repo):
+        entries = readLayersJournal(journalfile)
+        if len(entries) == 0 and os.path.exists(ljsonfile):
+            return ljsonfile
+
+        layersdict = {}
+        if os.path.exists(ljsonfile):
+            with open(ljsonfile, 'r') as lfile:
+                layersdict = json.load(lfile)
+
+        for layers_json_e in entries:
+            layersdict.update(layers_json_e)
+
+        tmpfile = ljsonfile + ".tmp"
+        with open(tmpfile, 'w') as lfile:
+            lfile.write(json.dumps(layersdict, indent=4, sort_keys=False))
+            lfile.flush()
+            os.fsync(lfile.fileno())
+        os.replace(tmpfile, ljsonfile)
+
+        # ENTRIES ARE IN layers.json NOW. IF THIS IS INTERRUPTED BEFORE THE TRUNCATE, REAPPLYING THEM IS HARMLESS
+        open(journalfile, 'w').close()
+
+    return ljsonfile
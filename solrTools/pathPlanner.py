@@ -0,0 +1,72 @@
+# PLANS THE HASHED OPENGEOMETADATA DIRECTORY (E.G. 328/541/84/45) OF EVERY RECORD OF A CONVERSION AT ONCE, INSTEAD OF
+#  ONE RECORD AT A TIME IN setOutDir. THE layer_id_s VALUES ARE HASHED IN ONE BATCH (hash_dn_batch), ONLY THE IDS WHOSE
+#  HASH CONTAINS A RESERVED WINDOWS NAME ARE RE-SALTED ONE BY ONE, AND THE DIRECTORY TREE IS CREATED WITH ONE makedirs
+#  PER DISTINCT LEAF DIRECTORY. DIFFERENT layer_id_s VALUES THAT END UP ON THE SAME 10 CHARACTER PATH ARE REPORTED,
+#  SINCE THE LATER RECORD WOULD OVERWRITE THE EARLIER ONE.
+
+import os
+from collections import OrderedDict
+from fnv64basedhash import hash_dn, hash_dn_batch
+
+reservedFolderNames = ["CON", "PRN", "AUX", "NUL", "COM1", "COM2", "COM3", "COM4", "COM5", "COM6", "COM7",
+                       "COM8", "COM9", "LPT1", "LPT2", "LPT3", "LPT4", "LPT5", "LPT6", "LPT7", "LPT8", "LPT9"]
+
+
+def cleanHash(hash):
+    return hash.replace("_", "").replace("-", "")
+
+
+def resaltHash(lyr_id, hash):
+    """Returns (hash, salt) for lyr_id given its unsalted (cleaned) hash. While the hash contains a reserved folder
+    name the id is rehashed with one more space of salt. This is the exact sequence setOutDir has always used, so
+    existing records keep their directories."""
+    salt = ""
+    for iffn in reservedFolderNames:
+        while iffn.lower() in hash.lower():
+            salt += " "
+            hash = cleanHash(hash_dn(lyr_id, salt))
+    return hash, salt
+
+
+def hashedDirList(hash):
+    return [hash[0:3], hash[3:6], hash[6:8], hash[8:10]]
+
+
+def planHashedPaths(layer_ids, metadata_repo=None):
+    """Returns {layer_id_s: hashed directory path} for every id in layer_ids, with the same paths setOutDir would
+    give. If metadata_repo is given the directories are created in it.
+
+    Ids sharing a 10 character path and ids that had to be re-salted are printed, and also returned in the
+    "collisions" ({path: [layer ids]}) and "resalted" ({layer id: salt}) entries of the report dictionary
+    returned along with the paths."""
+    sep = os.sep
+    unique_ids = list(OrderedDict.fromkeys(layer_ids))
+
+    paths = OrderedDict()
+    resalted = OrderedDict()
+    by_path = OrderedDict()
+    for lyr_id, hash in zip(unique_ids, hash_dn_batch(unique_ids, "")):
+        hash = cleanHash(hash)
+        lowered = hash.lower()
+        if any(iffn.lower() in lowered for iffn in reservedFolderNames):
+            hash, salt = resaltHash(lyr_id, hash)
+            resalted[lyr_id] = salt
+        path = sep.join(hashedDirList(hash))
+        paths[lyr_id] = path
+        by_path.setdefault(path, []).append(lyr_id)
+
+    collisions = OrderedDict((path, ids) for path, ids in by_path.items() if len(ids) > 1)
+
+    print("Planned {} hashed paths ({} re-salted for reserved names, {} collisions)"
+          .format(len(paths), len(resalted), len(collisions)))
+    for lyr_id, salt in resalted.items():
+        print("\tRE-SALTED: {} with {} space(s) -> {}".format(lyr_id, len(salt), paths[lyr_id]))
+    for path, ids in collisions.items():
+        print("WARNING: Hashed path {} is shared by layer ids {}".format(path, ", ".join(ids)))
+
+    if metadata_repo is not None:
+        # ONE makedirs PER LEAF DIRECTORY CREATES ITS PARENTS TOO. PATHS WERE ALREADY DEDUPLICATED ABOVE
+        for path in by_path:
+            os.makedirs(os.path.join(metadata_repo, path), exist_ok=True)
+
+    return paths, {"collisions": collisions, "resalted": resalted}
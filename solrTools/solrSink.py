@@ -0,0 +1,152 @@
+# BUFFERED SOLR INDEXING OF GEOBLACKLIGHT DOCUMENTS. DOCUMENTS ARE COLLECTED AND SENT AS JSON ARRAYS IN BATCHES OVER ONE
+#  SHARED requests.Session (KEEP-ALIVE CONNECTIONS) TO THE update HANDLER OF THE COLLECTION. INSTEAD OF A HARD COMMIT PER
+#  DOCUMENT, SOLR IS ASKED TO COMMIT WITHIN commit_within MILLISECONDS AND/OR ONCE WHEN THE SINK IS CLOSED. A BATCH
+#  THAT STILL FAILS AFTER ITS RETRIES ISN'T DROPPED: ITS DOCUMENTS ARE KEPT IN failed, APPENDED TO failed_path (ONE JSON
+#  DOCUMENT PER LINE, TO BE RESENT LATER) IF ONE IS GIVEN, AND LISTED IN THE REPORT PRINTED ON close.
+#
+# E.G.
+#   with SolrSink("http://localhost:8983/solr/collection1", batch_size=500) as sink:
+#       for doc in docs:
+#           sink.add(doc)
+
+import json, threading, time
+import requests
+
+
+def docId(doc):
+    # IDENTIFIER OF A GEOBLACKLIGHT DOCUMENT FOR MESSAGES
+    return doc.get("layer_id_s") or doc.get("layer_slug_s") or doc.get("dc_identifier_s")
+
+
+class SolrSink(object):
+
+    def __init__(self, solr_loc, batch_size=500, commit_within=10000, final_commit=True, retries=5, backoff=1.0,
+                 timeout=60, session=None, failed_path=None):
+        """solr_loc is the url of the Solr collection, e.g. http://localhost:8983/solr/collection1
+
+        batch_size      number of documents sent per update request
+        commit_within   milliseconds Solr may wait before committing each batch. None to leave commits to
+                        final_commit (or the server's autoCommit settings)
+        final_commit    send a single hard commit when the sink is closed
+        retries         number of times a failed batch is resent before giving up
+        backoff         seconds to wait before the first retry. Doubled on every following retry
+        timeout         seconds to wait for Solr to answer a request
+        failed_path     file the documents of batches that failed after all retries are appended to"""
+        self.update_url = solr_loc.rstrip("/") + "/update"
+        self.batch_size = batch_size
+        self.commit_within = commit_within
+        self.final_commit = final_commit
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
+        self.session.headers.update({"content-type": "application/json"})
+
+        self.failed_path = failed_path
+        self.failed = []
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.docs_sent = 0
+        self.batches_sent = 0
+        self.retries_used = 0
+        self.request_time = 0.0
+        self.start_time = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, doc):
+        # THREAD SAFE. THE BATCH IS SENT BY WHICHEVER CALLER FILLS THE BUFFER
+        with self.lock:
+            self.buffer.append(doc)
+            if len(self.buffer) < self.batch_size:
+                return
+            batch = self.buffer
+            self.buffer = []
+        self.sendBatch(batch)
+
+    def flush(self):
+        with self.lock:
+            batch = self.buffer
+            self.buffer = []
+        if len(batch) > 0:
+            self.sendBatch(batch)
+
+    def commit(self):
+        self.post({}, json.dumps({"commit": {}}))
+
+    def close(self):
+        try:
+            self.flush()
+            if self.final_commit and self.batches_sent > 0:
+                self.commit()
+        finally:
+            self.report()
+            self.session.close()
+
+    def sendBatch(self, batch):
+        params = {}
+        if self.commit_within is not None:
+            params["commitWithin"] = self.commit_within
+        print("Pushing {} records to Solr at {} ...".format(len(batch), self.update_url))
+        try:
+            self.post(params, json.dumps(batch, sort_keys=False))
+        except IOError:
+            self.keepFailed(batch)
+            return
+        with self.lock:
+            self.docs_sent += len(batch)
+            self.batches_sent += 1
+
+    def keepFailed(self, batch):
+        # THE BATCH WON'T BE SENT. KEEP ITS DOCUMENTS AND SAY WHICH THEY ARE
+        with self.lock:
+            self.failed.extend(batch)
+            if self.failed_path is not None:
+                with open(self.failed_path, "a", encoding="utf8") as ffile:
+                    for doc in batch:
+                        ffile.write(json.dumps(doc, sort_keys=False) + "\n")
+        print("ERROR: {} records not sent to Solr{}: {}".format(
+            len(batch), " (written to {})".format(self.failed_path) if self.failed_path is not None else "",
+            ", ".join(str(docId(doc)) for doc in batch)))
+
+    def post(self, params, data):
+        # RETRY CONNECTION ERRORS AND SERVER SIDE (5XX, 429) ERRORS WITH EXPONENTIAL BACKOFF. OTHER 4XX RESPONSES MEAN
+        #  SOLR REJECTED THE DOCUMENTS, SO RESENDING WON'T HELP
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                r = self.session.post(self.update_url, params=params, data=data, timeout=self.timeout)
+                error = None if r.status_code < 400 else "HTTP {}: {}".format(r.status_code, r.text[:500])
+                retryable = r.status_code >= 500 or r.status_code == 429
+            except requests.RequestException as e:
+                error = str(e)
+                retryable = True
+            with self.lock:
+                self.request_time += time.time() - start
+
+            if error is None:
+                return r
+            if not retryable or attempt >= self.retries:
+                print("ERROR: Solr update failed after {} attempts. {}".format(attempt + 1, error))
+                raise IOError(error)
+
+            wait = self.backoff * (2 ** attempt)
+            print("WARNING: Solr update failed ({}). Retrying in {}s".format(error, wait))
+            time.sleep(wait)
+            attempt += 1
+            with self.lock:
+                self.retries_used += 1
+
+    def report(self):
+        elapsed = time.time() - self.start_time
+        rate = self.docs_sent / elapsed if elapsed > 0 else 0
+        print("SOLR: {} records in {} batches ({} retries). {:.1f}s in requests, {:.1f}s total ({:.2f} records/s)"
+              .format(self.docs_sent, self.batches_sent, self.retries_used, self.request_time, elapsed, rate))
+        if self.failed:
+            print("ERROR: {} records failed to be sent to Solr{}".format(
+                len(self.failed), " and are in {}".format(self.failed_path) if self.failed_path is not None else ""))
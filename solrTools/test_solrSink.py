@@ -0,0 +1,132 @@
+# TESTS OF solrSink.py AGAINST A LOCAL http.server STANDING IN FOR SOLR. RUN WITH python -m pytest solrTools OR
+#  python -m unittest FROM solrTools
+
+import json, os, shutil, tempfile, threading, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import solrSink
+from solrSink import SolrSink
+
+
+class FakeSolr(ThreadingHTTPServer):
+    # RECORDS EVERY UPDATE REQUEST AS (QUERY PARAMETERS, JSON BODY). statuses ARE ANSWERED IN ORDER, THEN 200
+    daemon_threads = True
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), FakeSolrHandler)
+        self.requests = []
+        self.statuses = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/solr/collection1".format(self.server_address[1])
+
+
+class FakeSolrHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.requests.append((url.path, parse_qs(url.query), json.loads(body)))
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"responseHeader":{"status":0}}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SolrSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeSolr()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        # RECORD THE BACKOFF WAITS INSTEAD OF SLEEPING
+        self.sleeps = []
+        sleep = solrSink.time.sleep
+        solrSink.time.sleep = self.sleeps.append
+        self.addCleanup(setattr, solrSink.time, "sleep", sleep)
+
+    def updates(self):
+        return [(params, body) for path, params, body in self.server.requests if isinstance(body, list)]
+
+    def commits(self):
+        return [body for path, params, body in self.server.requests if body == {"commit": {}}]
+
+    def test_batches(self):
+        with SolrSink(self.server.url, batch_size=3, commit_within=5000) as sink:
+            for i in range(8):
+                sink.add({"layer_slug_s": str(i)})
+        updates = self.updates()
+        self.assertEqual([len(body) for params, body in updates], [3, 3, 2])
+        self.assertEqual([doc["layer_slug_s"] for params, body in updates for doc in body], [str(i) for i in range(8)])
+        self.assertTrue(all(path == "/solr/collection1/update" for path, params, body in self.server.requests))
+        self.assertEqual(sink.docs_sent, 8)
+        self.assertEqual(sink.batches_sent, 3)
+
+    def test_commit_within_on_every_update(self):
+        with SolrSink(self.server.url, batch_size=2, commit_within=5000) as sink:
+            for i in range(5):
+                sink.add({"layer_slug_s": str(i)})
+        self.assertEqual([params.get("commitWithin") for params, body in self.updates()], [["5000"]] * 3)
+
+    def test_one_commit_on_close(self):
+        sink = SolrSink(self.server.url, batch_size=2)
+        for i in range(5):
+            sink.add({"layer_slug_s": str(i)})
+        self.assertEqual(self.commits(), [])
+        sink.close()
+        self.assertEqual(len(self.commits()), 1)
+        self.assertEqual(self.server.requests[-1][2], {"commit": {}})
+
+    def test_retries_busy_server_with_backoff(self):
+        self.server.statuses = [429, 503, 503]
+        with SolrSink(self.server.url, batch_size=2, retries=5, backoff=0.5) as sink:
+            sink.add({"layer_slug_s": "0"})
+            sink.add({"layer_slug_s": "1"})
+        self.assertEqual(self.sleeps, [0.5, 1.0, 2.0])
+        self.assertEqual(sink.retries_used, 3)
+        self.assertEqual(len(self.updates()), 4)
+        self.assertEqual(sink.docs_sent, 2)
+
+    def test_gives_up_after_retries(self):
+        self.server.statuses = [503] * 3
+        sink = SolrSink(self.server.url, batch_size=1, retries=2, backoff=0.5)
+        sink.add({"layer_slug_s": "0"})
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+        self.assertEqual(len(self.updates()), 3)
+        self.assertEqual(sink.failed, [{"layer_slug_s": "0"}])
+
+    def test_rejected_documents_are_not_retried(self):
+        self.server.statuses = [400]
+        sink = SolrSink(self.server.url, batch_size=1, retries=5, backoff=0.5)
+        sink.add({"layer_slug_s": "0"})
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(len(self.updates()), 1)
+        self.assertEqual(sink.docs_sent, 0)
+        self.assertEqual(sink.failed, [{"layer_slug_s": "0"}])
+
+    def test_failed_batches_are_kept(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        failed_path = os.path.join(tmpdir, "failed.jsonl")
+        self.server.statuses = [200, 400]
+        with SolrSink(self.server.url, batch_size=2, failed_path=failed_path) as sink:
+            for i in range(5):
+                sink.add({"layer_slug_s": str(i)})
+        # THE SECOND BATCH WAS REJECTED, THE OTHERS SENT AND COMMITTED
+        self.assertEqual(sink.docs_sent, 3)
+        self.assertEqual(len(self.commits()), 1)
+        with open(failed_path) as ifile:
+            self.assertEqual([json.loads(line) for line in ifile], [{"layer_slug_s": "2"}, {"layer_slug_s": "3"}])
+
+
+if __name__ == "__main__":
+    unittest.main()